@@ -3,6 +3,7 @@
 namespace App\Http\Controllers;
 
 use Illuminate\Http\Request;
+use Illuminate\Support\Facades\Http;
 use App\Models\Patient;
 use App\Models\User;
 use Carbon\Carbon;
@@ -193,6 +194,7 @@ public function update(UpdatePatientRequest $request, $id)
     $patient->dds_trend_1_3 = ($dds1 !== null && $dds3 !== null) ? ($dds3 - $dds1) : null;
 
     $patient->save();
+    $this->invalidateRiskCache($patient->id);
 
     return response()->json(['message' => 'Patient updated', 'data' => $patient], 200);
 }
@@ -332,9 +334,21 @@ public function saveRisk(Request $request, $id)
         $patient->reduction_a_2_3 = ($hba1c2 !== null && $hba1c3 !== null) ? ($hba1c2 - $hba1c3) : null;
 
         $patient->save();
+        $this->invalidateRiskCache($patient->id);
 
         return response()->json(['message' => 'Risk saved', 'data' => $patient]);
     }
 
+    // Drop the FastAPI service's cached risk score for this patient (all workers)
+    private function invalidateRiskCache($patientId)
+    {
+        try {
+            $fastApiUrl = env('FASTAPI_URL', 'http://127.0.0.1:5000');
+            Http::timeout(3)->post("$fastApiUrl/cache/invalidate", ['patient_id' => (int) $patientId]);
+        } catch (\Throwable $e) {
+            \Log::warning("Risk cache invalidation failed for patient $patientId: " . $e->getMessage());
+        }
+    }
+
 
 }
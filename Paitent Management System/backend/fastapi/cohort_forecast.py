@@ -0,0 +1,182 @@
+"""HbA1c forecasting for a whole cohort in one pass.
+
+Works on an (n_patients x n_visits) array where missing visits are NaN. Like
+the per-patient code, missing visits are dropped and the remaining ones are
+re-indexed 0..k-1 before fitting.
+
+Two methods:
+
+- "linear": least-squares line, the same as `_forecast_hba1c_simple` in main.py.
+  It is solved in closed form and has no intervals.
+- "arima": the same as `forecast_metric` in therapy_effectiveness_final.py.
+  That uses SARIMAX(1,1,1) with trend "c" when there are at least 3 visits
+  and the linear fit when there are 2.
+
+  With exactly 3 visits, the three states of that model are all initialised
+  as diffuse. Every observation then goes to the likelihood burn-in, so the
+  likelihood is flat and the MLE returns the CSS start parameters unchanged.
+  Those are a zero constant, AR and MA terms, and a variance of
+  sum((d - mean(d))^2) / 3 over the first differences d. The model is
+  therefore a random walk: the forecast is the last value, and the h-step
+  variance is h * sigma2. That is computed here for all rows at once.
+
+  Rows with more than 3 visits still get a per-row statsmodels fit.
+
+`python cohort_forecast.py` checks both methods against the per-patient code
+on a synthetic cohort and prints timings.
+"""
+import time
+import argparse
+import warnings
+from statistics import NormalDist
+from typing import NamedTuple
+
+import numpy as np
+
+
+class CohortForecast(NamedTuple):
+    mean: np.ndarray   # (n_patients, steps)
+    lower: np.ndarray  # NaN where the method gives no interval
+    upper: np.ndarray
+
+
+def pack_observed(H) -> tuple[np.ndarray, np.ndarray]:
+    """Shift each row's observed values to the left (order kept); returns (packed, counts)."""
+    H = np.atleast_2d(np.asarray(H, dtype=float))
+    mask = ~np.isnan(H)
+    order = np.argsort(~mask, axis=1, kind="stable")
+    return np.take_along_axis(H, order, axis=1), mask.sum(axis=1)
+
+
+def linear_forecast(H, steps: int = 2) -> np.ndarray:
+    """Least-squares line through each row's observed visits, extrapolated `steps` ahead.
+
+    Rows with fewer than 2 observed visits are NaN.
+    """
+    H = np.atleast_2d(np.asarray(H, dtype=float))
+    mask = ~np.isnan(H)
+    k = mask.sum(axis=1).astype(float)
+    x = np.where(mask, np.cumsum(mask, axis=1) - 1, 0).astype(float)
+    y = np.where(mask, H, 0.0)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        x_mean = (k - 1.0) / 2.0
+        y_mean = y.sum(axis=1) / k
+        dx = np.where(mask, x - x_mean[:, None], 0.0)
+        slope = (dx * (y - y_mean[:, None])).sum(axis=1) / (dx * dx).sum(axis=1)
+        intercept = y_mean - slope * x_mean
+    future_x = k[:, None] + np.arange(steps, dtype=float)[None, :]
+    out = slope[:, None] * future_x + intercept[:, None]
+    out[k < 2] = np.nan
+    return out
+
+
+def _sarimax_row(values: np.ndarray, steps: int, alpha: float) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """forecast_metric's statsmodels fit for one series (used for rows with > 3 visits)."""
+    from statsmodels.tsa.statespace.sarimax import SARIMAX
+
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        model = SARIMAX(values, order=(1, 1, 1), seasonal_order=(0, 0, 0, 0),
+                        trend="c", enforce_stationarity=False, enforce_invertibility=False)
+        fc = model.fit(disp=False).get_forecast(steps=steps)
+        ci = np.asarray(fc.conf_int(alpha=alpha))
+    return np.asarray(fc.predicted_mean), ci[:, 0], ci[:, 1]
+
+
+def arima_forecast(H, steps: int = 2, alpha: float = 0.05) -> CohortForecast:
+    """Batch equivalent of forecast_metric with (1 - alpha) intervals."""
+    packed, k = pack_observed(H)
+    n = packed.shape[0]
+    mean = linear_forecast(H, steps)
+    lower = np.full((n, steps), np.nan)
+    upper = np.full((n, steps), np.nan)
+
+    three = k == 3
+    if three.any():
+        y = packed[three, :3]
+        d = np.diff(y, axis=1)
+        sigma2 = np.maximum(((d - d.mean(axis=1, keepdims=True)) ** 2).sum(axis=1) / 3.0, 1e-10)
+        half = NormalDist().inv_cdf(1.0 - alpha / 2.0) * np.sqrt(sigma2[:, None] * np.arange(1, steps + 1))
+        last = y[:, -1:]
+        mean[three] = last
+        lower[three] = last - half
+        upper[three] = last + half
+
+    for i in np.flatnonzero(k > 3):
+        mean[i], lower[i], upper[i] = _sarimax_row(packed[i, :k[i]], steps, alpha)
+    return CohortForecast(mean, lower, upper)
+
+
+def forecast_cohort(H, steps: int = 2, method: str = "arima", alpha: float = 0.05) -> CohortForecast:
+    """Forecasts (and intervals where the method has them) for every row of H."""
+    if method == "linear":
+        mean = linear_forecast(H, steps)
+        return CohortForecast(mean, np.full_like(mean, np.nan), np.full_like(mean, np.nan))
+    if method == "arima":
+        return arima_forecast(H, steps, alpha)
+    raise ValueError(f"Unknown forecast method: {method}")
+
+
+def _synthetic_cohort(n: int, n_visits: int = 3, missing: float = 0.1, seed: int = 0) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    H = np.round(rng.normal(8.0, 1.2, (n, 1)) + rng.normal(-0.2, 0.5, (n, n_visits)).cumsum(axis=1), 1)
+    H[rng.random(H.shape) < missing] = np.nan
+    return H
+
+
+def parity_check(n: int = 2000, steps: int = 2, seed: int = 0) -> dict:
+    """Max abs difference from the per-patient implementations, plus timings."""
+    H = _synthetic_cohort(n, seed=seed)
+    out = {}
+
+    t = time.perf_counter()
+    batch = forecast_cohort(H, steps, method="arima")
+    out["arima_batch_s"] = time.perf_counter() - t
+    t = time.perf_counter()
+    worst = 0.0
+    for i, row in enumerate(H):
+        # forecast_metric: SARIMAX for >= 3 visits, polyfit for 2 (it raises on a single visit)
+        values = row[~np.isnan(row)]
+        if len(values) < 2:
+            continue
+        if len(values) >= 3:
+            ref = _sarimax_row(values, steps, 0.05)
+        else:
+            a, b = np.polyfit(np.arange(len(values), dtype=float), values, 1)
+            fx = np.arange(len(values), len(values) + steps, dtype=float)
+            ref = (a * fx + b, np.full(steps, np.nan), np.full(steps, np.nan))
+        got = (batch.mean[i], batch.lower[i], batch.upper[i])
+        for r, g in zip(ref, got):
+            assert np.array_equal(np.isnan(r), np.isnan(g)), (i, r, g)
+            worst = max(worst, float(np.nanmax(np.abs(r - g), initial=0.0)))
+    out["arima_per_patient_s"] = time.perf_counter() - t
+    out["arima_max_abs_diff"] = worst
+
+    # _forecast_hba1c_simple
+    linear = linear_forecast(H, steps)
+    worst = 0.0
+    for i, row in enumerate(H):
+        values = row[~np.isnan(row)]
+        if len(values) < 2:
+            assert np.isnan(linear[i]).all()
+            continue
+        a, b = np.polyfit(np.arange(len(values), dtype=float), values, 1)
+        ref = a * np.arange(len(values), len(values) + steps, dtype=float) + b
+        worst = max(worst, float(np.abs(ref - linear[i]).max()))
+    out["linear_max_abs_diff"] = worst
+    out["patients"] = float(n)
+    return out
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Parity check of the cohort forecaster against per-patient fits")
+    parser.add_argument("--patients", type=int, default=2000)
+    parser.add_argument("--steps", type=int, default=2)
+    args = parser.parse_args()
+    result = parity_check(args.patients, args.steps)
+    for k, v in result.items():
+        print(f"{k:>22}: {v:.3g}")
+    tolerance = 1e-8
+    if result["arima_max_abs_diff"] > tolerance or result["linear_max_abs_diff"] > tolerance:
+        raise SystemExit("parity check failed")
+    print("parity OK")
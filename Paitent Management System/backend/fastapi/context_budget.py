@@ -0,0 +1,84 @@
+import re
+import logging
+
+_PIECE_RE = re.compile(r"\w+|[^\w\s]")
+
+try:
+    import tiktoken
+
+    _encoding = tiktoken.get_encoding("cl100k_base")
+except Exception:  # not installed, or no cached BPE file offline
+    _encoding = None
+    logging.info("[Context] tiktoken unavailable, estimating tokens from word pieces")
+
+
+def count_tokens(text: str) -> int:
+    """Local token count: tiktoken cl100k when available, else a word-piece estimate."""
+    if _encoding is not None:
+        return len(_encoding.encode(text, disallowed_special=()))
+    # Words and punctuation marks, plus ~1 extra token per 4 characters of long words
+    return sum(1 + max(0, len(p) - 6) // 4 for p in _PIECE_RE.findall(text))
+
+
+def _overlap(a: list[str], b: list[str], max_words: int) -> int:
+    """Length of the longest suffix of `a` that is a prefix of `b`."""
+    for k in range(min(len(a), len(b), max_words), 0, -1):
+        if a[-k:] == b[:k]:
+            return k
+    return 0
+
+
+def _shingles(words: list[str], n: int = 5) -> set:
+    return {tuple(words[i:i + n]) for i in range(max(1, len(words) - n + 1))}
+
+
+def _truncate_to_tokens(words: list[str], budget: int) -> list[str]:
+    lo, hi = 0, len(words)
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if count_tokens(" ".join(words[:mid])) <= budget:
+            lo = mid
+        else:
+            hi = mid - 1
+    return words[:lo]
+
+
+def assemble_context(matches, budget_tokens: int, max_overlap: int = 80,
+                     near_dup: float = 0.8, min_tokens: int = 40) -> list[str]:
+    """Pick chunk texts for the prompt from (id, score, text) matches.
+
+    Chunks are taken best score first. Text a kept chunk already contains is
+    removed: the overlap window chunk_text() repeats between neighbours and
+    near-duplicates (word 5-gram Jaccard >= `near_dup`). Chunks are added until
+    `budget_tokens` is spent; the last one is truncated if at least `min_tokens`
+    still fit.
+    """
+    ranked = sorted(matches, key=lambda m: (m[1] is None, -(m[1] or 0.0)))
+    kept: list[list[str]] = []
+    kept_shingles: list[set] = []
+    remaining = budget_tokens
+    for _, _, text in ranked:
+        words = text.split()
+        for prev in kept:
+            # Neighbouring chunks share up to `overlap` words at either end
+            words = words[_overlap(prev, words, max_overlap):]
+            cut = _overlap(words, prev, max_overlap)
+            if cut:
+                words = words[:-cut]
+        if not words:
+            continue
+        shingles = _shingles(words)
+        if any(len(shingles & s) / len(shingles | s) >= near_dup for s in kept_shingles):
+            continue
+        tokens = count_tokens(" ".join(words))
+        if tokens > remaining:
+            if remaining < min_tokens:
+                break
+            words = _truncate_to_tokens(words, remaining)
+            tokens = count_tokens(" ".join(words))
+        kept.append(words)
+        kept_shingles.append(shingles)
+        remaining -= tokens
+        if remaining <= 0:
+            break
+    return [" ".join(w) for w in kept]
@@ -0,0 +1,189 @@
+import os
+import time
+import queue
+import logging
+import threading
+from contextlib import contextmanager
+
+import mysql.connector
+from mysql.connector import Error
+
+
+class MySQLPool:
+    """Small thread-safe pool of mysql.connector connections.
+
+    Connections are validated on checkout (ping), recycled once they are older
+    than ``recycle`` seconds, and opened lazily up to ``size``.
+    """
+
+    def __init__(self, size: int = 5, recycle: float = 1800.0, timeout: float = 5.0, **conn_kwargs):
+        self.size = max(1, int(size))
+        self.recycle = float(recycle)
+        self.timeout = float(timeout)
+        self._conn_kwargs = conn_kwargs
+        self._idle: queue.LifoQueue = queue.LifoQueue(maxsize=self.size)
+        self._lock = threading.Lock()
+        self._opened = 0
+        self._in_use = 0
+        self._stats = {
+            "checkouts": 0,
+            "connects": 0,
+            "recycled": 0,
+            "failed_health_checks": 0,
+            "waits": 0,
+            "timeouts": 0,
+        }
+
+    # -- internals --
+    def _connect(self):
+        conn = mysql.connector.connect(**self._conn_kwargs)
+        conn._pool_created_at = time.monotonic()
+        with self._lock:
+            self._stats["connects"] += 1
+        return conn
+
+    def _discard(self, conn) -> None:
+        try:
+            conn.close()
+        except Exception:
+            pass
+        with self._lock:
+            self._opened -= 1
+
+    def _healthy(self, conn) -> bool:
+        if time.monotonic() - getattr(conn, "_pool_created_at", 0.0) > self.recycle:
+            with self._lock:
+                self._stats["recycled"] += 1
+            return False
+        try:
+            conn.ping(reconnect=False)
+            return True
+        except Exception:
+            with self._lock:
+                self._stats["failed_health_checks"] += 1
+            return False
+
+    def _acquire(self):
+        deadline = time.monotonic() + self.timeout
+        waited = False
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                conn = None
+            if conn is not None:
+                if self._healthy(conn):
+                    return conn
+                self._discard(conn)
+                continue
+
+            with self._lock:
+                can_open = self._opened < self.size
+                if can_open:
+                    self._opened += 1
+            if can_open:
+                try:
+                    return self._connect()
+                except Exception:
+                    with self._lock:
+                        self._opened -= 1
+                    raise
+
+            if not waited:
+                waited = True
+                with self._lock:
+                    self._stats["waits"] += 1
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                with self._lock:
+                    self._stats["timeouts"] += 1
+                raise TimeoutError("MySQL pool exhausted")
+            try:
+                conn = self._idle.get(timeout=min(remaining, 0.05))
+            except queue.Empty:
+                # Re-check capacity: a broken connection may have been discarded
+                continue
+            if self._healthy(conn):
+                return conn
+            self._discard(conn)
+
+    def _release(self, conn, broken: bool = False) -> None:
+        if broken:
+            self._discard(conn)
+            return
+        try:
+            # Drop any open transaction/unread results before reuse
+            conn.rollback()
+        except Exception:
+            self._discard(conn)
+            return
+        try:
+            self._idle.put_nowait(conn)
+        except queue.Full:
+            self._discard(conn)
+
+    # -- public API --
+    @contextmanager
+    def connection(self):
+        """Check out a healthy connection; it is returned to the pool on exit."""
+        conn = self._acquire()
+        with self._lock:
+            self._in_use += 1
+            self._stats["checkouts"] += 1
+        broken = False
+        try:
+            yield conn
+        except Error:
+            broken = True
+            raise
+        finally:
+            with self._lock:
+                self._in_use -= 1
+            self._release(conn, broken=broken)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "size": self.size,
+                "open": self._opened,
+                "in_use": self._in_use,
+                "idle": self._idle.qsize(),
+                **self._stats,
+            }
+
+    def close(self) -> None:
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            self._discard(conn)
+
+
+_pool: MySQLPool | None = None
+_pool_lock = threading.Lock()
+
+
+def get_mysql_pool() -> MySQLPool:
+    """Process-wide pool for the Laravel MySQL database (configured via env)."""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = MySQLPool(
+                    size=int(os.getenv("MYSQL_POOL_SIZE", "5")),
+                    recycle=float(os.getenv("MYSQL_POOL_RECYCLE", "1800")),
+                    timeout=float(os.getenv("MYSQL_POOL_TIMEOUT", "5")),
+                    host=os.getenv("DB_HOST", "localhost"),
+                    port=int(os.getenv("DB_PORT", "3306")),
+                    user=os.getenv("DB_USERNAME", "root"),
+                    password=os.getenv("DB_PASSWORD", ""),
+                    database=os.getenv("DB_DATABASE", "laravel"),
+                )
+                logging.info(f"[MySQL] pool initialised (size={_pool.size}, recycle={_pool.recycle}s)")
+    return _pool
+
+
+def close_mysql_pool() -> None:
+    if _pool is not None:
+        _pool.close()
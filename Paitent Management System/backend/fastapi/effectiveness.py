@@ -0,0 +1,93 @@
+"""Therapy effectiveness score, computed column-wise for any number of patients.
+
+Shared by the FastAPI service and "Therapy Effectiveness Model/therapy_effectiveness_final.py".
+Each component is the relative improvement from baseline to follow-up, clipped to
+[-1, 1]; a missing value or a zero baseline is neutral (0). The weighted sum is
+mapped to a score in [0, 1], and a score >= 0.5 is "Effective".
+
+Inputs use the training column names (FPG is the deployment schema's FVG).
+"""
+from typing import Mapping, NamedTuple
+
+import numpy as np
+import pandas as pd
+
+EFFECTIVENESS_WEIGHTS = {"HbA1c":0.30,"FPG":0.20,"BMI":0.10,"SBP":0.05,"DBP":0.05,"eGFR":0.10,"UACR":0.10,"Distress":0.10}
+
+# component: (baseline column, follow-up column, better direction)
+EFFECTIVENESS_COMPONENTS = {
+    "HbA1c":    ("HbA1c1", "HbA1c3", "down"),
+    "FPG":      ("FPG1",   "FPG3",   "down"),
+    "BMI":      ("BMI1",   "BMI3",   "down"),
+    "SBP":      ("SBP",    "SBP",    "down"),  # single
+    "DBP":      ("DBP",    "DBP",    "down"),  # single
+    "eGFR":     ("eGFR1",  "eGFR3",  "up"),
+    "UACR":     ("UACR1",  "UACR3",  "down"),
+    "Distress": ("DDS1",   "DDS3",   "down"),
+}
+
+
+class EffectivenessScores(NamedTuple):
+    score: np.ndarray                  # (n,)
+    components: dict[str, np.ndarray]  # component -> (n,)
+
+    @property
+    def labels(self) -> np.ndarray:
+        return np.where(self.score >= 0.5, "Effective", "Not Effective")
+
+
+def _column(columns: Mapping, name: str, n: int) -> np.ndarray:
+    if name not in columns:
+        return np.full(n, np.nan)
+    values = columns[name]
+    try:
+        return np.asarray(values, dtype=float).reshape(-1)  # None -> NaN
+    except (TypeError, ValueError):
+        # Stray strings become NaN and so count as neutral, like the per-row version
+        return pd.to_numeric(pd.Series(np.asarray(values, dtype=object).reshape(-1)), errors="coerce").to_numpy(dtype=float)
+
+
+def improvement_ratio(baseline, followup, direction: str) -> np.ndarray:
+    """Clipped relative improvement; NaN or zero baseline -> neutral 0"""
+    b = np.asarray(baseline, dtype=float)
+    f = np.asarray(followup, dtype=float)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        change = f - b
+        if direction == "down":
+            change = -change
+        ratio = np.clip(change / np.abs(b), -1.0, 1.0)
+    return np.where(np.isnan(b) | np.isnan(f) | (b == 0), 0.0, ratio)
+
+
+def score_effectiveness(columns: Mapping) -> EffectivenessScores:
+    """Score N patients from aligned columns (a DataFrame or a dict of arrays/lists)."""
+    n = len(columns) if isinstance(columns, pd.DataFrame) else max(
+        (np.size(v) for v in columns.values()), default=0)
+    comps = {
+        name: improvement_ratio(_column(columns, base, n), _column(columns, follow, n), direction)
+        for name, (base, follow, direction) in EFFECTIVENESS_COMPONENTS.items()
+    }
+    raw = sum(w * comps[k] for k, w in EFFECTIVENESS_WEIGHTS.items())
+    return EffectivenessScores(np.clip((raw + 1.0) / 2.0, 0.0, 1.0), comps)
+
+
+def effectiveness_records(columns: Mapping) -> list[dict]:
+    """Per-patient {"score", "label", "components"} dicts, the API / script format."""
+    res = score_effectiveness(columns)
+    labels = res.labels
+    comps = {k: v.tolist() for k, v in res.components.items()}
+    return [
+        {"score": score, "label": str(labels[i]), "components": {k: v[i] for k, v in comps.items()}}
+        for i, score in enumerate(res.score.tolist())
+    ]
+
+
+def effectiveness_frame(columns: Mapping, index=None) -> pd.DataFrame:
+    """Columnar result for cohort reports: score, label and component_<name> columns."""
+    res = score_effectiveness(columns)
+    if index is None and isinstance(columns, pd.DataFrame):
+        index = columns.index
+    out = pd.DataFrame({"effectiveness_score": res.score, "effectiveness_label": res.labels}, index=index)
+    for k, v in res.components.items():
+        out[f"component_{k}"] = v
+    return out
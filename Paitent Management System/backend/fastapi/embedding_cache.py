@@ -0,0 +1,216 @@
+import os
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+import unicodedata
+
+import numpy as np
+
+
+def normalize_text(text: str) -> str:
+    return " ".join(unicodedata.normalize("NFC", text).split())
+
+
+def embedding_key(model: str, text: str) -> str:
+    """Content address of an embedding: hash(model, normalized text)."""
+    return hashlib.sha256(f"{model}\0{normalize_text(text)}".encode()).hexdigest()
+
+
+def _fingerprint(key: str) -> int:
+    return int(key[:16], 16) or 1  # 0 marks an empty or half-written slot
+
+
+class EmbeddingCache:
+    """Persistent LRU cache of float32 embeddings for one model, shared by all
+    worker processes that open the same directory.
+
+    Vectors live in a fixed-capacity memory-mapped matrix (`vectors.f32`). The
+    SQLite index is the only record of which key owns which slot: slots are
+    allocated and evicted inside a `BEGIN IMMEDIATE` transaction, and vectors are
+    written while it is held. Each slot also carries a 64-bit fingerprint of its
+    key (`keys.u64`, cleared before a vector is overwritten), and reads only
+    accept a vector when the fingerprint matches before and after the copy.
+    Files for each dim/capacity live in their own subdirectory, so they are
+    never truncated while another worker has them open.
+    """
+
+    def __init__(self, directory: str, model: str, dim: int, capacity: int = 20000):
+        self.model = model
+        self.dim = int(dim)
+        self.capacity = max(1, int(capacity))
+        directory = os.path.join(directory, f"{self.dim}x{self.capacity}")
+        os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "evictions": 0, "stale_reads": 0}
+
+        self._db = sqlite3.connect(os.path.join(directory, "index.sqlite"), check_same_thread=False,
+                                   isolation_level=None, timeout=30)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS embedding_index (key TEXT PRIMARY KEY, slot INTEGER UNIQUE NOT NULL, last_used REAL NOT NULL)"
+        )
+        self._db.execute("BEGIN IMMEDIATE")
+        try:
+            # Files are only ever grown, under the write lock, never recreated
+            self.vectors = self._map(os.path.join(directory, "vectors.f32"), np.float32, (self.capacity, self.dim))
+            self.fingerprints = self._map(os.path.join(directory, "keys.u64"), np.uint64, (self.capacity,))
+            self._db.execute("COMMIT")
+        except BaseException:
+            self._db.execute("ROLLBACK")
+            raise
+        self._touched: set[str] = set()
+
+    @staticmethod
+    def _map(path: str, dtype, shape) -> np.memmap:
+        size = int(np.prod(shape)) * np.dtype(dtype).itemsize
+        with open(path, "ab") as fh:
+            if fh.tell() < size:
+                fh.truncate(size)
+        return np.memmap(path, dtype=dtype, mode="r+", shape=shape)
+
+    def get_many(self, texts: list[str]) -> list[np.ndarray | None]:
+        """Batched lookup; returns a copy of each cached vector or None."""
+        keys = [embedding_key(self.model, t) for t in texts]
+        out: list[np.ndarray | None] = []
+        with self._lock:
+            unique = list(set(keys))
+            slots = {}
+            for i in range(0, len(unique), 500):
+                part = unique[i:i + 500]
+                slots.update(self._db.execute(
+                    f"SELECT key, slot FROM embedding_index WHERE key IN ({','.join('?' * len(part))})", part
+                ).fetchall())
+            for key in keys:
+                slot = slots.get(key)
+                vec = None
+                if slot is not None:
+                    fp = np.uint64(_fingerprint(key))
+                    if self.fingerprints[slot] == fp:
+                        vec = np.array(self.vectors[slot])
+                        if self.fingerprints[slot] != fp:
+                            vec = None  # overwritten by another worker while copying
+                    if vec is None:
+                        self._stats["stale_reads"] += 1
+                if vec is None:
+                    self._stats["misses"] += 1
+                else:
+                    self._stats["hits"] += 1
+                    self._touched.add(key)
+                out.append(vec)
+            if len(self._touched) >= 256:
+                self._flush_recency(time.time())
+        return out
+
+    def _allocate(self, key: str, now: float) -> int:
+        """Slot for `key` (caller holds the write transaction)."""
+        row = self._db.execute("SELECT slot FROM embedding_index WHERE key = ?", (key,)).fetchone()
+        if row is not None:
+            self._db.execute("UPDATE embedding_index SET last_used = ? WHERE key = ?", (now, key))
+            return row[0]
+        count, max_slot = self._db.execute("SELECT COUNT(*), MAX(slot) FROM embedding_index").fetchone()
+        if count < self.capacity:
+            if max_slot is None or max_slot + 1 < self.capacity:
+                slot = 0 if max_slot is None else max_slot + 1
+            else:
+                # Holes left by deleted rows
+                slot = self._db.execute(
+                    "SELECT s.slot + 1 FROM embedding_index s WHERE s.slot + 1 < ? AND NOT EXISTS "
+                    "(SELECT 1 FROM embedding_index t WHERE t.slot = s.slot + 1) LIMIT 1", (self.capacity,)
+                ).fetchone()
+                slot = slot[0] if slot is not None else 0
+        else:
+            evicted, slot = self._db.execute(
+                "SELECT key, slot FROM embedding_index ORDER BY last_used LIMIT 1"
+            ).fetchone()
+            self._db.execute("DELETE FROM embedding_index WHERE key = ?", (evicted,))
+            self._stats["evictions"] += 1
+        self._db.execute("INSERT INTO embedding_index (key, slot, last_used) VALUES (?, ?, ?)", (key, slot, now))
+        return slot
+
+    def put_many(self, texts: list[str], vectors) -> None:
+        items = []
+        for text, vec in zip(texts, vectors):
+            vec = np.asarray(vec, dtype=np.float32)
+            if vec.shape != (self.dim,):
+                raise ValueError(f"Expected {self.dim}-d embedding for {self.model}, got {vec.shape}")
+            items.append((embedding_key(self.model, text), vec))
+        now = time.time()
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                for key, vec in items:
+                    slot = self._allocate(key, now)
+                    self.fingerprints[slot] = 0
+                    self.vectors[slot] = vec
+                    self.fingerprints[slot] = _fingerprint(key)
+                self.vectors.flush()
+                self.fingerprints.flush()
+                self._db.execute("COMMIT")
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+            self._flush_recency(now)
+
+    def _flush_recency(self, now: float) -> None:
+        if self._touched:
+            self._db.executemany(
+                "UPDATE embedding_index SET last_used = ? WHERE key = ?", [(now, k) for k in self._touched]
+            )
+            self._touched.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            s = dict(self._stats)
+            s["size"] = self._db.execute("SELECT COUNT(*) FROM embedding_index").fetchone()[0]
+        lookups = s["hits"] + s["misses"]
+        s["hit_rate"] = (s["hits"] / lookups) if lookups else 0.0
+        s["capacity"] = self.capacity
+        s["model"] = self.model
+        return s
+
+    def close(self) -> None:
+        with self._lock:
+            self._flush_recency(time.time())
+            self.vectors.flush()
+            self.fingerprints.flush()
+            self._db.close()
+
+
+_caches: dict[str, EmbeddingCache] = {}
+_caches_lock = threading.Lock()
+
+
+def get_embedding_cache(model: str, dim: int) -> EmbeddingCache | None:
+    """Process-wide cache per embedding model (EMBEDDING_CACHE=0 disables it)."""
+    if os.getenv("EMBEDDING_CACHE", "1") == "0":
+        return None
+    cache = _caches.get(model)
+    if cache is None:
+        with _caches_lock:
+            cache = _caches.get(model)
+            if cache is None:
+                base = os.getenv(
+                    "EMBEDDING_CACHE_DIR",
+                    os.path.join(os.path.dirname(os.path.abspath(__file__)), "embedding_cache"),
+                )
+                try:
+                    cache = EmbeddingCache(
+                        os.path.join(base, model.replace("/", "__")), model, dim,
+                        capacity=int(os.getenv("EMBEDDING_CACHE_CAPACITY", "20000")),
+                    )
+                except (OSError, sqlite3.Error) as e:
+                    logging.warning(f"[Embeddings] cache unavailable for {model}: {e}")
+                    return None
+                _caches[model] = cache
+    return cache
+
+
+def embedding_cache_stats() -> list[dict]:
+    return [c.stats() for c in list(_caches.values())]
+
+
+def close_embedding_caches() -> None:
+    for c in list(_caches.values()):
+        c.close()
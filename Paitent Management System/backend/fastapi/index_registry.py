@@ -0,0 +1,111 @@
+"""Registry of retrieval indexes and concurrent multi-index search.
+
+Each index is described by the model its vectors came from (an ingest-style
+spec such as `openai:text-embedding-3-small` or `st:BAAI/bge-large-en`), its
+dimension and optionally its backend (`pinecone` or `local`; RETRIEVER_BACKEND
+otherwise). A query is embedded once per distinct model, every enabled index is
+searched in parallel, and whatever has answered by the deadline is merged on
+per-index normalised scores.
+
+Extra or overriding entries can be supplied as a JSON object in the file named
+by RAG_INDEX_REGISTRY; RAG_INDEXES lists the indexes to search.
+"""
+import os
+import json
+import time
+import logging
+from concurrent.futures import ThreadPoolExecutor, wait
+
+DEFAULT_REGISTRY = {
+    # Service index (Pinecone, OpenAI embeddings)
+    "medicalbooks-1536": {"embedder": "openai:text-embedding-3-small", "dim": 1536},
+    # Index built by the RAG notebooks
+    "medicalbooks": {"embedder": "st:BAAI/bge-large-en", "dim": 1024},
+}
+
+
+def load_registry() -> dict[str, dict]:
+    registry = {name: dict(entry) for name, entry in DEFAULT_REGISTRY.items()}
+    path = os.getenv("RAG_INDEX_REGISTRY")
+    if path:
+        with open(path) as fh:
+            for name, entry in json.load(fh).items():
+                registry.setdefault(name, {}).update(entry)
+    return registry
+
+
+def enabled_indexes() -> list[str]:
+    default = os.getenv("LOCAL_INDEX_NAME", "medicalbooks-1536")
+    return [n.strip() for n in os.getenv("RAG_INDEXES", default).split(",") if n.strip()]
+
+
+def normalize_scores(matches: list[tuple]) -> list[tuple]:
+    """Min-max scale one index's scores to [0, 1] so indexes with different models compare."""
+    if not matches:
+        return []
+    scores = [m[1] or 0.0 for m in matches]
+    lo, hi = min(scores), max(scores)
+    span = hi - lo
+    return [(m[0], (s - lo) / span if span > 0 else 1.0, m[2]) for m, s in zip(matches, scores)]
+
+
+def merge_results(per_index: dict[str, list[tuple]], top_k: int) -> list[tuple]:
+    """Merge (id, score, text) lists from several indexes; ids are qualified as `index:id`."""
+    if len(per_index) == 1:
+        return next(iter(per_index.values()))[:top_k]
+    merged: dict[str, tuple] = {}
+    for name, matches in per_index.items():
+        for chunk_id, score, text in normalize_scores(matches):
+            # The same passage can live in several corpora; keep its best score
+            key = " ".join(text.split())
+            if key not in merged or score > merged[key][1]:
+                merged[key] = (f"{name}:{chunk_id}", score, text)
+    return sorted(merged.values(), key=lambda m: m[1], reverse=True)[:top_k]
+
+
+class IndexFanOut:
+    """Embeds once per distinct model and queries every index concurrently."""
+
+    def __init__(self, max_workers: int = 8):
+        # Separate pools so index queries waiting on an embedding cannot starve it
+        self._embed_pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="rag-embed")
+        self._query_pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="rag-query")
+        self._stats = {"searches": 0, "deadline_misses": 0, "index_errors": 0}
+
+    def search(self, query: str, indexes: dict[str, dict], embed, query_index, top_k: int,
+               deadline_s: float, known_vectors: dict | None = None) -> list[tuple]:
+        """`embed(spec, text) -> vector`; `query_index(name, entry, vector, top_k) -> [(id, score, text)]`."""
+        started = time.monotonic()
+        self._stats["searches"] += 1
+        known_vectors = known_vectors or {}
+        embeddings = {}
+        for entry in indexes.values():
+            spec = entry["embedder"]
+            if spec not in embeddings and spec not in known_vectors:
+                embeddings[spec] = self._embed_pool.submit(embed, spec, query)
+
+        def run(name, entry):
+            spec = entry["embedder"]
+            vector = known_vectors[spec] if spec in known_vectors else embeddings[spec].result()
+            return query_index(name, entry, vector, top_k)
+
+        futures = {self._query_pool.submit(run, name, entry): name for name, entry in indexes.items()}
+        done, pending = wait(futures, timeout=max(0.0, deadline_s - (time.monotonic() - started)))
+
+        per_index, errors = {}, []
+        for fut in done:
+            try:
+                per_index[futures[fut]] = fut.result()
+            except Exception as e:
+                self._stats["index_errors"] += 1
+                logging.warning(f"[RAG] index {futures[fut]} failed: {e}")
+                errors.append(e)
+        if pending:
+            self._stats["deadline_misses"] += len(pending)
+            logging.warning(f"[RAG] skipped {[futures[f] for f in pending]} after {deadline_s:.2f}s deadline")
+        if errors and not per_index and not pending:
+            raise errors[0]
+        return merge_results(per_index, top_k)
+
+    def stats(self) -> dict:
+        return dict(self._stats)
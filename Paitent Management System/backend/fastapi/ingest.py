@@ -0,0 +1,387 @@
+"""Resumable, parallel ingestion of the RAG book corpus.
+
+Replaces the notebook cells (extract_text_from_pdf -> chunk_text -> embed ->
+100-vector upserts). Pages are extracted in page-range jobs on a process pool
+and streamed through the chunker in order, chunks are embedded in large
+batches and upserted by several concurrent writers in payloads capped at 4 MB.
+
+Progress is checkpointed per document in `<state>/manifest.json`, with the
+embedded chunks staged as `.npz` files, so an interrupted run resumes where it
+stopped and unchanged documents (same content hash) are skipped. Chunks of
+documents whose files were deleted are removed from the index. A BM25 index
+over all chunks is rebuilt at the end for hybrid retrieval.
+
+    python ingest.py books/*.pdf --target pinecone --index medicalbooks-1536
+    python ingest.py books/ --target local --index medicalbooks-1536
+    python ingest.py books/ --embedder st:BAAI/bge-large-en --index medicalbooks
+
+PDF extraction needs PyMuPDF (`pip install pymupdf`).
+"""
+import os
+import re
+import sys
+import json
+import hashlib
+import logging
+import argparse
+import tempfile
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import numpy as np
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+MAX_BYTES = 4 * 1024 * 1024  # 4MB
+PAGES_PER_JOB = 25
+
+
+# ---- Extraction / chunking ----
+def _extract_range(job: tuple[str, int, int]) -> list[str]:
+    """Text of pages [start, end) with the notebook's page markers."""
+    import fitz  # PyMuPDF
+
+    path, start, end = job
+    with fitz.open(path) as doc:
+        return [f"\n--- Page {i+1} ---\n" + doc[i].get_text() for i in range(start, end)]
+
+
+def iter_pages(path: str, pool=None):
+    """Yield page texts in order; PDFs are extracted in page-range jobs on `pool`."""
+    if not path.lower().endswith(".pdf"):
+        with open(path, encoding="utf-8", errors="replace") as fh:
+            yield fh.read()
+        return
+    import fitz  # PyMuPDF
+
+    with fitz.open(path) as doc:
+        n_pages = doc.page_count
+    jobs = [(path, s, min(s + PAGES_PER_JOB, n_pages)) for s in range(0, n_pages, PAGES_PER_JOB)]
+    results = pool.map(_extract_range, jobs) if pool is not None else map(_extract_range, jobs)
+    for pages in results:
+        yield from pages
+
+
+def chunk_text(text, chunk_size=300, overlap=50):
+    words = text.split()
+    chunks = []
+    start = 0
+    while start < len(words):
+        end = start + chunk_size
+        chunk = " ".join(words[start:end])
+        chunks.append(chunk)
+        start += chunk_size - overlap
+    return chunks
+
+
+def iter_chunks(pages, chunk_size=300, overlap=50):
+    """Streaming chunk_text over an iterable of page texts (same output as on the joined text)."""
+    step = chunk_size - overlap
+    buf: list[str] = []
+    for page in pages:
+        buf.extend(page.split())
+        while len(buf) >= chunk_size:
+            yield " ".join(buf[:chunk_size])
+            del buf[:step]
+    while buf:
+        yield " ".join(buf[:chunk_size])
+        del buf[:step]
+
+
+def split_payload(payload_list, encoder_fn, max_bytes=MAX_BYTES):
+    current_batch = []
+    current_size = 0
+    for item in payload_list:
+        encoded = encoder_fn(item)  # e.g., JSON-encoded string or vector
+        size = len(encoded.encode("utf-8"))
+        if current_batch and current_size + size > max_bytes:
+            yield current_batch
+            current_batch = [item]
+            current_size = size
+        else:
+            current_batch.append(item)
+            current_size += size
+    if current_batch:
+        yield current_batch
+
+
+# ---- Embedding ----
+class OpenAIEmbedder:
+    def __init__(self, model: str = "text-embedding-3-small", batch_size: int = 512):
+        import openai
+
+        self.model = model
+        self.batch_size = batch_size
+        self.client = openai.OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+
+    def embed(self, texts: list[str]) -> np.ndarray:
+        out = []
+        for i in range(0, len(texts), self.batch_size):
+            response = self.client.embeddings.create(model=self.model, input=texts[i:i + self.batch_size])
+            out.extend(d.embedding for d in sorted(response.data, key=lambda d: d.index))
+        return np.asarray(out, dtype=np.float32)
+
+
+class SentenceTransformerEmbedder:
+    def __init__(self, model: str = "BAAI/bge-large-en", batch_size: int = 64):
+        from sentence_transformers import SentenceTransformer
+
+        self.model = model
+        self.batch_size = batch_size
+        self.encoder = SentenceTransformer(model)
+
+    def embed(self, texts: list[str]) -> np.ndarray:
+        return np.asarray(self.encoder.encode(texts, batch_size=self.batch_size), dtype=np.float32)
+
+
+def make_embedder(spec: str):
+    """`openai[:model]` or `st:<sentence-transformers model>`"""
+    kind, _, model = spec.partition(":")
+    if kind == "openai":
+        embedder = OpenAIEmbedder(model or "text-embedding-3-small")
+    elif kind == "st":
+        embedder = SentenceTransformerEmbedder(model or "BAAI/bge-large-en")
+    else:
+        raise ValueError(f"Unknown embedder: {spec}")
+    embedder.spec = f"{kind}:{embedder.model}"
+    return embedder
+
+
+# ---- Checkpoint manifest ----
+def file_sha256(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as fh:
+        for block in iter(lambda: fh.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def doc_slug(path: str) -> str:
+    """Readable, unique chunk-id prefix: file stem plus a hash of the full path
+    (books/a/intro.pdf and books/b/intro.pdf must not share chunk ids)."""
+    stem = os.path.splitext(os.path.basename(path))[0]
+    digest = hashlib.sha1(os.path.abspath(path).encode()).hexdigest()[:10]
+    return f"{re.sub(r'[^A-Za-z0-9_.-]+', '_', stem)}-{digest}"
+
+
+def chunk_ids(slug: str, start: int, stop: int) -> list[str]:
+    return [f"{slug}-chunk-{i}" for i in range(start, stop)]
+
+
+class Manifest:
+    """Per-document ingest state, rewritten atomically after every step."""
+
+    def __init__(self, state_dir: str, settings: dict):
+        self.state_dir = state_dir
+        self.path = os.path.join(state_dir, "manifest.json")
+        os.makedirs(os.path.join(state_dir, "staged"), exist_ok=True)
+        data = {}
+        if os.path.exists(self.path):
+            with open(self.path) as fh:
+                data = json.load(fh)
+        if data.get("settings") != settings:
+            # Different embedder/chunking/target: nothing staged so far can be reused
+            if data:
+                logging.info("[Ingest] settings changed, starting over")
+            data = {"settings": settings, "docs": {}}
+        self.data = data
+
+    @property
+    def docs(self) -> dict:
+        return self.data["docs"]
+
+    def staged_path(self, slug: str) -> str:
+        return os.path.join(self.state_dir, "staged", f"{slug}.npz")
+
+    def staged_chunks(self, with_vectors: bool = True) -> tuple[list[str], np.ndarray | None, list[str]]:
+        """Every staged (ids, vectors, texts), in document order."""
+        ids, vectors, texts = [], [], []
+        for slug in sorted(entry["slug"] for entry in self.docs.values()):
+            staged = np.load(self.staged_path(slug))
+            if not staged["ids"].size:
+                continue
+            ids.extend(staged["ids"].tolist())
+            texts.extend(staged["texts"].tolist())
+            if with_vectors:
+                vectors.append(staged["vectors"])
+        return ids, (np.concatenate(vectors) if vectors else None), texts
+
+    def save(self) -> None:
+        fd, tmp = tempfile.mkstemp(dir=self.state_dir, suffix=".tmp")
+        with os.fdopen(fd, "w") as fh:
+            json.dump(self.data, fh, indent=1)
+        os.replace(tmp, self.path)
+
+
+# ---- Sinks ----
+def _build_lexical(index_name: str, ids: list[str], texts: list[str]) -> None:
+    from lexical_index import build_lexical_index, lexical_index_path
+
+    build_lexical_index(lexical_index_path(index_name), ids, texts)
+    logging.info(f"[Ingest] built BM25 index for {index_name} with {len(ids)} chunks")
+
+
+class PineconeSink:
+    def __init__(self, index_name: str, writers: int = 4, batch_size: int = 100):
+        from pinecone import Pinecone
+
+        api_key = os.getenv("PINECONE_API_KEY")
+        if not api_key:
+            raise RuntimeError("PINECONE_API_KEY not set")
+        self.index = Pinecone(api_key=api_key).Index(index_name)
+        self.index_name = index_name
+        self.writers = writers
+        self.batch_size = batch_size
+
+    def write(self, ids: list[str], vectors: np.ndarray, texts: list[str], stale_ids: list[str]) -> None:
+        items = [(i, v.tolist(), {"text": t}) for i, v, t in zip(ids, vectors, texts)]
+        batches = []
+        for payload in split_payload(items, json.dumps):
+            batches.extend(payload[i:i + self.batch_size] for i in range(0, len(payload), self.batch_size))
+        with ThreadPoolExecutor(max_workers=self.writers) as ex:
+            list(ex.map(lambda b: self.index.upsert(vectors=b), batches))
+        self.delete(stale_ids)
+
+    def delete(self, ids: list[str]) -> None:
+        for i in range(0, len(ids), 1000):
+            self.index.delete(ids=ids[i:i + 1000])
+
+    def finish(self, manifest: Manifest) -> None:
+        ids, _, texts = manifest.staged_chunks(with_vectors=False)
+        if ids:
+            _build_lexical(self.index_name, ids, texts)
+
+
+class LocalSink:
+    """Stages everything, then builds the vector_store index once from all documents."""
+
+    def __init__(self, index_name: str, embedding_model: str | None = None):
+        self.index_name = index_name
+        self.embedding_model = embedding_model
+
+    def write(self, ids, vectors, texts, stale_ids) -> None:
+        pass
+
+    def delete(self, ids) -> None:
+        pass  # finish() rebuilds from the staged files, which no longer include them
+
+    def finish(self, manifest: Manifest) -> None:
+        from vector_store import build_index, index_path
+
+        ids, vectors, texts = manifest.staged_chunks()
+        if not ids:
+            return
+        build_index(index_path(self.index_name), ids, vectors, [{"text": t} for t in texts],
+                    source=f"ingest:{manifest.state_dir}", embedding_model=self.embedding_model)
+        logging.info(f"[Ingest] built local index {self.index_name} with {len(ids)} chunks")
+        _build_lexical(self.index_name, ids, texts)
+
+
+# ---- Driver ----
+def _collect(paths: list[str]) -> list[str]:
+    out = []
+    for p in paths:
+        if os.path.isdir(p):
+            out.extend(os.path.join(p, f) for f in sorted(os.listdir(p)) if f.lower().endswith((".pdf", ".txt")))
+        else:
+            out.append(p)
+    return sorted(set(os.path.abspath(p) for p in out))
+
+
+def _remove_missing(sink, manifest: Manifest) -> int:
+    """Delete the chunks of manifest documents whose files no longer exist."""
+    removed = 0
+    for path in [p for p in manifest.docs if not os.path.exists(p)]:
+        entry = manifest.docs.pop(path)
+        sink.delete(chunk_ids(entry["slug"], 0, entry["chunks"]))
+        if not any(e["slug"] == entry["slug"] for e in manifest.docs.values()):
+            try:
+                os.remove(manifest.staged_path(entry["slug"]))
+            except FileNotFoundError:
+                pass
+        manifest.data["needs_build"] = True
+        manifest.save()
+        logging.info(f"[Ingest] {path} is gone, deleted its {entry['chunks']} chunks")
+        removed += 1
+    return removed
+
+
+def ingest(paths: list[str], embedder, sink, manifest: Manifest, pool=None, chunk_size=300, overlap=50) -> dict:
+    summary = {"ingested": 0, "skipped": 0, "removed": _remove_missing(sink, manifest), "chunks": 0, "built": False}
+    for path in _collect(paths):
+        digest = file_sha256(path)
+        entry = manifest.docs.get(path)
+        slug = doc_slug(path)
+        if entry and entry["sha256"] == digest and entry["status"] == "done" and entry["slug"] == slug:
+            summary["skipped"] += 1
+            continue
+        old_count = entry["chunks"] if entry else 0
+        staged_file = manifest.staged_path(slug)
+        if entry and entry["slug"] != slug:
+            # Ingested under a basename-only slug (possibly shared with another file): replace all of it
+            sink.delete(chunk_ids(entry["slug"], 0, old_count))
+            entry, old_count = None, 0
+
+        if entry and entry["sha256"] == digest and entry["status"] == "embedded" and os.path.exists(staged_file):
+            # Crashed between embedding and upsert: reuse the staged vectors
+            staged = np.load(staged_file)
+            ids, vectors, texts = staged["ids"].tolist(), staged["vectors"], staged["texts"].tolist()
+        else:
+            texts = list(iter_chunks(iter_pages(path, pool), chunk_size, overlap))
+            ids = chunk_ids(slug, 0, len(texts))
+            logging.info(f"[Ingest] {os.path.basename(path)}: {len(texts)} chunks, embedding")
+            vectors = embedder.embed(texts) if texts else np.zeros((0, 0), dtype=np.float32)
+            np.savez(staged_file, ids=np.asarray(ids), vectors=vectors, texts=np.asarray(texts))
+            manifest.docs[path] = {"sha256": digest, "slug": slug, "chunks": old_count, "status": "embedded"}
+            manifest.save()
+
+        stale = chunk_ids(slug, len(ids), old_count)
+        sink.write(ids, vectors, texts, stale)
+        manifest.docs[path] = {"sha256": digest, "slug": slug, "chunks": len(ids), "status": "done"}
+        manifest.data["needs_build"] = True
+        manifest.save()
+        summary["ingested"] += 1
+        summary["chunks"] += len(ids)
+    # Rebuilding re-clusters the local index and gives it a new build_id (dropping every
+    # worker's cached answers), so only do it after a run that changed something
+    if manifest.data.get("needs_build"):
+        sink.finish(manifest)
+        manifest.data["needs_build"] = False
+        manifest.save()
+        summary["built"] = True
+    return summary
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description="Ingest PDF/TXT books into the RAG vector index")
+    parser.add_argument("paths", nargs="+", help="files or directories")
+    parser.add_argument("--index", default="medicalbooks-1536")
+    parser.add_argument("--target", choices=("pinecone", "local"), default="pinecone")
+    parser.add_argument("--embedder", default="openai", help="openai[:model] or st:<model>")
+    parser.add_argument("--state", default=os.path.join(BASE_DIR, "ingest_state"), help="checkpoint directory")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="extraction processes")
+    parser.add_argument("--writers", type=int, default=4, help="concurrent upsert requests")
+    parser.add_argument("--chunk-size", type=int, default=300)
+    parser.add_argument("--overlap", type=int, default=50)
+    parser.add_argument("--invalidate-url", help="e.g. http://localhost:8000/rag-cache/invalidate, called after changes")
+    args = parser.parse_args(argv)
+
+    settings = {"index": args.index, "target": args.target, "embedder": args.embedder,
+                "chunk_size": args.chunk_size, "overlap": args.overlap}
+    manifest = Manifest(os.path.join(args.state, re.sub(r"[^A-Za-z0-9_.-]+", "_", args.index)), settings)
+    embedder = make_embedder(args.embedder)
+    sink = PineconeSink(args.index, writers=args.writers) if args.target == "pinecone" else LocalSink(args.index, embedder.spec)
+    with ProcessPoolExecutor(max_workers=max(1, args.workers)) as pool:
+        summary = ingest(args.paths, embedder, sink, manifest, pool, args.chunk_size, args.overlap)
+    logging.info(f"[Ingest] done: {summary}")
+    if summary["ingested"] or summary["removed"] or summary["built"]:
+        # Shared marker read by every service worker (RAG_VERSION_FILE) to drop cached answers
+        from semantic_cache import bump_rag_version
+        bump_rag_version()
+    if args.invalidate_url and (summary["ingested"] or summary["removed"] or summary["built"]):
+        import requests
+        requests.post(args.invalidate_url, timeout=10).raise_for_status()
+    print(json.dumps(summary))
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    sys.exit(main())
@@ -0,0 +1,99 @@
+import os
+import uuid
+import logging
+
+import httpx
+
+from outbound import get_scheduler, INTERACTIVE
+
+LANGFLOW_BASE_URL = "https://host-langflow.delightfulflower-50ef0bcd.westus2.azurecontainerapps.io/api/v1/run"
+
+# Flow ids used by the service
+TREATMENT_FLOW_ID = "6c9b582f-d64a-44de-add3-b075a051dccc"
+CHATBOT_FLOW_ID = "a9c7468e-417c-4289-80b4-0d6bec3d846d"
+
+
+def _auth_headers() -> dict:
+    headers = {"Content-Type": "application/json"}
+    # Try different authentication methods
+    langflow_api_key = os.getenv("LANGFLOW_API_KEY", "")
+    langflow_token = os.getenv("LANGFLOW_TOKEN", "")
+    if langflow_api_key:
+        headers["x-api-key"] = langflow_api_key
+    elif langflow_token:
+        headers["Authorization"] = f"Bearer {langflow_token}"
+    return headers
+
+
+def _extract_text(result: dict) -> str:
+    # Extract response from Langflow output
+    return result.get("outputs", [{}])[0].get("outputs", [{}])[0].get("results", {}).get("message", {}).get("text", "No response generated")
+
+
+class LangflowClient:
+    """Shared non-blocking Langflow client.
+
+    One keep-alive connection pool per process. Flow runs go through the
+    outbound "langflow" scheduler, which bounds in-flight runs (LANGFLOW_MAX_CONCURRENCY),
+    applies rate limits and retries 429/5xx.
+    """
+
+    def __init__(self, max_connections: int = 64):
+        self._limits = httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections)
+        self._client: httpx.AsyncClient | None = None
+        self._in_flight = 0
+
+    def _get_client(self) -> httpx.AsyncClient:
+        if self._client is None:
+            self._client = httpx.AsyncClient(limits=self._limits, headers=_auth_headers())
+        return self._client
+
+    async def run(self, flow_id: str, input_value: str, timeout: float = 90.0, label: str = "LANGFLOW",
+                  priority: int = INTERACTIVE) -> str:
+        """Run a chat flow and return its text output; raises httpx errors on failure."""
+        payload = {
+            "output_type": "chat",
+            "input_type": "chat",
+            "input_value": input_value,
+            "session_id": str(uuid.uuid4()),
+        }
+        logging.info(f"{label} - Langflow API Call (session {payload['session_id']})")
+
+        async def post():
+            self._in_flight += 1
+            try:
+                response = await self._get_client().post(
+                    f"{LANGFLOW_BASE_URL}/{flow_id}", json=payload, timeout=timeout
+                )
+            finally:
+                self._in_flight -= 1
+            logging.info(f"{label} - Langflow response status: {response.status_code}")
+            logging.debug(f"{label} - Langflow response body: {response.text}")
+            response.raise_for_status()
+            return response
+
+        response = await get_scheduler("langflow").acall(post, priority=priority)
+        return _extract_text(response.json())
+
+    def stats(self) -> dict:
+        return {"in_flight": self._in_flight, "max_connections": self._limits.max_connections}
+
+    async def aclose(self) -> None:
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+
+_langflow_client: LangflowClient | None = None
+
+
+def get_langflow_client() -> LangflowClient:
+    global _langflow_client
+    if _langflow_client is None:
+        _langflow_client = LangflowClient(max_connections=int(os.getenv("LANGFLOW_MAX_CONNECTIONS", "64")))
+    return _langflow_client
+
+
+async def close_langflow_client() -> None:
+    if _langflow_client is not None:
+        await _langflow_client.aclose()
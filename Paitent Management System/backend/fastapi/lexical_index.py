@@ -0,0 +1,140 @@
+"""BM25 inverted index over the RAG chunks, plus reciprocal rank fusion.
+
+Built at ingest/import time next to the vector index (`<LOCAL_INDEX_DIR>/<name>.bm25`)
+as CSR postings in mmap'ed `.npy` files. Queries that are mostly regimen codes or
+drug names (PBD, BB, GLP1, SGLT2, ...) can be answered from it alone, without an
+embedding round trip; everything else is fused with the vector results.
+"""
+import os
+import re
+import json
+import logging
+from collections import Counter
+
+import numpy as np
+
+from model_artifacts import publish_artifact
+from vector_store import INDEX_ROOT, pack_blob, blob_item
+
+_ARRAYS = ("post_offsets", "post_docs", "post_tf", "doc_len", "idf", "id_blob", "id_offsets", "text_blob", "text_offsets")
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+# "GLP-1" / "SGLT 2" style spellings collapse to the codes used in the data
+_CODE_RE = re.compile(r"\b(glp|sglt|dpp)[\s-]+(\d)\b")
+STOPWORDS = frozenset(
+    "a an and are as at be by can do does for from how i in is it of on or should that the this to vs "
+    "versus what when which who why with".split()
+)
+DEFAULT_TERMS = (
+    "pbd bb glp1 sglt2 dpp4 metformin insulin sulfonylurea gliclazide glipizide empagliflozin dapagliflozin "
+    "canagliflozin liraglutide semaglutide dulaglutide exenatide sitagliptin linagliptin vildagliptin "
+    "pioglitazone acarbose glargine detemir degludec aspart lispro"
+)
+
+
+def tokenize(text: str) -> list[str]:
+    return [t for t in _TOKEN_RE.findall(_CODE_RE.sub(r"\1\2", text.lower())) if t not in STOPWORDS]
+
+
+def lexical_index_path(name: str) -> str:
+    return os.path.join(INDEX_ROOT, f"{name}.bm25")
+
+
+def build_lexical_index(out_dir: str, ids: list[str], texts: list[str], k1: float = 1.2, b: float = 0.75) -> None:
+    vocab: dict[str, int] = {}
+    rows, cols, tfs, doc_len = [], [], [], np.zeros(len(texts), dtype=np.float32)
+    for d, text in enumerate(texts):
+        counts = Counter(tokenize(text))
+        doc_len[d] = sum(counts.values())
+        for term, tf in counts.items():
+            rows.append(vocab.setdefault(term, len(vocab)))
+            cols.append(d)
+            tfs.append(tf)
+    term_ids = np.asarray(rows, dtype=np.int64)
+    order = np.argsort(term_ids, kind="stable")
+    post_offsets = np.zeros(len(vocab) + 1, dtype=np.int64)
+    np.cumsum(np.bincount(term_ids, minlength=len(vocab)), out=post_offsets[1:])
+    df = np.diff(post_offsets).astype(np.float64)
+    n = max(len(texts), 1)
+    idf = np.log(1.0 + (n - df + 0.5) / (df + 0.5)).astype(np.float32)
+
+    id_blob, id_offsets = pack_blob([i.encode() for i in ids])
+    text_blob, text_offsets = pack_blob([t.encode() for t in texts])
+    arrays = {
+        "post_offsets": post_offsets, "post_docs": np.asarray(cols, dtype=np.int32)[order],
+        "post_tf": np.asarray(tfs, dtype=np.float32)[order], "doc_len": doc_len, "idf": idf,
+        "id_blob": id_blob, "id_offsets": id_offsets, "text_blob": text_blob, "text_offsets": text_offsets,
+    }
+    meta = {"count": len(texts), "k1": k1, "b": b, "avgdl": float(doc_len.mean()) if len(texts) else 0.0,
+            "vocab": sorted(vocab, key=vocab.get)}
+    publish_artifact(out_dir, arrays, meta)
+
+
+class LexicalIndex:
+    def __init__(self, path: str, fast_terms=DEFAULT_TERMS, fast_ratio: float = 0.6):
+        with open(os.path.join(path, "meta.json")) as fh:
+            meta = json.load(fh)
+        for name in _ARRAYS:
+            setattr(self, name, np.load(os.path.join(path, f"{name}.npy"), mmap_mode="r"))
+        self.path = path
+        self.count = int(meta["count"])
+        self.k1, self.b, self.avgdl = float(meta["k1"]), float(meta["b"]), float(meta["avgdl"]) or 1.0
+        self.vocab = {t: i for i, t in enumerate(meta["vocab"])}
+        self.fast_terms = frozenset(tokenize(fast_terms) if isinstance(fast_terms, str) else fast_terms)
+        self.fast_ratio = float(fast_ratio)
+        # Length normalisation is per document, so precompute it once
+        self._norm = (self.k1 * (1.0 - self.b + self.b * np.asarray(self.doc_len) / self.avgdl)).astype(np.float32)
+
+    def is_term_query(self, query: str) -> bool:
+        """True when most query tokens are known clinical terms present in the corpus."""
+        tokens = tokenize(query)
+        if not tokens:
+            return False
+        known = [t for t in tokens if t in self.fast_terms and t in self.vocab]
+        return len(known) / len(tokens) >= self.fast_ratio
+
+    def search(self, query: str, top_k: int = 3) -> list[tuple[str, float, str]]:
+        """BM25 top matches as (chunk id, score, text)."""
+        scores = np.zeros(self.count, dtype=np.float32)
+        for term in set(tokenize(query)):
+            t = self.vocab.get(term)
+            if t is None:
+                continue
+            start, end = self.post_offsets[t], self.post_offsets[t + 1]
+            docs, tf = self.post_docs[start:end], self.post_tf[start:end]
+            scores[docs] += self.idf[t] * tf * (self.k1 + 1.0) / (tf + self._norm[docs])
+        hits = np.flatnonzero(scores)
+        if not hits.size:
+            return []
+        k = min(top_k, hits.size)
+        best = hits[np.argpartition(-scores[hits], k - 1)[:k]]
+        best = best[np.argsort(-scores[best])]
+        return [
+            (blob_item(self.id_blob, self.id_offsets, d).decode(), float(scores[d]),
+             blob_item(self.text_blob, self.text_offsets, d).decode())
+            for d in best.tolist()
+        ]
+
+
+def reciprocal_rank_fusion(result_lists, top_k: int = 3, k: int = 60) -> list[tuple[str, float, str]]:
+    """Merge ranked (id, score, text) lists by sum of 1 / (k + rank)."""
+    fused: dict[str, float] = {}
+    texts: dict[str, str] = {}
+    for results in result_lists:
+        for rank, (chunk_id, _, text) in enumerate(results):
+            fused[chunk_id] = fused.get(chunk_id, 0.0) + 1.0 / (k + rank + 1)
+            texts.setdefault(chunk_id, text)
+    ranked = sorted(fused.items(), key=lambda kv: kv[1], reverse=True)[:top_k]
+    return [(chunk_id, score, texts[chunk_id]) for chunk_id, score in ranked]
+
+
+def open_lexical_index(name: str) -> LexicalIndex | None:
+    path = lexical_index_path(name)
+    if not os.path.isfile(os.path.join(path, "meta.json")):
+        logging.info(f"[Lexical] no BM25 index at {path}; vector retrieval only")
+        return None
+    return LexicalIndex(
+        path,
+        fast_terms=os.getenv("LEXICAL_FAST_TERMS", DEFAULT_TERMS),
+        fast_ratio=float(os.getenv("LEXICAL_FAST_RATIO", "0.6")),
+    )
@@ -0,0 +1,119 @@
+"""CPU embedding of RAG queries with a local sentence-transformers model.
+
+Queries from concurrent requests are grouped by a MicroBatcher into one
+`encode()` call, torch/ONNX Runtime intra-op threads are capped so several
+uvicorn workers do not oversubscribe the cores, and the ONNX backend can load
+a dynamically quantized int8 export of the model.
+
+The vector index must be built with the same model, e.g.
+
+    python ingest.py books/ --embedder st:all-MiniLM-L6-v2 --target local --index medicalbooks-minilm
+
+Benchmark throughput with `python local_embedder.py --texts 512 --concurrency 16`.
+"""
+import os
+import time
+import logging
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from micro_batcher import MicroBatcher
+
+LOCAL_EMBEDDING_MODEL = os.getenv("LOCAL_EMBEDDING_MODEL", "all-MiniLM-L6-v2")
+
+
+def default_threads() -> int:
+    """Cores per worker process (uvicorn/gunicorn fork WEB_CONCURRENCY of them)."""
+    workers = max(1, int(os.getenv("WEB_CONCURRENCY", "1")))
+    return max(1, (os.cpu_count() or 1) // workers)
+
+
+def load_sentence_transformer(model_name: str = LOCAL_EMBEDDING_MODEL):
+    """SentenceTransformer on CPU, configured from env.
+
+    LOCAL_EMBEDDER_BACKEND=onnx uses ONNX Runtime (needs `optimum[onnxruntime]`);
+    LOCAL_EMBEDDER_ONNX_FILE picks an export such as `onnx/model_qint8_avx2.onnx`
+    for int8 inference. LOCAL_EMBEDDER_THREADS overrides the thread count.
+    """
+    import torch
+    from sentence_transformers import SentenceTransformer
+
+    threads = int(os.getenv("LOCAL_EMBEDDER_THREADS", "0")) or default_threads()
+    torch.set_num_threads(threads)
+    backend = os.getenv("LOCAL_EMBEDDER_BACKEND", "torch")
+    if backend == "onnx":
+        model_kwargs = {"provider": "CPUExecutionProvider"}
+        onnx_file = os.getenv("LOCAL_EMBEDDER_ONNX_FILE")
+        if onnx_file:
+            model_kwargs["file_name"] = onnx_file
+        model = SentenceTransformer(model_name, device="cpu", backend="onnx", model_kwargs=model_kwargs)
+    else:
+        model = SentenceTransformer(model_name, device="cpu")
+    logging.info(f"[Embedder] loaded {model_name} ({backend}, {threads} threads)")
+    return model
+
+
+class LocalEmbedder:
+    """Dynamic batching front end over a loaded SentenceTransformer."""
+
+    def __init__(self, model, window_ms: float = 5.0, max_batch: int = 64, model_name: str = LOCAL_EMBEDDING_MODEL):
+        self.model = model
+        self.model_name = model_name
+        self.dim = int(model.get_sentence_embedding_dimension())
+        self.batcher = MicroBatcher(self.encode, window_s=window_ms / 1000.0, max_batch=max_batch,
+                                    numeric=False, name="embed-batcher")
+
+    def encode(self, texts: list[str]) -> np.ndarray:
+        return np.asarray(
+            self.model.encode(texts, batch_size=len(texts), normalize_embeddings=True, convert_to_numpy=True),
+            dtype=np.float32,
+        )
+
+    def embed(self, texts: list[str], timeout: float | None = 10.0) -> np.ndarray:
+        """Embed via the shared batcher so concurrent requests share forward passes."""
+        futures = [self.batcher.submit(t) for t in texts]
+        return np.stack([f.result(timeout=timeout) for f in futures])
+
+    def stats(self) -> dict:
+        s = self.batcher.stats()
+        s["model"] = self.model_name
+        return s
+
+
+def benchmark(embedder: LocalEmbedder, n_texts: int = 512, concurrency: int = 16) -> dict:
+    rng = np.random.default_rng(0)
+    vocab = "insulin regimen glucose hba1c metformin dose patient renal risk weight diet exercise".split()
+    texts = [" ".join(rng.choice(vocab, size=12)) + f" {i}" for i in range(n_texts)]
+    embedder.encode(texts[:8])  # warm-up
+
+    out = {}
+    t = time.perf_counter()
+    for text in texts[:64]:
+        embedder.encode([text])
+    out["single_per_s"] = 64 / (time.perf_counter() - t)
+
+    t = time.perf_counter()
+    embedder.encode(texts)
+    out["one_batch_per_s"] = n_texts / (time.perf_counter() - t)
+
+    t = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as ex:
+        list(ex.map(lambda s: embedder.embed([s]), texts))
+    out["concurrent_batched_per_s"] = n_texts / (time.perf_counter() - t)
+    out["avg_batch_size"] = embedder.stats()["avg_batch_size"]
+    return out
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Local embedding throughput benchmark")
+    parser.add_argument("--model", default=LOCAL_EMBEDDING_MODEL)
+    parser.add_argument("--texts", type=int, default=512)
+    parser.add_argument("--concurrency", type=int, default=16)
+    args = parser.parse_args()
+    result = benchmark(LocalEmbedder(load_sentence_transformer(args.model), model_name=args.model),
+                       args.texts, args.concurrency)
+    for k, v in result.items():
+        print(f"{k:>26}: {v:,.1f}")
@@ -1,25 +1,29 @@
 import os
-import mysql.connector
-from mysql.connector import Error
+import sys
 import logging
-import uuid
-import requests
 
-# ---- MySQL connection helper ----
-def _get_mysql_conn():
-    """Connect to Laravel MySQL database"""
-    try:
-        conn = mysql.connector.connect(
-            host=os.getenv("DB_HOST", "localhost"),
-            port=int(os.getenv("DB_PORT", "3306")),
-            user=os.getenv("DB_USERNAME", "root"),
-            password=os.getenv("DB_PASSWORD", ""),
-            database=os.getenv("DB_DATABASE", "laravel")
-        )
-        return conn
-    except Error as e:
-        logging.debug(f"MySQL connection error: {e}")
-        return None
+# Allow sibling-module imports under both `main:app` and `backend.fastapi.main:app`
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from db_pool import get_mysql_pool, close_mysql_pool
+from risk_inference import load_fast_linear_model
+from therapy_inference import load_fast_therapy_model, CompiledTherapyForest
+from model_artifacts import load_shared_model
+from micro_batcher import MicroBatcher
+from cohort_forecast import linear_forecast, forecast_cohort
+from effectiveness import effectiveness_records
+from trend_plots import get_renderer, trend_spec, trend_plots_dir, patient_plot_name, patient_plot_title
+from prediction_cache import get_prediction_cache, close_prediction_cache
+from vector_store import open_local_index, LocalVectorIndex
+from index_registry import load_registry, enabled_indexes, IndexFanOut
+from lexical_index import open_lexical_index, reciprocal_rank_fusion
+from context_budget import assemble_context, count_tokens
+from single_flight import get_single_flight, request_key
+from semantic_cache import get_answer_cache, read_rag_version, bump_rag_version
+from local_embedder import LocalEmbedder, load_sentence_transformer, LOCAL_EMBEDDING_MODEL
+from embedding_cache import get_embedding_cache, embedding_cache_stats, close_embedding_caches
+from outbound import get_scheduler, outbound_stats, UpstreamRateLimited, INTERACTIVE, BATCH
+from langflow_client import get_langflow_client, close_langflow_client, TREATMENT_FLOW_ID, CHATBOT_FLOW_ID
 
 # ---- Read from Laravel patients table ----
 def latest_get(patient_id: int | None, model_version: str = "risk_v1") -> float | None:
@@ -28,30 +32,50 @@ def latest_get(patient_id: int | None, model_version: str = "risk_v1") -> float
         return None
 
     try:
-        conn = _get_mysql_conn()
-        if conn is None:
-            return None
-
-        cursor = conn.cursor()
-        cursor.execute(
-            "SELECT last_risk_score, risk_model_version FROM patients WHERE id = %s",
-            (patient_id,)
-        )
-        row = cursor.fetchone()
+        with get_mysql_pool().connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                "SELECT last_risk_score, risk_model_version FROM patients WHERE id = %s",
+                (patient_id,)
+            )
+            row = cursor.fetchone()
+            cursor.close()
 
         if row:
             score, db_model_version = row
             if score is not None and (db_model_version == model_version or db_model_version is None):
-                cursor.close()
-                conn.close()
                 return float(score)
-
-        cursor.close()
-        conn.close()
         return None
-    except Exception:
+    except Exception as e:
+        logging.debug(f"MySQL read error: {e}")
         return None
 
+def latest_get_many(patient_ids: list[int], model_version: str = "risk_v1") -> dict[int, float]:
+    """Bulk variant of latest_get: one `WHERE id IN (...)` query for many patients"""
+    ids = sorted({int(pid) for pid in patient_ids if pid is not None})
+    if not ids:
+        return {}
+
+    try:
+        placeholders = ", ".join(["%s"] * len(ids))
+        with get_mysql_pool().connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                f"SELECT id, last_risk_score, risk_model_version FROM patients WHERE id IN ({placeholders})",
+                tuple(ids)
+            )
+            rows = cursor.fetchall()
+            cursor.close()
+
+        found: dict[int, float] = {}
+        for pid, score, db_model_version in rows:
+            if score is not None and (db_model_version == model_version or db_model_version is None):
+                found[int(pid)] = float(score)
+        return found
+    except Exception as e:
+        logging.debug(f"MySQL bulk read error: {e}")
+        return {}
+
 def latest_set(patient_id: int | None, value: float, model_version: str = "risk_v1") -> None:
     """This is now handled by Laravel backend via POST /api/patients/{id}/risk"""
     # No-op: Laravel handles the database write
@@ -60,49 +84,113 @@ def latest_set(patient_id: int | None, value: float, model_version: str = "risk_
 # ---- Write to Laravel patients table ----
 def save_latest_to_mysql(patient_id: int, value: float, label: str, model_version: str = "risk_v1") -> None:
     try:
-        conn = _get_mysql_conn()
-        if conn is None:
-            return
-        cursor = conn.cursor()
-        # Read current HbA1c (2nd) to compute reduction_a_2_3
-        cursor.execute("SELECT hba1c_2nd_visit FROM patients WHERE id = %s", (int(patient_id),))
-        row = cursor.fetchone()
-        hba1c2 = float(row[0]) if row and row[0] is not None else None
-        reduction_a_2_3 = (hba1c2 - float(value)) if hba1c2 is not None else None
-
-        cursor.execute(
-            """
-            UPDATE patients
-            SET last_risk_score = %s,
-                last_risk_label = %s,
-                risk_model_version = %s,
-                last_predicted_at = NOW(),
-                hba1c_3rd_visit = %s,
-                reduction_a_2_3 = %s
-            WHERE id = %s
-            """,
-            (float(value), str(label), str(model_version), float(value), reduction_a_2_3, int(patient_id))
-        )
-        conn.commit()
-        cursor.close()
-        conn.close()
-    except Exception:
+        with get_mysql_pool().connection() as conn:
+            cursor = conn.cursor()
+            # Read current HbA1c (2nd) to compute reduction_a_2_3
+            cursor.execute("SELECT hba1c_2nd_visit FROM patients WHERE id = %s", (int(patient_id),))
+            row = cursor.fetchone()
+            hba1c2 = float(row[0]) if row and row[0] is not None else None
+            reduction_a_2_3 = (hba1c2 - float(value)) if hba1c2 is not None else None
+
+            cursor.execute(
+                """
+                UPDATE patients
+                SET last_risk_score = %s,
+                    last_risk_label = %s,
+                    risk_model_version = %s,
+                    last_predicted_at = NOW(),
+                    hba1c_3rd_visit = %s,
+                    reduction_a_2_3 = %s
+                WHERE id = %s
+                """,
+                (float(value), str(label), str(model_version), float(value), reduction_a_2_3, int(patient_id))
+            )
+            conn.commit()
+            cursor.close()
+    except Exception as e:
         # silent fail; caller will still return the computed value
-        pass
+        logging.debug(f"MySQL write error: {e}")
 
-# Deprecated cache functions (no longer used)
+def save_latest_many_to_mysql(items: list[tuple[int, float, str]], model_version: str = "risk_v1") -> None:
+    """Persist many (patient_id, value, label) scores with a single joined UPDATE.
+
+    reduction_a_2_3 is derived in SQL from hba1c_2nd_visit, matching save_latest_to_mysql.
+    """
+    if not items:
+        return
+    try:
+        rows_sql = " UNION ALL ".join(["SELECT %s AS id, %s AS score, %s AS label"] * len(items))
+        params: list = []
+        for pid, value, label in items:
+            params.extend([int(pid), float(value), str(label)])
+        params.append(str(model_version))
+
+        with get_mysql_pool().connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                f"""
+                UPDATE patients p
+                JOIN ({rows_sql}) v ON p.id = v.id
+                SET p.last_risk_score = v.score,
+                    p.last_risk_label = v.label,
+                    p.risk_model_version = %s,
+                    p.last_predicted_at = NOW(),
+                    p.hba1c_3rd_visit = v.score,
+                    p.reduction_a_2_3 = p.hba1c_2nd_visit - v.score
+                """,
+                tuple(params)
+            )
+            conn.commit()
+            cursor.close()
+    except Exception as e:
+        # silent fail; caller will still return the computed values
+        logging.debug(f"MySQL bulk write error: {e}")
+
+# ---- Two-tier prediction cache (in-memory LRU + local SQLite) in front of MySQL ----
 def cache_get(features: list[float], patient_id: int | None = None, model_version: str = "risk_v1"):
-    """Deprecated: Now reads from MySQL via latest_get"""
-    return latest_get(patient_id, model_version)
+    """Cached score for a patient (falling back to MySQL via latest_get) or a feature vector"""
+    cache = get_prediction_cache()
+    if patient_id is None:
+        return cache.get(model_version, features=features)
+    value = cache.get(model_version, patient_id=patient_id)
+    if value is None:
+        value = latest_get(patient_id, model_version)
+        if value is not None:
+            cache.set(value, model_version, patient_id=patient_id)
+    return value
+
+def cache_get_many(patient_ids: list[int], model_version: str = "risk_v1") -> dict[int, float]:
+    """Bulk cache_get for patients: cache first, one MySQL query for the rest"""
+    cache = get_prediction_cache()
+    found: dict[int, float] = {}
+    missing: list[int] = []
+    for pid in {int(p) for p in patient_ids if p is not None}:
+        value = cache.get(model_version, patient_id=pid)
+        if value is None:
+            missing.append(pid)
+        else:
+            found[pid] = value
+    if missing:
+        from_db = latest_get_many(missing, model_version=model_version)
+        for pid, value in from_db.items():
+            cache.set(value, model_version, patient_id=pid)
+        found.update(from_db)
+    return found
 
 def cache_set(features: list[float], value: float, patient_id: int | None = None, model_version: str = "risk_v1"):
-    """Deprecated: Laravel handles writes"""
-    pass
+    """Remember a freshly computed score for its feature vector and, if given, its patient"""
+    cache = get_prediction_cache()
+    cache.set(value, model_version, features=features)
+    if patient_id is not None:
+        cache.set(value, model_version, patient_id=patient_id)
 
 from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import StreamingResponse, FileResponse
+from starlette.concurrency import run_in_threadpool
 from pydantic import BaseModel
 from fastapi.middleware.cors import CORSMiddleware
 from dotenv import load_dotenv
+import json
 import warnings
 import numpy as np
 import pandas as pd
@@ -157,13 +245,23 @@ warnings.filterwarnings(
     message=r"X does not have valid feature names, but .* was fitted with feature names",
 )
 
+# Keep proxies (nginx/Azure) from buffering Server-Sent Events
+_SSE_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+
 # --- Lazy-loaded resources ---
 _ridge_model = None
 _therapy_pathline_model = None
 _pinecone_client = None
-_pinecone_index = None
+_pinecone_indexes = {}
+_local_indexes = {}
+_index_registry = None
+_index_fanout = None
+_lexical_index = None
+_lexical_loaded = False
 _groq_client = None
-_embedder = None
+_embedders = {}
+_local_embedders = {}
+_predict_batcher = None
 
 
 def get_ridge_model():
@@ -172,17 +270,41 @@ def get_ridge_model():
         import joblib, os
         base_dir = os.path.dirname(__file__)
         model_path = os.path.join(base_dir, "lasso_model.pkl")  # Switched to Lasso model
-        _ridge_model = joblib.load(model_path)
+        # Serve through the NumPy fast path (falls back to sklearn if it cannot match it),
+        # from mmap'ed arrays shared by all workers
+        _ridge_model = load_shared_model("risk", lambda: load_fast_linear_model(joblib.load(model_path)))
     return _ridge_model
 
 
+def get_predict_batcher():
+    """Shared micro-batcher for single-row /predict (window 0 disables batching)"""
+    global _predict_batcher
+    if _predict_batcher is None:
+        window_ms = float(os.getenv("PREDICT_BATCH_WINDOW_MS", "2"))
+        if window_ms <= 0:
+            return None
+        _predict_batcher = MicroBatcher(
+            lambda X: get_ridge_model().predict(X),
+            window_s=window_ms / 1000.0,
+            max_batch=int(os.getenv("PREDICT_BATCH_MAX", "64")),
+        )
+    return _predict_batcher
+
+
 def get_therapy_model():
     global _therapy_pathline_model
     if _therapy_pathline_model is None:
         import joblib, os
         base_dir = os.path.dirname(__file__)
         model_path = os.path.join(base_dir, "therapy_effectiveness_model.pkl")
-        _therapy_pathline_model = joblib.load(model_path)
+        # Serve through the flat-array evaluator (falls back to sklearn if it cannot match it),
+        # from mmap'ed arrays shared by all workers
+        model = load_shared_model("therapy", lambda: load_fast_therapy_model(joblib.load(model_path)))
+        if isinstance(model, CompiledTherapyForest):
+            # Large batches (bulk/cohort scoring) are faster through sklearn's own tree traversal
+            model.batch_threshold = int(os.getenv("THERAPY_SKLEARN_MIN_BATCH", model.batch_threshold))
+            model.batch_loader = lambda: joblib.load(model_path)
+        _therapy_pathline_model = model
     return _therapy_pathline_model
 
 
@@ -197,12 +319,65 @@ def get_pinecone_client():
     return _pinecone_client
 
 
-def get_pinecone_index():
-    global _pinecone_index
-    if _pinecone_index is None:
+def get_pinecone_index(name="medicalbooks-1536"):
+    if name not in _pinecone_indexes:
         pc = get_pinecone_client()
-        _pinecone_index = pc.Index("medicalbooks-1536")
-    return _pinecone_index
+        _pinecone_indexes[name] = pc.Index(name)
+    return _pinecone_indexes[name]
+
+
+def get_index_registry():
+    """Index name -> {embedder, dim, backend}; see index_registry.py"""
+    global _index_registry
+    if _index_registry is None:
+        _index_registry = load_registry()
+    return _index_registry
+
+
+def resolve_index(name):
+    """Registry entry for an index, with backend and embedder filled in"""
+    entry = dict(get_index_registry().get(name, {}))
+    # Indexes not pinned to a backend follow RETRIEVER_BACKEND (local = on-disk copy)
+    entry.setdefault("backend", os.getenv("RETRIEVER_BACKEND", "pinecone"))
+    if entry["backend"] != "local":
+        entry.setdefault("embedder", query_embedding_model())
+        return entry
+    # A local index records the model it was built with, and its vectors only match that model
+    index = get_vector_index(name)
+    built_with = index.embedding_model or query_embedding_model()
+    if entry.get("embedder", built_with) != built_with:
+        logging.info(f"[RAG] index {name} registered for {entry['embedder']}, querying with {built_with} it was built with")
+    entry["embedder"] = built_with
+    entry["dim"] = index.dim
+    return entry
+
+
+def get_vector_index(name=None):
+    """Index by name (default: the first of RAG_INDEXES), local or Pinecone per its backend"""
+    name = name or enabled_indexes()[0]
+    backend = get_index_registry().get(name, {}).get("backend", os.getenv("RETRIEVER_BACKEND", "pinecone"))
+    if backend == "local":
+        if name not in _local_indexes:
+            _local_indexes[name] = open_local_index(name)
+        return _local_indexes[name]
+    return get_pinecone_index(name)
+
+
+def get_index_fanout():
+    global _index_fanout
+    if _index_fanout is None:
+        _index_fanout = IndexFanOut(max_workers=int(os.getenv("RAG_FANOUT_WORKERS", "8")))
+    return _index_fanout
+
+
+def get_lexical_index():
+    """BM25 index built next to the primary vector index at ingest time (None if absent or LEXICAL_INDEX=0)"""
+    global _lexical_index, _lexical_loaded
+    if not _lexical_loaded:
+        if os.getenv("LEXICAL_INDEX", "1") != "0":
+            _lexical_index = open_lexical_index(enabled_indexes()[0])
+        _lexical_loaded = True
+    return _lexical_index
 
 
 def get_groq_client():
@@ -212,7 +387,8 @@ def get_groq_client():
         api_key = os.getenv("GROQ_API_KEY")
         if not api_key:
             raise RuntimeError("GROQ_API_KEY not set")
-        _groq_client = Groq(api_key=api_key)
+        # Retries are done by the outbound scheduler, not inside the SDK
+        _groq_client = Groq(api_key=api_key, max_retries=0)
     return _groq_client
 
 
@@ -222,16 +398,33 @@ def get_openai_client():
     api_key = os.getenv("OPENAI_API_KEY")
     if api_key:
         openai.api_key = api_key
+    openai.max_retries = 0  # retried by the outbound scheduler
     return openai
 
 
-def get_embedder():
-    global _embedder
-    if _embedder is None:
+def get_embedder(model_name=LOCAL_EMBEDDING_MODEL):
+    if model_name not in _embedders:
         # Lazy import to avoid pulling torch/transformers at startup
-        from sentence_transformers import SentenceTransformer
-        _embedder = SentenceTransformer("all-MiniLM-L6-v2")
-    return _embedder
+        _embedders[model_name] = load_sentence_transformer(model_name)
+    return _embedders[model_name]
+
+
+def get_local_embedder(model_name=LOCAL_EMBEDDING_MODEL):
+    """Dynamic batching over get_embedder() for concurrent query embedding"""
+    if model_name not in _local_embedders:
+        _local_embedders[model_name] = LocalEmbedder(
+            get_embedder(model_name),
+            window_ms=float(os.getenv("LOCAL_EMBED_BATCH_WINDOW_MS", "5")),
+            max_batch=int(os.getenv("LOCAL_EMBED_BATCH_MAX", "64")),
+            model_name=model_name,
+        )
+    return _local_embedders[model_name]
+
+
+# Load models at import time so a pre-forking server (e.g. gunicorn --preload) maps them once
+if os.getenv("PRELOAD_MODELS", "0") == "1":
+    get_ridge_model()
+    get_therapy_model()
 
 
 @app.get("/health")
@@ -239,22 +432,34 @@ def health():
     return {"status": "ok"}
 
 
-# --- Effectiveness helpers (mirror training script semantics where possible) ---
-def _improvement_ratio(baseline: float | None, followup: float | None, direction: str) -> float:
-    try:
-        b = float(baseline) if baseline is not None else float('nan')
-        f = float(followup) if followup is not None else float('nan')
-    except Exception:
-        return 0.0
-    if np.isnan(b) or np.isnan(f) or b == 0:
-        return 0.0
-    change = f - b
-    if direction == "down":
-        change = -change
-    ratio = change / abs(b)
-    return float(np.clip(ratio, -1.0, 1.0))
-
-
+@app.get("/metrics")
+def metrics():
+    batcher = get_predict_batcher()
+    answer_cache = get_answer_cache()
+    return {
+        "mysql_pool": get_mysql_pool().stats(),
+        "predict_batcher": batcher.stats() if batcher is not None else None,
+        "langflow": get_langflow_client().stats(),
+        "prediction_cache": get_prediction_cache().stats(),
+        "embedding_cache": embedding_cache_stats(),
+        "single_flight": get_single_flight().stats(),
+        "outbound": outbound_stats(),
+        "answer_cache": answer_cache.stats() if answer_cache is not None else None,
+        "local_embedders": {name: e.stats() for name, e in list(_local_embedders.items())},
+        "vector_indexes": {name: idx.stats() for name, idx in list(_local_indexes.items())},
+        "index_fanout": _index_fanout.stats() if _index_fanout is not None else None,
+    }
+
+
+@app.on_event("shutdown")
+async def _shutdown():
+    close_mysql_pool()
+    close_prediction_cache()
+    close_embedding_caches()
+    await close_langflow_client()
+
+
+# --- Effectiveness helpers (shared with the training script via effectiveness.py) ---
 def compute_effectiveness_from_patient(p: "PatientData") -> dict:
     """Compute overall effectiveness similar to therapy_effectiveness_final.py
     using available fields. Where training used FPG, map to FVG; missing metrics
@@ -281,56 +486,148 @@ def compute_effectiveness_from_patient(p: "PatientData") -> dict:
     DDS1   = getattr(p, 'dds1', None)
     DDS3   = getattr(p, 'dds3', None)
 
-    comps: dict[str, float] = {}
-    comps["HbA1c"]    = _improvement_ratio(HbA1c1, HbA1c3, "down")
-    comps["FPG"]      = _improvement_ratio(FPG1,   FPG3,   "down")
-    comps["BMI"]      = _improvement_ratio(BMI1,   BMI3,   "down")
-    comps["SBP"]      = _improvement_ratio(SBP,    SBP,    "down")  # single
-    comps["DBP"]      = _improvement_ratio(DBP,    DBP,    "down")  # single
-    comps["eGFR"]     = _improvement_ratio(eGFR1,  eGFR3,  "up")
-    comps["UACR"]     = _improvement_ratio(UACR1,  UACR3,  "down")
-    comps["Distress"] = _improvement_ratio(DDS1,   DDS3,   "down")
-
-    weights = {"HbA1c":0.30,"FPG":0.20,"BMI":0.10,"SBP":0.05,"DBP":0.05,"eGFR":0.10,"UACR":0.10,"Distress":0.10}
-    raw = sum(weights[k] * comps.get(k, 0.0) for k in weights)
-    score = float(np.clip((raw + 1.0) / 2.0, 0.0, 1.0))
-    label = "Effective" if score >= 0.5 else "Not Effective"
-    return {"score": score, "label": label, "components": comps}
+    return effectiveness_records({
+        "HbA1c1": [HbA1c1], "HbA1c3": [HbA1c3], "FPG1": [FPG1], "FPG3": [FPG3],
+        "BMI1": [BMI1], "BMI3": [BMI3], "SBP": [SBP], "DBP": [DBP],
+        "eGFR1": [eGFR1], "eGFR3": [eGFR3], "UACR1": [UACR1], "UACR3": [UACR3],
+        "DDS1": [DDS1], "DDS3": [DDS3],
+    })[0]
+
+
+OPENAI_EMBEDDING_MODEL = "text-embedding-3-small"
+OPENAI_EMBEDDING_DIM = 1536
+
+
+def get_openai_embeddings(texts: list[str], model=OPENAI_EMBEDDING_MODEL, dim=OPENAI_EMBEDDING_DIM) -> list[list[float]]:
+    """Batched embeddings; cached vectors skip the API, misses go in one request"""
+    cache = get_embedding_cache(model, dim)
+    found = cache.get_many(texts) if cache is not None else [None] * len(texts)
+    missing = [i for i, v in enumerate(found) if v is None]
+    if missing:
+        try:
+            openai = get_openai_client()
+            batch = [texts[i] for i in missing]
+            response = get_scheduler("openai").call(
+                lambda: openai.embeddings.create(model=model, input=batch),
+                tokens=sum(count_tokens(t) for t in batch),
+            )
+        except Exception as e:
+            print("❌ OpenAI Embedding Error:", e)
+            raise
+        vectors = [d.embedding for d in sorted(response.data, key=lambda d: d.index)]
+        if cache is not None:
+            cache.put_many([texts[i] for i in missing], vectors)
+        for i, vec in zip(missing, vectors):
+            found[i] = vec
+    return [v.tolist() if isinstance(v, np.ndarray) else list(v) for v in found]
 
 
 def get_openai_embedding(text: str) -> list:
-    try:
-        openai = get_openai_client()
-        response = openai.embeddings.create(
-            model="text-embedding-3-small",
-            input=[text]
-        )
-        return response.data[0].embedding
-    except Exception as e:
-        print("❌ OpenAI Embedding Error:", e)
-        raise
-
-def retrieve_context(query, top_k=3):
-    query_vec = get_openai_embedding(query)
-    index = get_pinecone_index()
-    results = index.query(vector=query_vec, top_k=top_k, include_metadata=True)
-
-    context_chunks = []
+    return get_openai_embeddings([text])[0]
+
+
+def get_local_embeddings(texts: list[str], model=LOCAL_EMBEDDING_MODEL) -> list[list[float]]:
+    """Same contract as get_openai_embeddings, computed in-process on CPU"""
+    embedder = get_local_embedder(model)
+    cache = get_embedding_cache(model, embedder.dim)
+    found = cache.get_many(texts) if cache is not None else [None] * len(texts)
+    missing = [i for i, v in enumerate(found) if v is None]
+    if missing:
+        vectors = embedder.embed([texts[i] for i in missing])
+        if cache is not None:
+            cache.put_many([texts[i] for i in missing], vectors)
+        for i, vec in zip(missing, vectors):
+            found[i] = vec
+    return [np.asarray(v).tolist() for v in found]
+
+
+def query_embedding_model() -> str:
+    """Embedder used for RAG queries (EMBEDDING_BACKEND=openai|local), as an ingest spec"""
+    if os.getenv("EMBEDDING_BACKEND", "openai") == "local":
+        return f"st:{LOCAL_EMBEDDING_MODEL}"
+    return f"openai:{OPENAI_EMBEDDING_MODEL}"
+
+
+def embed_with(spec: str, text: str, dim=None) -> list:
+    """Embed with an ingest-style spec: `openai:<model>` or `st:<model>`"""
+    kind, _, model = spec.partition(":")
+    if kind == "st":
+        return get_local_embeddings([text], model or LOCAL_EMBEDDING_MODEL)[0]
+    return get_openai_embeddings([text], model or OPENAI_EMBEDDING_MODEL, dim or OPENAI_EMBEDDING_DIM)[0]
+
+
+def get_query_embedding(text: str) -> list:
+    """Embedding for the primary (first) index; used by the answer cache and reused for retrieval"""
+    entry = resolve_index(enabled_indexes()[0])
+    return embed_with(entry["embedder"], text, entry.get("dim"))
+
+def is_lexical_query(query) -> bool:
+    """Queries dominated by regimen codes / drug names are served by BM25 alone"""
+    lexical = get_lexical_index()
+    return lexical is not None and lexical.is_term_query(query)
+
+def _query_index(name, entry, vector, top_k):
+    results = get_vector_index(name).query(vector=vector, top_k=top_k, include_metadata=True)
+    matches = []
     for match in results.get("matches", []):
         metadata = match.get("metadata", {})
         if "text" in metadata:
-            context_chunks.append(metadata["text"])
-    
-    return context_chunks
+            matches.append((match.get("id"), match.get("score"), metadata["text"]))
+    return matches
+
+def retrieve_matches(query, top_k=3, query_vec=None):
+    """Top matches as (chunk id, score, text); pass query_vec to reuse an embedding"""
+    lexical = get_lexical_index()
+    if is_lexical_query(query):
+        return lexical.search(query, top_k)
+
+    # Every index in RAG_INDEXES is searched concurrently, embedding once per distinct model
+    primary = enabled_indexes()[0]
+    indexes = {name: resolve_index(name) for name in enabled_indexes()}
+    known = {indexes[primary]["embedder"]: query_vec} if query_vec is not None else None
+    dims = {entry["embedder"]: entry.get("dim") for entry in indexes.values()}
+    matches = get_index_fanout().search(
+        query, indexes,
+        embed=lambda spec, text: embed_with(spec, text, dims.get(spec)),
+        query_index=_query_index,
+        top_k=top_k * 3 if lexical is not None else top_k,
+        deadline_s=float(os.getenv("RAG_RETRIEVAL_DEADLINE_MS", "3000")) / 1000.0,
+        known_vectors=known,
+    )
+    if lexical is not None:
+        # Hybrid: fuse vector and BM25 rankings (candidates from both, deeper than top_k)
+        lexical_matches = lexical.search(query, top_k * 3)
+        if len(indexes) > 1:
+            lexical_matches = [(f"{primary}:{i}", s, t) for i, s, t in lexical_matches]
+        return reciprocal_rank_fusion([matches, lexical_matches], top_k)
+    return matches
 
-def generate_rag_response(user_query, patient_context=""):
-    try:
-        context_chunks = retrieve_context(user_query)
-        print("[RAG] Retrieved context:", context_chunks)
+def retrieve_context(query, top_k=3):
+    return [text for _, _, text in retrieve_matches(query, top_k)]
 
-        all_context = f"Patient Info:\n{patient_context}\n\nMedical Book Context:\n" + "\n".join(context_chunks)
+def rag_index_version() -> str:
+    """Identifies the indexed corpora; the answer cache is dropped when it changes.
 
-        prompt = f"""
+    The shared marker file is bumped by ingest.py and /rag-cache/invalidate, so a
+    re-ingest reaches every worker even when the index name (Pinecone) is unchanged.
+    """
+    versions = [read_rag_version()]
+    for name in enabled_indexes():
+        index = get_vector_index(name)
+        versions.append(index.build_id if isinstance(index, LocalVectorIndex) else name)
+    return os.getenv("RAG_INDEX_VERSION", "") + "|".join(versions)
+
+def _build_rag_prompt(user_query, patient_context="", query_vec=None):
+    """Retrieve context and build the grounded prompt; returns (prompt, all_context, chunk_ids)"""
+    matches = retrieve_matches(user_query, top_k=int(os.getenv("RAG_TOP_K", "5")), query_vec=query_vec)
+    # Deduplicate overlapping chunks and keep the best-scored ones within the token budget
+    budget = int(os.getenv("RAG_CONTEXT_TOKENS", "1200")) - count_tokens(patient_context)
+    context_chunks = assemble_context(matches, max(budget, 0))
+    print("[RAG] Retrieved context:", context_chunks)
+
+    all_context = f"Patient Info:\n{patient_context}\n\nMedical Book Context:\n" + "\n".join(context_chunks)
+
+    prompt = f"""
 You are a clinical AI. Only use the information in the provided context.
 
 Context:
@@ -344,25 +641,115 @@ Instructions:
 - If context lacks a specific answer, say so.
 - Mention insulin regimen (e.g. PBD) only if clearly stated in the context.
 """.strip()
+    return prompt, all_context, [chunk_id for chunk_id, _, _ in matches]
+
+
+def _cached_rag_answer(user_query, patient_context):
+    """Semantic answer cache lookup; returns (hit or None, query_vec, index_version)"""
+    cache = get_answer_cache()
+    # Term queries skip the embedding round trip entirely, so they are not cached by meaning
+    if cache is None or is_lexical_query(user_query):
+        return None, None, None
+    query_vec = get_query_embedding(user_query)
+    version = rag_index_version()
+    return cache.get(query_vec, patient_context, version), query_vec, version
+
+
+def _with_context(result: dict, include_context: bool) -> dict:
+    return result if include_context else {k: v for k, v in result.items() if k != "context_used"}
 
-        groq_client = get_groq_client()
-        response = groq_client.chat.completions.create(
+
+def generate_rag_response(user_query, patient_context="", include_context=True):
+    try:
+        # Paraphrases of an already answered question skip retrieval and the LLM call
+        cached, query_vec, version = _cached_rag_answer(user_query, patient_context)
+        if cached is not None:
+            return _with_context(cached, include_context)
+
+        prompt, all_context, chunk_ids = _build_rag_prompt(user_query, patient_context, query_vec)
+
+        response = _groq_chat(
             model="llama-3.3-70b-versatile",
             messages=[{"role": "user", "content": prompt}],
             temperature=0.7
         )
 
-        return {
+        result = {
             "response": response.choices[0].message.content,
             "context_used": all_context
         }
+        if query_vec is not None:
+            get_answer_cache().set(query_vec, patient_context, version, result, chunk_ids)
+        return _with_context(result, include_context)
 
+    except UpstreamRateLimited:
+        raise  # a 503 from the endpoint, not an error string in a 200
     except Exception as e:
         print("[RAG ERROR]", str(e))
-        return {
+        return _with_context({
             "response": "❌ AI backend error: " + str(e),
             "context_used": ""
-        }
+        }, include_context)
+
+
+def _sse(event: str, data) -> str:
+    """Format one Server-Sent Events message with a JSON payload"""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+def _groq_tokens(kwargs: dict) -> int:
+    """Tokens/min charge for a chat call: prompt plus the completion allowance"""
+    return sum(count_tokens(m["content"]) for m in kwargs["messages"]) + kwargs.get("max_tokens", 512)
+
+
+def _groq_chat(priority=INTERACTIVE, **kwargs):
+    """Groq chat completion through the outbound scheduler (rate limits, priority, retries)"""
+    return get_scheduler("groq").call(
+        lambda: get_groq_client().chat.completions.create(**kwargs), priority, _groq_tokens(kwargs)
+    )
+
+
+def _stream_groq_tokens(priority=INTERACTIVE, **kwargs):
+    """Yield content deltas from a streaming Groq chat completion"""
+    scheduler = get_scheduler("groq")
+    # The concurrency slot is held until the stream is drained (or the client goes away)
+    with scheduler.hold(
+        lambda: get_groq_client().chat.completions.create(stream=True, **kwargs), priority, _groq_tokens(kwargs)
+    ) as stream:
+        for chunk in stream:
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+
+
+def stream_rag_response(user_query, patient_context="", include_context=True):
+    """SSE variant of generate_rag_response: a `context` event (optional), then `token` events, then `done`"""
+    try:
+        cached, query_vec, version = _cached_rag_answer(user_query, patient_context)
+        if cached is not None:
+            if include_context:
+                yield _sse("context", {"context_used": cached["context_used"]})
+            yield _sse("token", {"text": cached["response"]})
+            yield _sse("done", {})
+            return
+
+        prompt, all_context, chunk_ids = _build_rag_prompt(user_query, patient_context, query_vec)
+        if include_context:
+            yield _sse("context", {"context_used": all_context})
+        tokens = []
+        for token in _stream_groq_tokens(
+            model="llama-3.3-70b-versatile",
+            messages=[{"role": "user", "content": prompt}],
+            temperature=0.7,
+        ):
+            tokens.append(token)
+            yield _sse("token", {"text": token})
+        yield _sse("done", {})
+        if query_vec is not None:
+            result = {"response": "".join(tokens), "context_used": all_context}
+            get_answer_cache().set(query_vec, patient_context, version, result, chunk_ids)
+    except Exception as e:
+        print("[RAG ERROR]", str(e))
+        yield _sse("error", {"response": "❌ AI backend error: " + str(e)})
 
 # Data models
 class PredictionRequest(BaseModel):
@@ -418,30 +805,55 @@ class PatientData(BaseModel):
     gap_1_2_days: float | None
     gap_2_3_days: float | None
 
+class BulkPathlineRequest(BaseModel):
+    patients: list[PatientData]
+    patient_ids: list[int | None] | None = None  # optional, echoed back per result
+    include_summary: bool = False  # LLM/fallback summaries are opt-in for cohort runs
+
 class DashboardRequest(BaseModel):
     features: list[float]
     patient_id: int | None = None
     model_version: str | None = None
     patient: dict | None = None  # optional; used for key factor strings
 
+class CacheInvalidateRequest(BaseModel):
+    patient_id: int | None = None
+    model_version: str | None = None  # omit both to clear the whole cache
+
+class DashboardEntry(BaseModel):
+    features: list[float]
+    patient_id: int | None = None
+    patient: dict | None = None
+
+class BulkDashboardRequest(BaseModel):
+    entries: list[DashboardEntry]
+    model_version: str | None = None
+
 # Routes
 @app.post("/predict")
 def predict(req: PredictionRequest, force: bool = False):
     try:
         model_version = req.model_version or "risk_v1"
 
-        # Check MySQL for cached prediction (unless force recompute)
+        # Check the prediction cache / MySQL for a saved prediction (unless force recompute)
         if not force and req.patient_id:
-            cached = latest_get(req.patient_id, model_version=model_version)
+            cached = cache_get(req.features, req.patient_id, model_version=model_version)
             if cached is not None:
                 return {"prediction": cached, "cached": True, "model_version": model_version}
 
-        # Compute fresh prediction
-        m = get_ridge_model()
-        input_data = np.array(req.features, dtype=float).reshape(1, -1)
-        prediction = float(m.predict(input_data)[0])
+        # Compute fresh prediction (coalesced with concurrent requests when batching is on)
+        prediction = cache_get(req.features, model_version=model_version)
+        if prediction is None:
+            batcher = get_predict_batcher()
+            if batcher is not None:
+                prediction = batcher.predict_one(req.features)
+            else:
+                m = get_ridge_model()
+                input_data = np.array(req.features, dtype=float).reshape(1, -1)
+                prediction = float(m.predict(input_data)[0])
         
         # Laravel will save via POST /api/patients/{id}/risk
+        cache_set(req.features, prediction, req.patient_id, model_version=model_version)
         return {"prediction": prediction, "cached": False, "model_version": model_version}
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Prediction failed: {e}")
@@ -509,9 +921,9 @@ def risk_dashboard(req: DashboardRequest, force: bool = False):
     try:
         model_version = req.model_version or "risk_v1"
 
-        # 1) Check MySQL for last saved prediction (unless force recalculate)
+        # 1) Check the prediction cache / MySQL for last saved prediction (unless force recalculate)
         if not force and req.patient_id:
-            cached_score = latest_get(req.patient_id, model_version=model_version)
+            cached_score = cache_get(req.features, req.patient_id, model_version=model_version)
             if cached_score is not None:
                 label = _risk_label(float(cached_score))
                 factors = _key_factors_from_patient(req.patient)
@@ -525,14 +937,17 @@ def risk_dashboard(req: DashboardRequest, force: bool = False):
                 }
 
         # 2) No cached value or force=true: compute fresh prediction
-        m = get_ridge_model()
-        input_data = np.array(req.features, dtype=float).reshape(1, -1)
-        prediction_val = float(m.predict(input_data)[0])
+        prediction_val = cache_get(req.features, model_version=model_version)
+        if prediction_val is None:
+            m = get_ridge_model()
+            input_data = np.array(req.features, dtype=float).reshape(1, -1)
+            prediction_val = float(m.predict(input_data)[0])
 
         label = _risk_label(prediction_val)
         # Persist fresh score directly to MySQL so future calls hit cache
         if req.patient_id:
             save_latest_to_mysql(int(req.patient_id), prediction_val, label, model_version=model_version)
+        cache_set(req.features, prediction_val, req.patient_id, model_version=model_version)
         factors = _key_factors_from_patient(req.patient)
         return {
             "prediction": prediction_val,
@@ -545,12 +960,98 @@ def risk_dashboard(req: DashboardRequest, force: bool = False):
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Risk dashboard failed: {e}")
 
+@app.post("/risk-dashboard-bulk")
+def risk_dashboard_bulk(req: BulkDashboardRequest, force: bool = False):
+    """Multi-patient /risk-dashboard: one cache query, one model call, one UPDATE"""
+    try:
+        model_version = req.model_version or "risk_v1"
+        entries = req.entries
+        if not entries:
+            return {"results": []}
+
+        # 1) Resolve cached scores for every patient (local cache, then one MySQL query)
+        cached: dict[int, float] = {}
+        if not force:
+            cached = cache_get_many([e.patient_id for e in entries if e.patient_id], model_version=model_version)
+
+        # 2) Score only the cache misses as a single matrix
+        miss_idx = [i for i, e in enumerate(entries) if not (e.patient_id and e.patient_id in cached)]
+        fresh: dict[int, float] = {}
+        if miss_idx:
+            m = get_ridge_model()
+            X = np.array([entries[i].features for i in miss_idx], dtype=float)
+            y = m.predict(X)
+            fresh = {i: float(v) for i, v in zip(miss_idx, y)}
+
+        results = []
+        to_save: list[tuple[int, float, str]] = []
+        for i, e in enumerate(entries):
+            is_cached = i not in fresh
+            value = cached[e.patient_id] if is_cached else fresh[i]
+            label = _risk_label(value)
+            if not is_cached:
+                cache_set(e.features, value, e.patient_id, model_version=model_version)
+                if e.patient_id:
+                    to_save.append((int(e.patient_id), value, label))
+            results.append({
+                "patient_id": e.patient_id,
+                "prediction": value,
+                "risk_label": label,
+                "key_factors": _key_factors_from_patient(e.patient),
+                "cached": is_cached,
+                "stale": False,
+                "model_version": model_version,
+            })
+
+        # 3) Persist all fresh scores in one batched UPDATE
+        save_latest_many_to_mysql(to_save, model_version=model_version)
+        return {"results": results}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Bulk risk dashboard failed: {e}")
+
+@app.post("/cache/invalidate")
+def cache_invalidate(req: CacheInvalidateRequest):
+    """Called when Laravel stores a new risk score or the model version changes"""
+    get_prediction_cache().invalidate(patient_id=req.patient_id, model_version=req.model_version)
+    return {"invalidated": True, "patient_id": req.patient_id, "model_version": req.model_version}
+
+@app.post("/rag-cache/invalidate")
+def rag_cache_invalidate():
+    """Called after re-ingesting the corpus; bumps the shared version so every worker drops its answers"""
+    version = bump_rag_version()
+    cache = get_answer_cache()
+    if cache is not None:
+        cache.invalidate()
+    return {"invalidated": True, "rag_version": version}
+
 @app.post("/rag")
 async def rag_query(request: Request):
-    query = (await request.json())["query"]
-    response_text = generate_rag_response(query)
+    body = await request.json()
+    query = body["query"]
+    # context_used is only returned on request (it is not displayed and roughly doubles the payload)
+    include_context = bool(body.get("include_context", False))
+    # Identical concurrent questions (e.g. dashboard refreshes) share one RAG run
+    try:
+        response_text = await get_single_flight().do(
+            "rag", request_key(query, include_context),
+            lambda: run_in_threadpool(generate_rag_response, query, "", include_context),
+        )
+    except UpstreamRateLimited as e:
+        raise _rate_limited(e)
     return {"response": response_text}
 
+@app.post("/rag-stream")
+async def rag_query_stream(request: Request):
+    body = await request.json()
+    query = body["query"]
+    include_context = bool(body.get("include_context", False))
+    return StreamingResponse(stream_rag_response(query, "", include_context), media_type="text/event-stream", headers=_SSE_HEADERS)
+
+def _rate_limited(e: UpstreamRateLimited) -> HTTPException:
+    """Provider 429s that outlasted our retries are a 503 with Retry-After, not a 500"""
+    headers = {"Retry-After": str(max(1, int(e.retry_after or 1)))}
+    return HTTPException(status_code=503, detail=str(e), headers=headers)
+
 @app.post("/treatment-recommendation")
 async def treatment_recommendation(request: Request):
     try:
@@ -564,57 +1065,20 @@ async def treatment_recommendation(request: Request):
         # Combine question with patient context
         full_input = f"{question}\n\nPatient Data:\n{patient_data}"
 
-        # Call Langflow API
-        langflow_url = "https://host-langflow.delightfulflower-50ef0bcd.westus2.azurecontainerapps.io/api/v1/run/6c9b582f-d64a-44de-add3-b075a051dccc"
-        
-        # Get API key from environment variable (try different formats)
-        langflow_api_key = os.getenv("LANGFLOW_API_KEY", "")
-        langflow_token = os.getenv("LANGFLOW_TOKEN", "")
-        
-        headers = {
-            "Content-Type": "application/json"
-        }
-        
-        # Try different authentication methods
-        if langflow_api_key:
-            headers["x-api-key"] = langflow_api_key  # Common API key header
-        elif langflow_token:
-            headers["Authorization"] = f"Bearer {langflow_token}"
-        
-        payload = {
-            "output_type": "chat",
-            "input_type": "chat",
-            "input_value": full_input,
-            "session_id": str(uuid.uuid4())
-        }
-        
-        logging.info("="*80)
-        logging.info(f"TREATMENT RECOMMENDATION - Langflow API Call")
-        logging.info(f"Headers: {headers}")
-        logging.info(f"Payload keys: {list(payload.keys())}")
-        logging.info(f"Session ID: {payload['session_id']}")
-        logging.info("="*80)
-        
-        langflow_response = requests.post(langflow_url, json=payload, headers=headers, timeout=90)
-        
-        logging.info("="*80)
-        logging.info(f"LANGFLOW RESPONSE - Status Code: {langflow_response.status_code}")
-        logging.info(f"LANGFLOW RESPONSE - Headers: {dict(langflow_response.headers)}")
-        logging.info(f"LANGFLOW RESPONSE - Body: {langflow_response.text}")
-        logging.info("="*80)
-        
-        langflow_response.raise_for_status()
-        
-        result = langflow_response.json()
-        
-        # Extract response from Langflow output
-        response_text = result.get("outputs", [{}])[0].get("outputs", [{}])[0].get("results", {}).get("message", {}).get("text", "No response generated")
+        response_text = await get_single_flight().do(
+            "treatment-recommendation", request_key(TREATMENT_FLOW_ID, full_input),
+            lambda: get_langflow_client().run(
+                TREATMENT_FLOW_ID, full_input, timeout=90, label="TREATMENT RECOMMENDATION"
+            ),
+        )
 
         return {
             "response": response_text,
             "context_used": "Langflow API with trained context"
         }
 
+    except UpstreamRateLimited as e:
+        raise _rate_limited(e)
     except Exception as e:
         print("❌ Treatment Recommendation Error:", e)
         raise HTTPException(status_code=500, detail=str(e))
@@ -651,52 +1115,17 @@ async def treatment_chat(request: Request):
         User Question: {question} 
         """
 
-        # Call Langflow API (SAME URL as treatment-recommendation)
-        langflow_url = "https://host-langflow.delightfulflower-50ef0bcd.westus2.azurecontainerapps.io/api/v1/run/6c9b582f-d64a-44de-add3-b075a051dccc"
-        
-        # Get API key from environment variable
-        langflow_api_key = os.getenv("LANGFLOW_API_KEY", "")
-        langflow_token = os.getenv("LANGFLOW_TOKEN", "")
-        
-        headers = {
-            "Content-Type": "application/json"
-        }
-        
-        # Try different authentication methods
-        if langflow_api_key:
-            headers["x-api-key"] = langflow_api_key
-        elif langflow_token:
-            headers["Authorization"] = f"Bearer {langflow_token}"
-        
-        payload = {
-            "output_type": "chat",
-            "input_type": "chat",
-            "input_value": full_input,
-            "session_id": str(uuid.uuid4())
-        }
-        
-        logging.info("="*80)
-        logging.info(f"TREATMENT CHAT - Langflow API Call")
-        logging.info(f"Session ID: {payload['session_id']}")
-        logging.info("="*80)
-        
-        langflow_response = requests.post(langflow_url, json=payload, headers=headers, timeout=90)
-        
-        logging.info("="*80)
-        logging.info(f"LANGFLOW RESPONSE - Status Code: {langflow_response.status_code}")
-        logging.info("="*80)
-        
-        langflow_response.raise_for_status()
-        
-        result = langflow_response.json()
-        
-        # Extract response from Langflow output
-        response_text = result.get("outputs", [{}])[0].get("outputs", [{}])[0].get("results", {}).get("message", {}).get("text", "No response generated")
+        # Same flow as treatment-recommendation
+        response_text = await get_langflow_client().run(
+            TREATMENT_FLOW_ID, full_input, timeout=90, label="TREATMENT CHAT"
+        )
 
         return {
             "response": response_text
         }
 
+    except UpstreamRateLimited as e:
+        raise _rate_limited(e)
     except Exception as e:
         print("❌ Treatment Chat Error:", e)
         raise HTTPException(status_code=500, detail=str(e))
@@ -715,54 +1144,14 @@ User Question: {req.query}
 
 Please provide a concise, friendly clinical response based on the patient's data and medical knowledge."""
 
-        # Call Langflow API
-        langflow_url = "https://host-langflow.delightfulflower-50ef0bcd.westus2.azurecontainerapps.io/api/v1/run/a9c7468e-417c-4289-80b4-0d6bec3d846d"
-        
-        # Get API key from environment variable (try different formats)
-        langflow_api_key = os.getenv("LANGFLOW_API_KEY", "")
-        langflow_token = os.getenv("LANGFLOW_TOKEN", "")
-        
-        headers = {
-            "Content-Type": "application/json"
-        }
-        
-        # Try different authentication methods
-        if langflow_api_key:
-            headers["x-api-key"] = langflow_api_key  # Common API key header
-        elif langflow_token:
-            headers["Authorization"] = f"Bearer {langflow_token}"
-        
-        payload = {
-            "output_type": "chat",
-            "input_type": "chat",
-            "input_value": full_input,
-            "session_id": str(uuid.uuid4())
-        }
-        
-        logging.info("="*80)
-        logging.info(f"CHATBOT QUERY - Langflow API Call")
-        logging.info(f"Headers: {headers}")
-        logging.info(f"Payload keys: {list(payload.keys())}")
-        logging.info(f"Session ID: {payload['session_id']}")
-        logging.info("="*80)
-        
-        langflow_response = requests.post(langflow_url, json=payload, headers=headers, timeout=30)
-        
-        logging.info("="*80)
-        logging.info(f"LANGFLOW RESPONSE - Status Code: {langflow_response.status_code}")
-        logging.info(f"LANGFLOW RESPONSE - Headers: {dict(langflow_response.headers)}")
-        logging.info(f"LANGFLOW RESPONSE - Body: {langflow_response.text}")
-        logging.info("="*80)
-        
-        langflow_response.raise_for_status()
-        
-        result = langflow_response.json()
-        
-        # Extract response from Langflow output
-        response_text = result.get("outputs", [{}])[0].get("outputs", [{}])[0].get("results", {}).get("message", {}).get("text", "No response generated")
+        response_text = await get_langflow_client().run(
+            CHATBOT_FLOW_ID, full_input, timeout=30, label="CHATBOT QUERY"
+        )
         
         return {"response": response_text}
         
+    except UpstreamRateLimited as e:
+        raise _rate_limited(e)
     except Exception as e:
         print("❌ Chatbot Query Error:", e)
         raise HTTPException(status_code=500, detail=str(e))
@@ -770,133 +1159,276 @@ Please provide a concise, friendly clinical response based on the patient's data
 
 def _forecast_hba1c_simple(hba1c_values: list[float], steps: int = 2) -> list[float]:
     """Lightweight linear forecast for HbA1c (mirrors script's fallback for <3 visits)"""
-    valid = [v for v in hba1c_values if not np.isnan(v)]
-    if len(valid) < 2:
-        return [np.nan] * steps
-    x = np.arange(len(valid), dtype=float)
-    a, b = np.polyfit(x, valid, 1)
-    future_x = np.arange(len(valid), len(valid) + steps, dtype=float)
-    return [float(a * fx + b) for fx in future_x]
+    return [float(v) for v in linear_forecast([hba1c_values], steps)[0]]
+
+
+def compute_effectiveness_batch(df: pd.DataFrame) -> list[dict]:
+    """Vectorized compute_effectiveness_from_patient over a pathline frame"""
+    return effectiveness_records(df)
+
+
+# Map categorical values to match training data
+# Handle both uppercase database values and model-expected values
+_SEX_MAP = {
+    'MALE': 'Male', 'FEMALE': 'Female', 'M': 'Male', 'F': 'Female',
+    'Male': 'Male', 'Female': 'Female',
+    '0': 'Male', '1': 'Female'
+}
+_ETHNICITY_MAP = {
+    # Map database ethnicities to model's expected categories
+    'CAUCASIAN': 'Others', 'AFRICAN': 'Others', 'HISPANIC': 'Others', 'ASIAN': 'Chinese',
+    'Caucasian': 'Others', 'African': 'Others', 'Hispanic': 'Others', 'Asian': 'Chinese',
+    # Model's original categories
+    'Chinese': 'Chinese', 'Malay': 'Malay', 'Indian': 'Indian', 'Others': 'Others',
+    '0': 'Chinese', '1': 'Malay', '2': 'Indian', '3': 'Others'
+}
+
+
+def _num(v) -> float:
+    return v if v is not None else np.nan
+
+
+def _pathline_frame(patients: list["PatientData"]) -> pd.DataFrame:
+    """Build one columnar frame with all training columns for many patients"""
+    col = lambda f: [f(p) for p in patients]
+    patient_dict = {
+        'Age': col(lambda p: _num(p.age)),
+        'Sex': col(lambda p: _SEX_MAP.get(str(p.sex).upper() if p.sex else '', 'Male')),
+        'Ethnicity': col(lambda p: _ETHNICITY_MAP.get(str(p.ethnicity).upper() if p.ethnicity else '', 'Chinese')),
+        'Height_cm': col(lambda p: _num(p.height_cm)),
+        'Weight1': col(lambda p: _num(p.weight1)),
+        'Weight2': col(lambda p: _num(p.weight2)),
+        'Weight3': col(lambda p: _num(p.weight3)),
+        'BMI1': col(lambda p: _num(p.bmi1)),
+        'BMI3': col(lambda p: _num(p.bmi3)),
+        'Regimen1': col(lambda p: p.insulin_regimen),
+        'Regimen2': col(lambda p: p.insulin_regimen),
+        'Regimen3': col(lambda p: p.insulin_regimen),
+        'HbA1c1': col(lambda p: p.hba1c1),
+        'HbA1c2': col(lambda p: p.hba1c2),
+        'HbA1c3': col(lambda p: p.hba1c3),
+        'FPG1': col(lambda p: p.fvg1),
+        'FPG2': col(lambda p: p.fvg2),
+        'FPG3': col(lambda p: p.fvg3),
+        'SBP': col(lambda p: _num(p.sbp)),
+        'DBP': col(lambda p: _num(p.dbp)),
+        'eGFR1': col(lambda p: p.egfr1 if p.egfr1 is not None else p.egfr),
+        'eGFR3': col(lambda p: p.egfr3 if p.egfr3 is not None else p.egfr),
+        'UACR1': col(lambda p: _num(p.uacr1)),
+        'UACR3': col(lambda p: _num(p.uacr3)),
+        'DDS1': col(lambda p: p.dds1),
+        'DDS3': col(lambda p: p.dds3),
+        'Gap_1_2_days': col(lambda p: _num(p.gap_1_2_days)),
+        'Gap_2_3_days': col(lambda p: _num(p.gap_2_3_days)),
+    }
+    df = pd.DataFrame(patient_dict)
+    # None -> NaN for nullable numeric columns (object dtype would break the scaler)
+    num_cols = [c for c in df.columns if c not in ('Sex', 'Ethnicity', 'Regimen1', 'Regimen2', 'Regimen3')]
+    df[num_cols] = df[num_cols].astype(float)
+    return df
+
+
+def _pathline_summary_prompt(data: "PatientData", eff: dict, forecast_vals: list[float]) -> str:
+    """Prompt for the LLM summary (matches script llm_analysis prompt structure)"""
+    hb = [data.hba1c1, data.hba1c2, data.hba1c3]
+    regimen = data.insulin_regimen
+    pred_text = f"""Therapy effectiveness score: {eff['score']:.2f} ({eff['label']}).
+HbA1c across visits: {', '.join(f"{x:.2f}" for x in hb if x is not None and not np.isnan(x))}.
+Forecast HbA1c next visits: {', '.join(f"{x:.2f}" for x in forecast_vals if not np.isnan(x))}.
+Regimen: {regimen}."""
+    return f"""You are a helpful medical assistant.
+Summarize the patient's trajectory and give a concise, clinically-relevant recommendation (<120 words).
+
+{pred_text}"""
+
+
+def _pathline_fallback_summary(data: "PatientData", eff: dict) -> str:
+    """Rule-based summary used when no GROQ_API_KEY is configured"""
+    trend = "improving" if eff["components"]["HbA1c"] > 0 else ("worsening" if eff["components"]["HbA1c"] < 0 else "flat")
+    recs = []
+    if eff["score"] < 0.5:
+        recs.append("consider regimen intensification or adherence review")
+    else:
+        recs.append("continue current regimen with monitoring")
+    if (data.sbp is not None and data.sbp >= 140) or (data.dbp is not None and data.dbp >= 90):
+        recs.append("optimize blood pressure control")
+    if data.uacr3 is not None and data.uacr3 >= 30:
+        recs.append("monitor albuminuria and kidney function")
+    return f"Glycemic trend is {trend}. Overall therapy appears {eff['label'].lower()} (score {eff['score']:.2f}). Recommendation: " + "; ".join(recs) + "."
+
+
+def _pathline_llm_kwargs(prompt: str) -> dict:
+    return dict(
+        model="llama-3.3-70b-versatile",
+        messages=[
+            {"role": "system", "content": "You are a helpful medical AI assistant."},
+            {"role": "user", "content": prompt},
+        ],
+        temperature=0.2,
+        max_tokens=220,
+    )
+
+
+def _pathline_summary(data: "PatientData", eff: dict, forecast_vals: list[float], priority: int = INTERACTIVE) -> str:
+    # Fallback if no GROQ_API_KEY
+    if not os.getenv("GROQ_API_KEY"):
+        return _pathline_fallback_summary(data, eff)
+
+    try:
+        chat = _groq_chat(priority, **_pathline_llm_kwargs(_pathline_summary_prompt(data, eff, forecast_vals)))
+        return chat.choices[0].message.content.strip()
+    except Exception as e:
+        return f"(LLM unavailable) {str(e)}"
+
+
+def _pathline_prediction(data: "PatientData") -> tuple[dict, list[float]]:
+    """Model probability, effectiveness and forecast for one patient (no summary)"""
+    df = _pathline_frame([data])
+    tm = get_therapy_model()
+    
+    # Model probability (single row, matches script)
+    model_probability = float(tm.predict_proba(df)[0][1])
+
+    # Effectiveness (matches script compute_effectiveness)
+    eff = compute_effectiveness_from_patient(data)
+
+    # Forecast HbA1c (matches script forecast_metric)
+    hba1c_series = [_num(data.hba1c1), _num(data.hba1c2), _num(data.hba1c3)]
+    forecast_vals = _forecast_hba1c_simple(hba1c_series, steps=2)
+
+    result = {
+        "patient_id": None,  # not passed in request, can add if needed
+        "effectiveness": eff,
+        "model_probability": round(model_probability, 4),
+        "forecast_hba1c": [round(f, 2) if not np.isnan(f) else None for f in forecast_vals],
+    }
+    return result, forecast_vals
 
 
 @app.post("/predict-therapy-pathline")
 def predict_therapy_pathline(data: PatientData):
     try:
-        # Build complete DataFrame with all training columns
-        # Map categorical values to match training data
-        # Handle both uppercase database values and model-expected values
-        sex_map = {
-            'MALE': 'Male', 'FEMALE': 'Female', 'M': 'Male', 'F': 'Female',
-            'Male': 'Male', 'Female': 'Female',
-            '0': 'Male', '1': 'Female'
-        }
-        ethnicity_map = {
-            # Map database ethnicities to model's expected categories
-            'CAUCASIAN': 'Others', 'AFRICAN': 'Others', 'HISPANIC': 'Others', 'ASIAN': 'Chinese',
-            'Caucasian': 'Others', 'African': 'Others', 'Hispanic': 'Others', 'Asian': 'Chinese',
-            # Model's original categories
-            'Chinese': 'Chinese', 'Malay': 'Malay', 'Indian': 'Indian', 'Others': 'Others',
-            '0': 'Chinese', '1': 'Malay', '2': 'Indian', '3': 'Others'
-        }
-        
-        sex_value = sex_map.get(str(data.sex).upper() if data.sex else '', 'Male')
-        ethnicity_value = ethnicity_map.get(str(data.ethnicity).upper() if data.ethnicity else '', 'Chinese')
-        
-        patient_dict = {
-            'Age': [data.age if data.age is not None else np.nan],
-            'Sex': [sex_value],
-            'Ethnicity': [ethnicity_value],
-            'Height_cm': [data.height_cm if data.height_cm is not None else np.nan],
-            'Weight1': [data.weight1 if data.weight1 is not None else np.nan],
-            'Weight2': [data.weight2 if data.weight2 is not None else np.nan],
-            'Weight3': [data.weight3 if data.weight3 is not None else np.nan],
-            'BMI1': [data.bmi1 if data.bmi1 is not None else np.nan],
-            'BMI3': [data.bmi3 if data.bmi3 is not None else np.nan],
-            'Regimen1': [data.insulin_regimen],
-            'Regimen2': [data.insulin_regimen],
-            'Regimen3': [data.insulin_regimen],
-            'HbA1c1': [data.hba1c1],
-            'HbA1c2': [data.hba1c2],
-            'HbA1c3': [data.hba1c3],
-            'FPG1': [data.fvg1],
-            'FPG2': [data.fvg2],
-            'FPG3': [data.fvg3],
-            'SBP': [data.sbp if data.sbp is not None else np.nan],
-            'DBP': [data.dbp if data.dbp is not None else np.nan],
-            'eGFR1': [data.egfr1 if data.egfr1 is not None else data.egfr],
-            'eGFR3': [data.egfr3 if data.egfr3 is not None else data.egfr],
-            'UACR1': [data.uacr1 if data.uacr1 is not None else np.nan],
-            'UACR3': [data.uacr3 if data.uacr3 is not None else np.nan],
-            'DDS1': [data.dds1],
-            'DDS3': [data.dds3],
-            'Gap_1_2_days': [data.gap_1_2_days if data.gap_1_2_days is not None else np.nan],
-            'Gap_2_3_days': [data.gap_2_3_days if data.gap_2_3_days is not None else np.nan],
-        }
+        def run():
+            result, forecast_vals = _pathline_prediction(data)
+            result["summary"] = _pathline_summary(data, result["effectiveness"], forecast_vals)
+            return result
 
-        df = pd.DataFrame(patient_dict)
-        tm = get_therapy_model()
-        
-        # Model probability (single row, matches script)
-        model_probability = float(tm.predict_proba(df)[0][1])
+        # Match script output structure
+        return get_single_flight().do_sync("predict-therapy-pathline", request_key(data.model_dump()), run)
 
-        # Effectiveness (matches script compute_effectiveness)
-        eff = compute_effectiveness_from_patient(data)
+    except Exception as e:
+        print("❌ LLM Pathline Error:", e)
+        raise HTTPException(status_code=500, detail=str(e))
 
-        # Forecast HbA1c (matches script forecast_metric)
-        hba1c_series = [data.hba1c1, data.hba1c2, data.hba1c3]
-        forecast_vals = _forecast_hba1c_simple(hba1c_series, steps=2)
 
-        # LLM summary (matches script llm_analysis prompt structure)
-        hb = [data.hba1c1, data.hba1c2, data.hba1c3]
-        regimen = data.insulin_regimen
-        pred_text = f"""Therapy effectiveness score: {eff['score']:.2f} ({eff['label']}).
-HbA1c across visits: {', '.join(f"{x:.2f}" for x in hb if not np.isnan(x))}.
-Forecast HbA1c next visits: {', '.join(f"{x:.2f}" for x in forecast_vals if not np.isnan(x))}.
-Regimen: {regimen}."""
+@app.post("/predict-therapy-pathline-stream")
+def predict_therapy_pathline_stream(data: PatientData):
+    """SSE variant: a `prediction` event with the model numbers, then summary `token` events"""
+    try:
+        result, forecast_vals = _pathline_prediction(data)
+    except Exception as e:
+        print("❌ LLM Pathline Error:", e)
+        raise HTTPException(status_code=500, detail=str(e))
 
-        # Fallback if no GROQ_API_KEY
-        api_key = os.getenv("GROQ_API_KEY")
-        if not api_key:
-            trend = "improving" if eff["components"]["HbA1c"] > 0 else ("worsening" if eff["components"]["HbA1c"] < 0 else "flat")
-            recs = []
-            if eff["score"] < 0.5:
-                recs.append("consider regimen intensification or adherence review")
-            else:
-                recs.append("continue current regimen with monitoring")
-            if data.sbp >= 140 or data.dbp >= 90:
-                recs.append("optimize blood pressure control")
-            if data.uacr3 >= 30:
-                recs.append("monitor albuminuria and kidney function")
-            summary = f"Glycemic trend is {trend}. Overall therapy appears {eff['label'].lower()} (score {eff['score']:.2f}). Recommendation: " + "; ".join(recs) + "."
+    def events():
+        yield _sse("prediction", result)
+        if not os.getenv("GROQ_API_KEY"):
+            yield _sse("token", {"text": _pathline_fallback_summary(data, result["effectiveness"])})
         else:
             try:
-                prompt = f"""You are a helpful medical assistant.
-Summarize the patient's trajectory and give a concise, clinically-relevant recommendation (<120 words).
-
-{pred_text}"""
-                groq_client = get_groq_client()
-                chat = groq_client.chat.completions.create(
-                    model="llama-3.3-70b-versatile",
-                    messages=[
-                        {"role": "system", "content": "You are a helpful medical AI assistant."},
-                        {"role": "user", "content": prompt},
-                    ],
-                    temperature=0.2,
-                    max_tokens=220,
-                )
-                summary = chat.choices[0].message.content.strip()
+                prompt = _pathline_summary_prompt(data, result["effectiveness"], forecast_vals)
+                for token in _stream_groq_tokens(**_pathline_llm_kwargs(prompt)):
+                    yield _sse("token", {"text": token})
             except Exception as e:
-                summary = f"(LLM unavailable) {str(e)}"
+                yield _sse("token", {"text": f"(LLM unavailable) {str(e)}"})
+        yield _sse("done", {})
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers=_SSE_HEADERS)
 
-        # Match script output structure
-        return {
-            "patient_id": None,  # not passed in request, can add if needed
-            "effectiveness": eff,
-            "model_probability": round(model_probability, 4),
-            "forecast_hba1c": [round(f, 2) if not np.isnan(f) else None for f in forecast_vals],
-            "summary": summary,
-        }
+
+@app.post("/predict-therapy-pathline-bulk")
+def predict_therapy_pathline_bulk(req: BulkPathlineRequest):
+    """Score many patients with one frame, one predict_proba and vectorized helpers"""
+    try:
+        patients = req.patients
+        if not patients:
+            return {"results": []}
+
+        df = _pathline_frame(patients)
+        probs = get_therapy_model().predict_proba(df)[:, 1]
+        effs = compute_effectiveness_batch(df)
+        forecasts = linear_forecast(df[["HbA1c1", "HbA1c2", "HbA1c3"]].to_numpy(), steps=2)
+
+        results = []
+        for i, p in enumerate(patients):
+            forecast_vals = [float(v) for v in forecasts[i]]
+            results.append({
+                "patient_id": req.patient_ids[i] if req.patient_ids and i < len(req.patient_ids) else None,
+                "effectiveness": effs[i],
+                "model_probability": round(float(probs[i]), 4),
+                "forecast_hba1c": [round(f, 2) if not np.isnan(f) else None for f in forecast_vals],
+                # Cohort summaries yield to interactive chat at the Groq scheduler
+                "summary": _pathline_summary(p, effs[i], forecast_vals, BATCH) if req.include_summary else None,
+            })
+        return {"results": results}
 
     except Exception as e:
-        print("❌ LLM Pathline Error:", e)
+        print("❌ Bulk Pathline Error:", e)
         raise HTTPException(status_code=500, detail=str(e))
+
+
+# Trend plots rendered by the cohort batch job (therapy_effectiveness_final.render_cohort_plots)
+TREND_PLOTS_DIR = trend_plots_dir("patients")  # keyed by MySQL patients.id, unlike the script's dataset plots
+
+
+def _trend_plot_spec(patient_id: int) -> dict | None:
+    """A patient's plot spec from their MySQL visits, drawn as the batch script would; None if there is no data"""
+    with get_mysql_pool().connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            """
+            SELECT hba1c_1st_visit, hba1c_2nd_visit, hba1c_3rd_visit, fvg_1, fvg_2, fvg_3,
+                   first_visit_date, second_visit_date, third_visit_date
+            FROM patients WHERE id = %s
+            """,
+            (int(patient_id),)
+        )
+        row = cursor.fetchone()
+        cursor.close()
+    if row is None:
+        return None
+    hba1c = np.array([np.nan if v is None else float(v) for v in row[0:3]])
+    fpg = np.array([np.nan if v is None else float(v) for v in row[3:6]])
+    observed = ~np.isnan(hba1c)
+    if not observed.any():
+        return None
+    # Visits on a month-end grid from the first visit, like the script's _patient_series
+    start = pd.Timestamp(min(row[6:9])) if all(row[6:9]) else pd.Timestamp("2023-01-31")
+    idx = pd.date_range(start, periods=3, freq="ME")
+    last = pd.date_range(idx[observed].min(), periods=int(observed.sum()), freq="ME")[-1]
+    fc_idx = pd.date_range(last + pd.tseries.frequencies.to_offset("ME"), periods=2, freq="ME")
+    fcs = forecast_cohort(hba1c[None, :], steps=2)
+    fc = pd.Series(fcs.mean[0], index=fc_idx)
+    ci = pd.DataFrame({"lower": fcs.lower[0], "upper": fcs.upper[0]}, index=fc_idx)
+    return trend_spec(pd.Series(hba1c, index=idx), pd.Series(fpg, index=idx), fc, ci, patient_plot_title(patient_id))
+
+
+@app.get("/trend-plots/{patient_id}")
+def get_trend_plot(patient_id: int):
+    path = os.path.join(TREND_PLOTS_DIR, patient_plot_name(patient_id))
+    try:
+        spec = _trend_plot_spec(patient_id)
+    except Exception as e:
+        # Database unavailable: fall back to this patient's last rendered plot, if any
+        logging.warning(f"[TrendPlot] could not load visits for patient {patient_id}: {e}")
+        spec = None
+        if not os.path.isfile(path):
+            raise HTTPException(status_code=503, detail="Patient data unavailable")
+    else:
+        if spec is None:
+            raise HTTPException(status_code=404, detail=f"No trend plot for patient {patient_id}")
+        os.makedirs(TREND_PLOTS_DIR, exist_ok=True)
+        # Redraws only when the visits changed since the file was written
+        get_renderer().render(spec, path)
+    # The file changes whenever the visits do, so let clients revalidate
+    return FileResponse(path, media_type="image/png", headers={"Cache-Control": "no-cache"})
@@ -0,0 +1,123 @@
+import time
+import queue
+import threading
+from concurrent.futures import Future
+from typing import Callable
+
+import numpy as np
+
+
+class _Item:
+    __slots__ = ("row", "future", "enqueued_at")
+
+    def __init__(self, row: np.ndarray):
+        self.row = row
+        self.future: Future = Future()
+        self.enqueued_at = time.monotonic()
+
+
+class MicroBatcher:
+    """Collect single-row predictions into one matrix call.
+
+    Rows submitted within ``window_s`` of the first queued row (or until
+    ``max_batch`` rows are waiting) are stacked and scored with one
+    ``predict_fn(X)`` call; each caller's future gets its own row back.
+
+    With ``numeric=False`` items are passed through as a list (e.g. texts to
+    embed) and each caller receives its element of the result unchanged.
+    """
+
+    def __init__(self, predict_fn: Callable[[np.ndarray], np.ndarray], window_s: float = 0.002, max_batch: int = 64,
+                 numeric: bool = True, name: str = "predict-batcher"):
+        self.predict_fn = predict_fn
+        self.numeric = numeric
+        self.name = name
+        self.window_s = max(0.0, float(window_s))
+        self.max_batch = max(1, int(max_batch))
+        self._queue: queue.Queue = queue.Queue()
+        self._worker: threading.Thread | None = None
+        self._start_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._stats = {
+            "batches": 0,
+            "rows": 0,
+            "max_batch_size": 0,
+            "last_batch_size": 0,
+            "total_wait_ms": 0.0,
+            "max_wait_ms": 0.0,
+        }
+
+    def _ensure_worker(self) -> None:
+        if self._worker is None:
+            with self._start_lock:
+                if self._worker is None:
+                    self._worker = threading.Thread(target=self._run, name=self.name, daemon=True)
+                    self._worker.start()
+
+    def submit(self, row) -> Future:
+        item = _Item(np.asarray(row, dtype=np.float64).ravel() if self.numeric else row)
+        self._ensure_worker()
+        self._queue.put(item)
+        return item.future
+
+    def predict_one(self, row, timeout: float | None = 10.0) -> float:
+        return float(self.submit(row).result(timeout=timeout))
+
+    def _collect(self) -> list[_Item]:
+        first = self._queue.get()
+        batch = [first]
+        deadline = first.enqueued_at + self.window_s
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            try:
+                item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            batch.append(item)
+        return batch
+
+    def _call(self, rows: list):
+        if self.numeric:
+            return [float(v) for v in np.asarray(self.predict_fn(np.vstack(rows)))]
+        return list(self.predict_fn(rows))
+
+    def _run(self) -> None:
+        while True:
+            batch = self._collect()
+            started = time.monotonic()
+            self._record(batch, started)
+            try:
+                y = self._call([it.row for it in batch])
+                for it, val in zip(batch, y):
+                    it.future.set_result(val)
+            except Exception:
+                # A malformed row (e.g. wrong width) must not fail its neighbours
+                for it in batch:
+                    if it.future.done():
+                        continue
+                    try:
+                        it.future.set_result(self._call([it.row])[0])
+                    except Exception as e:
+                        it.future.set_exception(e)
+
+    def _record(self, batch: list[_Item], started: float) -> None:
+        waits = [(started - it.enqueued_at) * 1000.0 for it in batch]
+        with self._stats_lock:
+            s = self._stats
+            s["batches"] += 1
+            s["rows"] += len(batch)
+            s["last_batch_size"] = len(batch)
+            s["max_batch_size"] = max(s["max_batch_size"], len(batch))
+            s["total_wait_ms"] += sum(waits)
+            s["max_wait_ms"] = max(s["max_wait_ms"], max(waits))
+
+    def stats(self) -> dict:
+        with self._stats_lock:
+            s = dict(self._stats)
+        s["avg_batch_size"] = (s["rows"] / s["batches"]) if s["batches"] else 0.0
+        total_wait_ms = s.pop("total_wait_ms")
+        s["avg_wait_ms"] = (total_wait_ms / s["rows"]) if s["rows"] else 0.0
+        s["queue_depth"] = self._queue.qsize()
+        s["window_ms"] = self.window_s * 1000.0
+        s["max_batch"] = self.max_batch
+        return s
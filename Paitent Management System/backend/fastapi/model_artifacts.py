@@ -0,0 +1,185 @@
+"""Read-only, memory-mappable model artifacts shared by all uvicorn workers.
+
+The compiled risk/therapy models are written once as raw `.npy` arrays plus a
+small `meta.json`, in a directory keyed by the source pickle's content hash.
+Workers `np.load(..., mmap_mode="r")` them, so N processes share one physical
+copy through the page cache and never need to unpickle (or import) sklearn.
+
+Build ahead of time with `python model_artifacts.py`; otherwise the first
+worker to load a model exports it.
+"""
+import os
+import re
+import json
+import time
+import shutil
+import hashlib
+import logging
+import tempfile
+
+import numpy as np
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+ARTIFACTS_DIR = os.getenv("MODEL_ARTIFACTS_DIR", os.path.join(BASE_DIR, "model_artifacts"))
+
+RISK_MODEL_PATH = os.path.join(BASE_DIR, "lasso_model.pkl")
+THERAPY_MODEL_PATH = os.path.join(BASE_DIR, "therapy_effectiveness_model.pkl")
+
+_THERAPY_ARRAYS = ("means", "scales", "feature", "threshold", "left", "right", "missing_left", "leaf_proba", "roots")
+
+
+def file_fingerprint(path: str) -> str:
+    try:
+        with open(path, "rb") as fh:
+            return hashlib.sha256(fh.read()).hexdigest()[:12]
+    except OSError:
+        return "missing"
+
+
+def artifact_dir(kind: str, source_path: str) -> str:
+    return os.path.join(ARTIFACTS_DIR, kind, file_fingerprint(source_path))
+
+
+# ---- Writers ----
+def write_artifact(out_dir: str, arrays: dict, meta: dict) -> None:
+    """Write into a temp dir and rename, so readers never see a half-written artifact."""
+    os.makedirs(os.path.dirname(out_dir), exist_ok=True)
+    tmp = tempfile.mkdtemp(prefix=".tmp-", dir=os.path.dirname(out_dir))
+    try:
+        for name, arr in arrays.items():
+            np.save(os.path.join(tmp, f"{name}.npy"), np.ascontiguousarray(arr))
+        with open(os.path.join(tmp, "meta.json"), "w") as fh:
+            json.dump(meta, fh)
+        os.replace(tmp, out_dir)
+    except OSError:
+        # Another worker won the race (or the directory is read-only)
+        shutil.rmtree(tmp, ignore_errors=True)
+        if not os.path.isdir(out_dir):
+            raise
+
+
+def publish_artifact(out_dir: str, arrays: dict, meta: dict) -> None:
+    """Replace a rebuilt artifact (e.g. a search index) while workers may be opening it.
+
+    `out_dir` is a symlink to a versioned sibling (`.<name>.<hex time>`). The new
+    version is written in full and the link is swapped atomically, so a reader sees
+    either the old or the new directory, never none. The previous version is kept
+    for readers part-way through opening it; older ones are removed.
+    """
+    parent, name = os.path.split(os.path.abspath(out_dir))
+    os.makedirs(parent, exist_ok=True)
+    version = os.path.join(parent, f".{name}.{time.time_ns():016x}")
+    write_artifact(version, arrays, meta)
+    if os.path.isdir(out_dir) and not os.path.islink(out_dir):
+        # Directory from before versioning: move it aside once so the link can take its place
+        os.replace(out_dir, os.path.join(parent, f".{name}.{0:016x}"))
+    link = os.path.join(parent, f".{name}.link-{os.getpid()}")
+    if os.path.lexists(link):
+        os.remove(link)
+    os.symlink(os.path.basename(version), link)
+    os.replace(link, out_dir)
+
+    pattern = re.compile(rf"\.{re.escape(name)}\.[0-9a-f]{{16}}")
+    versions = sorted(v for v in os.listdir(parent) if pattern.fullmatch(v))
+    current = os.path.basename(os.path.realpath(out_dir))
+    for old in versions[:-2]:
+        if old != current:
+            shutil.rmtree(os.path.join(parent, old), ignore_errors=True)
+
+
+def save_risk(compiled, out_dir: str) -> None:
+    write_artifact(out_dir, {"weights": compiled.weights}, {
+        "bias": compiled.bias,
+        "feature_names": compiled.feature_names_in_,
+    })
+
+
+def save_therapy(compiled, out_dir: str) -> None:
+    write_artifact(out_dir, {name: getattr(compiled, name) for name in _THERAPY_ARRAYS}, {
+        "num_cols": compiled.num_cols,
+        "cat_cols": compiled.cat_cols,
+        "cat_categories": [[str(c) for c in cats] for cats in compiled.cat_categories],
+        "cat_lookups": [{str(k): int(v) for k, v in lookup.items()} for lookup in compiled.cat_lookups],
+        "n_cat_out": compiled.n_cat_out,
+        "max_depth": compiled.max_depth,
+        "classes": np.asarray(compiled.classes_).tolist(),
+    })
+
+
+# ---- Readers (mmap) ----
+def _read(in_dir: str, names) -> tuple[dict, dict]:
+    with open(os.path.join(in_dir, "meta.json")) as fh:
+        meta = json.load(fh)
+    arrays = {name: np.load(os.path.join(in_dir, f"{name}.npy"), mmap_mode="r") for name in names}
+    return arrays, meta
+
+
+def load_risk(in_dir: str):
+    from risk_inference import CompiledLinearModel
+
+    arrays, meta = _read(in_dir, ("weights",))
+    return CompiledLinearModel(arrays["weights"], meta["bias"], meta["feature_names"])
+
+
+def load_therapy(in_dir: str):
+    from therapy_inference import CompiledTherapyForest
+
+    a, meta = _read(in_dir, _THERAPY_ARRAYS)
+    return CompiledTherapyForest(
+        meta["num_cols"], a["means"], a["scales"], meta["cat_cols"], meta["cat_categories"],
+        meta["cat_lookups"], meta["n_cat_out"], a["feature"], a["threshold"], a["left"],
+        a["right"], a["missing_left"], a["leaf_proba"], a["roots"], meta["max_depth"], meta["classes"],
+    )
+
+
+_KINDS = {
+    "risk": (RISK_MODEL_PATH, save_risk, load_risk, "CompiledLinearModel"),
+    "therapy": (THERAPY_MODEL_PATH, save_therapy, load_therapy, "CompiledTherapyForest"),
+}
+
+
+def load_shared_model(kind: str, build_fn):
+    """Load the mmap'ed artifact for `kind`, exporting it first via `build_fn()` if needed.
+
+    `build_fn` returns the parity-checked compiled model, or the sklearn object when
+    compilation is not possible (which is then served as-is, unshared).
+    """
+    source_path, save, load, compiled_type = _KINDS[kind]
+    out_dir = artifact_dir(kind, source_path)
+    if os.path.isdir(out_dir):
+        try:
+            return load(out_dir)
+        except Exception as e:
+            logging.warning(f"[Artifacts] could not load {out_dir}, rebuilding: {e}")
+
+    model = build_fn()
+    if type(model).__name__ != compiled_type:
+        return model
+    try:
+        save(model, out_dir)
+        logging.info(f"[Artifacts] exported {kind} model to {out_dir}")
+        return load(out_dir)
+    except Exception as e:
+        logging.warning(f"[Artifacts] export failed, serving in-memory {kind} model: {e}")
+        return model
+
+
+def build_all() -> None:
+    """Export every model whose pickle is present; missing ones are built at startup instead."""
+    import joblib
+    from risk_inference import load_fast_linear_model
+    from therapy_inference import load_fast_therapy_model
+
+    compilers = {"risk": load_fast_linear_model, "therapy": load_fast_therapy_model}
+    for kind, compile_fn in compilers.items():
+        source_path = _KINDS[kind][0]
+        if not os.path.isfile(source_path):
+            # *.pkl is gitignored, so a clean checkout has none
+            logging.warning(f"[Artifacts] {source_path} not found, skipping the {kind} model")
+            continue
+        load_shared_model(kind, lambda: compile_fn(joblib.load(source_path)))
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    build_all()
@@ -0,0 +1,412 @@
+"""Rate-limit-aware scheduling of outbound calls to Groq, OpenAI and Langflow.
+
+Each provider gets token buckets for requests/min and tokens/min, a cap on
+in-flight calls whose free slots go to the highest priority waiter first
+(INTERACTIVE before BATCH), and retries of 429/5xx/connection errors with
+jittered exponential backoff (honouring Retry-After). Works for threadpool code
+(`call`, `hold`) and coroutines (`acall`) alike.
+
+A call first waits for rate tokens and only then queues for a slot, so slots
+are never held while throttled. Waiting for both is bounded by `max_wait`; past
+it the call fails fast with UpstreamBusy (a 503). Timed-out requests are not
+retried, and no retry starts after the call's overall `deadline`.
+
+Provider limits are account-wide, so the rate buckets live in a SQLite file
+(OUTBOUND_STATE_PATH) shared by every uvicorn worker; concurrency caps and
+queues stay per process.
+"""
+import os
+import time
+import heapq
+import random
+import sqlite3
+import asyncio
+import logging
+import threading
+import itertools
+from contextlib import contextmanager, asynccontextmanager
+
+INTERACTIVE = 0
+BATCH = 1
+_PRIORITY_NAMES = {INTERACTIVE: "interactive", BATCH: "batch"}
+
+
+class UpstreamRateLimited(Exception):
+    """The provider kept answering 429 after all retries."""
+
+    def __init__(self, provider: str, retry_after: float | None = None, message: str | None = None):
+        super().__init__(message or f"{provider} rate limit exceeded, retry later")
+        self.provider = provider
+        self.retry_after = retry_after
+
+
+class UpstreamBusy(UpstreamRateLimited):
+    """Our own rate limits or concurrency cap would make the call wait longer than max_wait."""
+
+    def __init__(self, provider: str, retry_after: float | None = None):
+        super().__init__(provider, retry_after, f"{provider} is busy, retry later")
+
+
+class TokenBucket:
+    """Refills `per_minute` units per minute up to one minute's worth; reservations may
+    go into debt, and the caller waits the returned number of seconds."""
+
+    def __init__(self, per_minute: float):
+        self.rate = float(per_minute) / 60.0
+        self.capacity = float(per_minute)
+        self.level = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self, amount: float) -> float:
+        if self.rate <= 0:
+            return 0.0
+        with self._lock:
+            now = time.monotonic()
+            self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+            self.updated = now
+            self.level -= min(amount, self.capacity)
+            return max(0.0, -self.level / self.rate)
+
+    def refund(self, amount: float) -> None:
+        """Return a reservation that will not be used."""
+        if self.rate <= 0:
+            return
+        with self._lock:
+            self.level = min(self.capacity, self.level + min(amount, self.capacity))
+
+
+class SharedTokenBucket(TokenBucket):
+    """TokenBucket whose level is kept in SQLite, so all worker processes draw from one budget."""
+
+    def __init__(self, per_minute: float, path: str, name: str):
+        super().__init__(per_minute)
+        self.name = name
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=10)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS token_bucket (name TEXT PRIMARY KEY, level REAL NOT NULL, updated REAL NOT NULL)"
+        )
+
+    def _adjust(self, fn) -> float:
+        # Wall clock: monotonic clocks are not comparable across processes
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                now = time.time()
+                row = self._db.execute("SELECT level, updated FROM token_bucket WHERE name = ?", (self.name,)).fetchone()
+                level = self.capacity if row is None else min(self.capacity, row[0] + max(0.0, now - row[1]) * self.rate)
+                level, result = fn(level)
+                self._db.execute("INSERT OR REPLACE INTO token_bucket (name, level, updated) VALUES (?, ?, ?)",
+                                 (self.name, level, now))
+                self._db.execute("COMMIT")
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+        return result
+
+    def reserve(self, amount: float) -> float:
+        if self.rate <= 0:
+            return 0.0
+        amount = min(amount, self.capacity)
+        return self._adjust(lambda level: (level - amount, max(0.0, (amount - level) / self.rate)))
+
+    def refund(self, amount: float) -> None:
+        if self.rate <= 0:
+            return
+        self._adjust(lambda level: (min(self.capacity, level + min(amount, self.capacity)), None))
+
+
+def _make_bucket(provider: str, kind: str, per_minute: float) -> TokenBucket:
+    """Bucket shared across workers; if the state file is unusable, a per-process one with the
+    limit split over WEB_CONCURRENCY workers."""
+    if per_minute > 0 and os.getenv("OUTBOUND_STATE_PATH", "") != "0":
+        path = os.getenv("OUTBOUND_STATE_PATH",
+                         os.path.join(os.path.dirname(os.path.abspath(__file__)), "outbound_state.sqlite"))
+        try:
+            return SharedTokenBucket(per_minute, path, f"{provider}:{kind}")
+        except sqlite3.Error as e:
+            logging.warning(f"[Outbound] shared rate state unavailable ({path}), splitting limits per worker: {e}")
+    return TokenBucket(per_minute / max(1, int(os.getenv("WEB_CONCURRENCY", "1"))))
+
+
+def _status_of(exc: BaseException) -> int | None:
+    status = getattr(exc, "status_code", None)  # groq / openai APIStatusError
+    if status is None and getattr(exc, "response", None) is not None:
+        status = getattr(exc.response, "status_code", None)  # httpx.HTTPStatusError
+    return status
+
+
+def _retry_after(exc: BaseException) -> float | None:
+    response = getattr(exc, "response", None)
+    value = response.headers.get("retry-after") if response is not None and hasattr(response, "headers") else None
+    try:
+        return float(value) if value is not None else None
+    except ValueError:
+        return None
+
+
+def _is_retryable(exc: BaseException) -> bool:
+    status = _status_of(exc)
+    if status is not None:
+        return status == 429 or status >= 500
+    # Connection resets from httpx (used by groq, openai and Langflow). Timeouts are not
+    # retried: the request already used its whole timeout and would likely do so again.
+    names = {cls.__name__ for cls in type(exc).__mro__}
+    if names & {"APITimeoutError", "TimeoutException"}:
+        return False
+    return bool(names & {"APIConnectionError", "TransportError"})
+
+
+class ProviderScheduler:
+    def __init__(self, name: str, rpm: float = 0, tpm: float = 0, max_concurrency: int = 8,
+                 max_retries: int = 4, backoff_base: float = 0.5, backoff_cap: float = 20.0,
+                 max_wait: float = 30.0, deadline: float = 120.0, requests=None, tokens=None):
+        self.name = name
+        self.requests = requests or TokenBucket(rpm)
+        self.tokens = tokens or TokenBucket(tpm)
+        self.max_concurrency = max(1, int(max_concurrency))
+        self.max_retries = max(0, int(max_retries))
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+        self.max_wait = float(max_wait)  # rate tokens + slot, per attempt
+        self.deadline = float(deadline)  # no retry starts after this many seconds
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._waiters: list = []  # heap of (priority, seq, wake_fn); wake_fn() -> False if the waiter left
+        self._seq = itertools.count()
+        self._stats = {"calls": 0, "retries": 0, "rate_limited": 0, "failures": 0, "busy": 0,
+                       "throttle_wait_ms": 0.0, "queue_wait_ms": 0.0, "max_queue_wait_ms": 0.0}
+        self._queued_by_priority = {p: 0 for p in _PRIORITY_NAMES}
+
+    # ---- concurrency slots ----
+    def _try_acquire(self, priority: int, wake_fn) -> bool:
+        with self._lock:
+            if self._in_flight < self.max_concurrency and not self._waiters:
+                self._in_flight += 1
+                return True
+            heapq.heappush(self._waiters, (priority, next(self._seq), wake_fn))
+            self._queued_by_priority[priority] += 1
+            return False
+
+    def _withdraw(self, priority: int, wake_fn) -> None:
+        """Remove a waiter that gave up (caller holds self._lock)."""
+        for i, (_, _, fn) in enumerate(self._waiters):
+            if fn is wake_fn:
+                self._waiters[i] = self._waiters[-1]
+                self._waiters.pop()
+                heapq.heapify(self._waiters)
+                self._queued_by_priority[priority] -= 1
+                return
+
+    def _busy(self, retry_after: float | None = None) -> UpstreamBusy:
+        with self._lock:
+            self._stats["busy"] += 1
+        return UpstreamBusy(self.name, retry_after)
+
+    def _release(self) -> None:
+        with self._lock:
+            # Hand the slot straight to the best waiter; in_flight is unchanged
+            while self._waiters:
+                priority, _, wake = heapq.heappop(self._waiters)
+                self._queued_by_priority[priority] -= 1
+                if wake():
+                    return
+            self._in_flight -= 1
+
+    def _record_queue_wait(self, started: float) -> None:
+        waited = (time.monotonic() - started) * 1000.0
+        with self._lock:
+            self._stats["calls"] += 1
+            self._stats["queue_wait_ms"] += waited
+            self._stats["max_queue_wait_ms"] = max(self._stats["max_queue_wait_ms"], waited)
+
+    @contextmanager
+    def slot(self, priority: int = INTERACTIVE, timeout: float | None = None):
+        """Hold one concurrency slot; UpstreamBusy if none frees up within `timeout` seconds."""
+        started = time.monotonic()
+        event = threading.Event()
+
+        def wake():  # called under self._lock
+            if event.is_set():
+                return False  # gave up waiting
+            event.set()
+            return True
+
+        if not self._try_acquire(priority, wake) and not event.wait(timeout):
+            with self._lock:
+                granted = event.is_set()
+                if not granted:
+                    event.set()
+                    self._withdraw(priority, wake)
+            if not granted:
+                raise self._busy()
+        self._record_queue_wait(started)
+        try:
+            yield
+        finally:
+            self._release()
+
+    @asynccontextmanager
+    async def aslot(self, priority: int = INTERACTIVE, timeout: float | None = None):
+        started = time.monotonic()
+        loop = asyncio.get_running_loop()
+        fut = loop.create_future()
+        state = {"granted": False, "cancelled": False}
+
+        def wake():  # called under self._lock
+            if state["cancelled"]:
+                return False
+            state["granted"] = True
+            loop.call_soon_threadsafe(lambda: fut.done() or fut.set_result(None))
+            return True
+
+        if not self._try_acquire(priority, wake):
+            try:
+                await asyncio.wait_for(fut, timeout)
+            except asyncio.TimeoutError:
+                with self._lock:
+                    granted = state["granted"]
+                    if not granted:
+                        state["cancelled"] = True
+                        self._withdraw(priority, wake)
+                if not granted:
+                    raise self._busy()
+            except asyncio.CancelledError:
+                with self._lock:
+                    granted = state["granted"]
+                    state["cancelled"] = True
+                if granted:
+                    self._release()
+                raise
+        self._record_queue_wait(started)
+        try:
+            yield
+        finally:
+            self._release()
+
+    # ---- rate limits and retries ----
+    def _admit_by(self, deadline: float) -> float:
+        return min(time.monotonic() + self.max_wait, deadline)
+
+    def _throttle_delay(self, tokens: int, admit_by: float) -> float:
+        """Reserve rate tokens; UpstreamBusy (reservation returned) if they arrive after `admit_by`."""
+        delay = max(self.requests.reserve(1), self.tokens.reserve(tokens))
+        if time.monotonic() + delay > admit_by:
+            self.requests.refund(1)
+            self.tokens.refund(tokens)
+            raise self._busy(delay)
+        with self._lock:
+            self._stats["throttle_wait_ms"] += delay * 1000.0
+        return delay
+
+    def _backoff(self, attempt: int, exc: BaseException, deadline: float) -> float | None:
+        """Seconds to wait before retrying, or None to give up."""
+        delay = None
+        if attempt < self.max_retries and _is_retryable(exc):
+            hinted = _retry_after(exc)
+            # Full jitter unless the provider said how long to wait
+            delay = min(hinted, self.backoff_cap) if hinted is not None else \
+                random.uniform(0, min(self.backoff_cap, self.backoff_base * (2 ** attempt)))
+            if time.monotonic() + delay >= deadline:
+                delay = None
+        with self._lock:
+            if delay is None:
+                self._stats["failures"] += 1
+                if _status_of(exc) == 429:
+                    self._stats["rate_limited"] += 1
+            else:
+                self._stats["retries"] += 1
+        return delay
+
+    def _give_up(self, exc: BaseException):
+        if _status_of(exc) == 429:
+            raise UpstreamRateLimited(self.name, _retry_after(exc)) from exc
+        raise exc
+
+    @contextmanager
+    def hold(self, fn, priority: int = INTERACTIVE, tokens: int = 0):
+        """Like call(), but the slot stays held until the with block exits (for streams)."""
+        deadline = time.monotonic() + self.deadline
+        for attempt in itertools.count():
+            admit_by = self._admit_by(deadline)
+            time.sleep(self._throttle_delay(tokens, admit_by))
+            with self.slot(priority, timeout=max(0.0, admit_by - time.monotonic())):
+                try:
+                    result = fn()
+                except Exception as e:
+                    error = e
+                else:
+                    yield result
+                    return
+            delay = self._backoff(attempt, error, deadline)
+            if delay is None:
+                self._give_up(error)
+            logging.info(f"[Outbound] {self.name} {type(error).__name__}, retry {attempt + 1} in {delay:.2f}s")
+            time.sleep(delay)
+
+    def call(self, fn, priority: int = INTERACTIVE, tokens: int = 0):
+        with self.hold(fn, priority, tokens) as result:
+            return result
+
+    async def acall(self, coro_fn, priority: int = INTERACTIVE, tokens: int = 0):
+        deadline = time.monotonic() + self.deadline
+        for attempt in itertools.count():
+            admit_by = self._admit_by(deadline)
+            await asyncio.sleep(self._throttle_delay(tokens, admit_by))
+            async with self.aslot(priority, timeout=max(0.0, admit_by - time.monotonic())):
+                try:
+                    return await coro_fn()
+                except Exception as e:
+                    error = e
+            delay = self._backoff(attempt, error, deadline)
+            if delay is None:
+                self._give_up(error)
+            logging.info(f"[Outbound] {self.name} {type(error).__name__}, retry {attempt + 1} in {delay:.2f}s")
+            await asyncio.sleep(delay)
+
+    def stats(self) -> dict:
+        with self._lock:
+            s = dict(self._stats)
+            s["in_flight"] = self._in_flight
+            s["queue_depth"] = len(self._waiters)
+            s["queued"] = {_PRIORITY_NAMES[p]: n for p, n in self._queued_by_priority.items()}
+        s["avg_queue_wait_ms"] = (s.pop("queue_wait_ms") / s["calls"]) if s["calls"] else 0.0
+        s["max_concurrency"] = self.max_concurrency
+        return s
+
+
+_DEFAULTS = {
+    # provider: (rpm, tpm, max_concurrency); 0 disables a bucket
+    "groq": (30, 12000, 8),
+    "openai": (3000, 1000000, 16),
+    "langflow": (0, 0, 32),
+}
+_schedulers: dict[str, ProviderScheduler] = {}
+_schedulers_lock = threading.Lock()
+
+
+def get_scheduler(provider: str) -> ProviderScheduler:
+    """Per-provider scheduler; limits come from e.g. GROQ_RPM, GROQ_TPM, GROQ_MAX_CONCURRENCY."""
+    sched = _schedulers.get(provider)
+    if sched is None:
+        with _schedulers_lock:
+            sched = _schedulers.get(provider)
+            if sched is None:
+                rpm, tpm, conc = _DEFAULTS[provider]
+                prefix = provider.upper()
+                sched = ProviderScheduler(
+                    provider,
+                    requests=_make_bucket(provider, "rpm", float(os.getenv(f"{prefix}_RPM", rpm))),
+                    tokens=_make_bucket(provider, "tpm", float(os.getenv(f"{prefix}_TPM", tpm))),
+                    max_concurrency=int(os.getenv(f"{prefix}_MAX_CONCURRENCY", conc)),
+                    max_retries=int(os.getenv("OUTBOUND_MAX_RETRIES", "4")),
+                    max_wait=float(os.getenv("OUTBOUND_MAX_WAIT", "30")),
+                    deadline=float(os.getenv("OUTBOUND_DEADLINE", "120")),
+                )
+                _schedulers[provider] = sched
+    return sched
+
+
+def outbound_stats() -> dict:
+    return {name: s.stats() for name, s in list(_schedulers.items())}
@@ -0,0 +1,308 @@
+import os
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+
+from model_artifacts import file_fingerprint, RISK_MODEL_PATH
+
+
+def features_key(features: list[float]) -> str:
+    """Stable hash of a feature vector (repr keeps full float precision)."""
+    return hashlib.sha256(",".join(repr(float(f)) for f in features).encode()).hexdigest()[:32]
+
+
+class LRUCache:
+    """Size-bounded in-process LRU with per-entry TTL."""
+
+    def __init__(self, maxsize: int = 10000, ttl: float = 300.0):
+        self.maxsize = max(1, int(maxsize))
+        self.ttl = float(ttl)
+        self._data: OrderedDict[str, tuple[float, float]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> float | None:
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            value, stored_at = item
+            if time.monotonic() - stored_at > self.ttl:
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: float) -> None:
+        with self._lock:
+            self._data[key] = (float(value), time.monotonic())
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete_where(self, predicate) -> None:
+        with self._lock:
+            for k in [k for k in self._data if predicate(k)]:
+                del self._data[k]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+class SQLiteCache:
+    """Local L2 on the shipped prediction_cache(key, value, created_at) table, in WAL mode."""
+
+    def __init__(self, path: str, ttl: float = 3600.0):
+        self.path = path
+        self.ttl = float(ttl)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS prediction_cache (
+                key TEXT PRIMARY KEY,
+                value REAL NOT NULL,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+            """
+        )
+        # Invalidation generations shared by every worker on this file ("*" = everything,
+        # "p:<id>" = one patient). Each bump takes the next value of the "#" sequence row.
+        self._conn.execute("CREATE TABLE IF NOT EXISTS cache_generation (scope TEXT PRIMARY KEY, gen INTEGER NOT NULL)")
+
+    def get(self, key: str) -> float | None:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value FROM prediction_cache WHERE key = ? AND created_at >= datetime('now', ?)",
+                (key, f"-{int(self.ttl)} seconds"),
+            ).fetchone()
+        return float(row[0]) if row else None
+
+    def set(self, key: str, value: float) -> None:
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO prediction_cache (key, value, created_at) VALUES (?, ?, CURRENT_TIMESTAMP)",
+                (key, float(value)),
+            )
+
+    def generations_since(self, seq: int | None) -> tuple[int, dict[str, int]]:
+        """(current sequence, scopes bumped after `seq`); nothing but the sequence when `seq` is None."""
+        with self._lock:
+            row = self._conn.execute("SELECT gen FROM cache_generation WHERE scope = '#'").fetchone()
+            current = row[0] if row else 0
+            if seq is None or current == seq:
+                return current, {}
+            rows = self._conn.execute(
+                "SELECT scope, gen FROM cache_generation WHERE gen > ? AND scope != '#'", (seq,)
+            ).fetchall()
+        return current, dict(rows)
+
+    def bump_generation(self, scope: str) -> int:
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.execute(
+                    "INSERT INTO cache_generation (scope, gen) VALUES ('#', 1) ON CONFLICT(scope) DO UPDATE SET gen = gen + 1"
+                )
+                gen = self._conn.execute("SELECT gen FROM cache_generation WHERE scope = '#'").fetchone()[0]
+                self._conn.execute("INSERT OR REPLACE INTO cache_generation (scope, gen) VALUES (?, ?)", (scope, gen))
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+        return gen
+
+    def delete_like(self, pattern: str) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM prediction_cache WHERE key LIKE ? ESCAPE '\\'", (pattern,))
+
+    def delete_not_prefix(self, prefix: str) -> int:
+        with self._lock:
+            cur = self._conn.execute("DELETE FROM prediction_cache WHERE substr(key, 1, ?) != ?", (len(prefix), prefix))
+            return cur.rowcount
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+class PredictionCache:
+    """Two-tier risk score cache: in-memory LRU (L1) over local SQLite (L2).
+
+    Keys are namespaced by the model artifact fingerprint and model_version, then
+    either the patient id (mirrors MySQL last_risk_score) or a feature-vector hash.
+    Patient entries use both tiers; feature-hash entries stay in L1 since they are
+    cheaper to recompute than to persist. Entries from a different model artifact
+    are purged from L2 on start-up.
+
+    L1 is per process, so with an L2 each L1 key also carries the invalidation
+    generations stored in SQLite (global, and the patient's own). An invalidation
+    in any worker bumps them, and every worker's older L1 entries stop matching.
+    Workers poll the generations at most every `generation_poll` seconds, so L1
+    hits stay in memory; another worker's invalidation is seen within that window.
+    """
+
+    def __init__(self, l1: LRUCache, l2: SQLiteCache | None, model_fingerprint: str,
+                 generation_poll: float = 0.5):
+        self.l1 = l1
+        self.l2 = l2
+        self.model_fingerprint = model_fingerprint
+        self.generation_poll = float(generation_poll)
+        self._generations: dict[str, int] = {}
+        self._generation_seq: int | None = None
+        self._generation_polled = float("-inf")
+        self._lock = threading.Lock()
+        self._stats = {"l1_hits": 0, "l2_hits": 0, "misses": 0, "sets": 0, "invalidations": 0}
+        if self.l2 is not None:
+            purged = self.l2.delete_not_prefix(f"{model_fingerprint}:")
+            if purged:
+                logging.info(f"[Cache] purged {purged} entries from a previous model artifact")
+
+    def _key(self, model_version: str, patient_id: int | None = None, features: list[float] | None = None) -> str:
+        if patient_id is not None:
+            return f"{self.model_fingerprint}:{model_version}:p:{int(patient_id)}"
+        return f"{self.model_fingerprint}:{model_version}:f:{features_key(features or [])}"
+
+    def _l1_key(self, key: str, patient_id: int | None) -> str | None:
+        """L1 key tagged with the shared generations; None if they can't be read."""
+        if self.l2 is None:
+            return key
+        with self._lock:
+            now = time.monotonic()
+            if now - self._generation_polled >= self.generation_poll:
+                try:
+                    self._generation_seq, changed = self.l2.generations_since(self._generation_seq)
+                except sqlite3.Error as e:
+                    logging.debug(f"[Cache] generation read error: {e}")
+                    return None
+                self._generations.update(changed)
+                self._generation_polled = now
+            gens = [self._generations.get("*", 0)]
+            if patient_id is not None:
+                gens.append(self._generations.get(f"p:{int(patient_id)}", 0))
+        return f"{key}@{'.'.join(map(str, gens))}"
+
+    def _count(self, name: str) -> None:
+        with self._lock:
+            self._stats[name] += 1
+
+    def get(self, model_version: str, patient_id: int | None = None, features: list[float] | None = None) -> float | None:
+        key = self._key(model_version, patient_id, features)
+        l1_key = self._l1_key(key, patient_id)
+        if l1_key is None:
+            self._count("misses")
+            return None
+        value = self.l1.get(l1_key)
+        if value is not None:
+            self._count("l1_hits")
+            return value
+        if self.l2 is not None and patient_id is not None:
+            try:
+                value = self.l2.get(key)
+            except sqlite3.Error as e:
+                logging.debug(f"[Cache] L2 read error: {e}")
+                value = None
+            if value is not None:
+                self.l1.set(l1_key, value)
+                self._count("l2_hits")
+                return value
+        self._count("misses")
+        return None
+
+    def set(self, value: float, model_version: str, patient_id: int | None = None, features: list[float] | None = None) -> None:
+        key = self._key(model_version, patient_id, features)
+        l1_key = self._l1_key(key, patient_id)
+        if l1_key is not None:
+            self.l1.set(l1_key, value)
+        if self.l2 is not None and patient_id is not None:
+            try:
+                self.l2.set(key, value)
+            except sqlite3.Error as e:
+                logging.debug(f"[Cache] L2 write error: {e}")
+        self._count("sets")
+
+    def invalidate(self, patient_id: int | None = None, model_version: str | None = None) -> None:
+        """Drop cached scores for a patient and/or model_version (everything if neither is given)."""
+        ns = f"{self.model_fingerprint}:"
+        suffix = f":p:{int(patient_id)}" if patient_id is not None else None
+
+        def matches(key: str) -> bool:
+            key = key.split("@", 1)[0]
+            if not key.startswith(ns):
+                return False
+            if model_version is not None and not key.startswith(f"{ns}{model_version}:"):
+                return False
+            return suffix is None or key.endswith(suffix)
+
+        self.l1.delete_where(matches)
+        if self.l2 is not None:
+            scope = f"p:{int(patient_id)}" if patient_id is not None else "*"
+            try:
+                gen = self.l2.bump_generation(scope)
+                with self._lock:
+                    self._generations[scope] = gen  # this worker sees it at once
+            except sqlite3.Error as e:
+                logging.warning(f"[Cache] could not publish invalidation to other workers: {e}")
+            esc = lambda v: v.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+            pattern = esc(ns) + (esc(model_version) + ":" if model_version is not None else "%:")
+            pattern += f"p:{int(patient_id)}" if patient_id is not None else "%"
+            try:
+                self.l2.delete_like(pattern)
+            except sqlite3.Error as e:
+                logging.debug(f"[Cache] L2 invalidate error: {e}")
+        self._count("invalidations")
+
+    def stats(self) -> dict:
+        with self._lock:
+            s = dict(self._stats)
+        lookups = s["l1_hits"] + s["l2_hits"] + s["misses"]
+        s["hit_rate"] = ((s["l1_hits"] + s["l2_hits"]) / lookups) if lookups else 0.0
+        s["l1_size"] = len(self.l1)
+        s["model_fingerprint"] = self.model_fingerprint
+        return s
+
+    def close(self) -> None:
+        if self.l2 is not None:
+            self.l2.close()
+
+
+_cache: PredictionCache | None = None
+_cache_lock = threading.Lock()
+
+
+def get_prediction_cache() -> PredictionCache:
+    """Process-wide risk score cache (configured via env)."""
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                base_dir = os.path.dirname(os.path.abspath(__file__))
+                l1 = LRUCache(
+                    maxsize=int(os.getenv("PREDICTION_CACHE_SIZE", "10000")),
+                    ttl=float(os.getenv("PREDICTION_CACHE_TTL", "300")),
+                )
+                l2 = None
+                if os.getenv("PREDICTION_CACHE_SQLITE", "1") != "0":
+                    path = os.getenv("PREDICTION_CACHE_PATH", os.path.join(base_dir, "prediction_cache.sqlite"))
+                    try:
+                        l2 = SQLiteCache(path, ttl=float(os.getenv("PREDICTION_CACHE_L2_TTL", "3600")))
+                    except sqlite3.Error as e:
+                        logging.warning(f"[Cache] SQLite L2 unavailable ({path}): {e}")
+                _cache = PredictionCache(
+                    l1, l2, file_fingerprint(RISK_MODEL_PATH),
+                    generation_poll=float(os.getenv("PREDICTION_CACHE_GEN_POLL_MS", "500")) / 1000.0,
+                )
+    return _cache
+
+
+def close_prediction_cache() -> None:
+    if _cache is not None:
+        _cache.close()
@@ -0,0 +1,83 @@
+import logging
+
+import numpy as np
+
+
+class CompiledLinearModel:
+    """Linear risk model reduced to a single `X @ w + b`.
+
+    Built from the fitted sklearn object at load time; any StandardScaler steps
+    in front of the estimator are folded into the weights and bias.
+    """
+
+    def __init__(self, weights: np.ndarray, bias: float, feature_names: list[str] | None = None):
+        self.weights = np.ascontiguousarray(weights, dtype=np.float64)
+        self.bias = float(bias)
+        self.n_features_in_ = int(self.weights.shape[0])
+        self.feature_names_in_ = feature_names
+
+    def predict(self, X) -> np.ndarray:
+        X = np.asarray(X, dtype=np.float64)
+        if X.ndim == 1:
+            X = X.reshape(1, -1)
+        if X.shape[1] != self.n_features_in_:
+            raise ValueError(
+                f"X has {X.shape[1]} features, but the risk model expects {self.n_features_in_}"
+            )
+        return X @ self.weights + self.bias
+
+
+def _linear_steps(model) -> list:
+    steps = [s for _, s in model.steps] if hasattr(model, "steps") else [model]
+    return [s for s in steps if s is not None and s != "passthrough"]
+
+
+def compile_linear_model(model) -> CompiledLinearModel:
+    """Fold a fitted (scaler ->) linear estimator into plain weight/bias arrays.
+
+    Raises TypeError for anything other than StandardScaler steps followed by an
+    estimator exposing 1-D `coef_` and scalar `intercept_`.
+    """
+    from sklearn.preprocessing import StandardScaler
+
+    *transforms, estimator = _linear_steps(model)
+    coef = np.asarray(getattr(estimator, "coef_", None), dtype=np.float64)
+    if coef.ndim != 1:
+        raise TypeError(f"Unsupported estimator for compilation: {type(estimator).__name__}")
+    weights = coef.copy()
+    bias = float(np.ravel(estimator.intercept_)[0])
+
+    # Walk the transforms backwards: w' = w / scale, b' = b - (mean / scale) . w
+    for step in reversed(transforms):
+        if not isinstance(step, StandardScaler):
+            raise TypeError(f"Unsupported pipeline step for compilation: {type(step).__name__}")
+        if step.scale_ is not None:
+            weights = weights / step.scale_
+        if step.mean_ is not None:
+            bias -= float(step.mean_ @ weights)
+
+    names = getattr(model, "feature_names_in_", None)
+    return CompiledLinearModel(weights, bias, list(names) if names is not None else None)
+
+
+def check_parity(compiled: CompiledLinearModel, reference, n_rows: int = 64, tol: float = 1e-9) -> bool:
+    """Compare compiled and sklearn predictions on random probe rows."""
+    rng = np.random.default_rng(0)
+    X = rng.normal(loc=5.0, scale=3.0, size=(n_rows, compiled.n_features_in_))
+    ours = compiled.predict(X)
+    theirs = np.asarray(reference.predict(X), dtype=np.float64)
+    return bool(np.allclose(ours, theirs, rtol=tol, atol=tol))
+
+
+def load_fast_linear_model(model):
+    """Return a compiled model when it reproduces sklearn exactly, else the original."""
+    try:
+        compiled = compile_linear_model(model)
+    except Exception as e:
+        logging.warning(f"[Risk] NumPy fast path unavailable, using sklearn: {e}")
+        return model
+    if not check_parity(compiled, model):
+        logging.warning("[Risk] NumPy fast path failed parity check, using sklearn")
+        return model
+    logging.info(f"[Risk] Compiled linear model ({compiled.n_features_in_} features) for NumPy inference")
+    return compiled
@@ -0,0 +1,165 @@
+import os
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+
+def rag_version_path() -> str:
+    base_dir = os.path.dirname(os.path.abspath(__file__))
+    return os.getenv("RAG_VERSION_FILE", os.path.join(base_dir, "ingest_state", "rag_version"))
+
+
+def read_rag_version() -> str:
+    """Corpus version marker shared by all workers ("" until the first bump)."""
+    try:
+        with open(rag_version_path()) as fh:
+            return fh.read().strip()
+    except OSError:
+        return ""
+
+
+def bump_rag_version() -> str:
+    """Write a new corpus version; every worker's answer cache drops on its next lookup."""
+    path = rag_version_path()
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    version = f"{time.time_ns():x}-{os.getpid()}"
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "w") as fh:
+        fh.write(version)
+    os.replace(tmp, path)
+    return version
+
+
+def _scope_hash(text: str) -> int:
+    return int.from_bytes(hashlib.sha256(text.encode()).digest()[:8], "little", signed=True)
+
+
+class SemanticAnswerCache:
+    """In-process cache of RAG answers looked up by query-embedding similarity.
+
+    An entry is (normalised query embedding, retrieved chunk ids, answer) plus a
+    scope hash (the patient context the answer was grounded on). A lookup hits
+    when an unexpired entry in the same scope has cosine similarity >= threshold.
+    Entries are evicted LRU at capacity, and all of them are dropped when the
+    retrieval index version changes (re-ingest).
+    """
+
+    def __init__(self, capacity: int = 1000, ttl: float = 3600.0, threshold: float = 0.95):
+        self.capacity = max(1, int(capacity))
+        self.ttl = float(ttl)
+        self.threshold = float(threshold)
+        self._lock = threading.Lock()
+        self._vecs: np.ndarray | None = None  # (capacity, dim), allocated on first put
+        self._scope = np.zeros(self.capacity, dtype=np.int64)
+        self._stored_at = np.zeros(self.capacity, dtype=np.float64)
+        self._valid = np.zeros(self.capacity, dtype=bool)
+        self._entries: list[dict | None] = [None] * self.capacity
+        self._lru: OrderedDict[int, None] = OrderedDict()
+        self._index_version: str | None = None
+        self._stats = {"hits": 0, "misses": 0, "sets": 0, "evictions": 0, "invalidations": 0}
+
+    def _check_version(self, index_version: str) -> None:
+        if index_version != self._index_version:
+            if self._index_version is not None:
+                self._clear()
+            self._index_version = index_version
+
+    def _clear(self) -> None:
+        self._valid[:] = False
+        self._entries = [None] * self.capacity
+        self._lru.clear()
+        self._stats["invalidations"] += 1
+
+    def _best(self, q: np.ndarray, scope: int) -> tuple[int, float]:
+        if self._vecs is None or self._vecs.shape[1] != q.shape[0]:
+            return -1, -1.0
+        live = self._valid & (self._scope == scope) & (time.monotonic() - self._stored_at <= self.ttl)
+        slots = np.flatnonzero(live)
+        if not slots.size:
+            return -1, -1.0
+        scores = self._vecs[slots] @ q
+        i = int(np.argmax(scores))
+        return int(slots[i]), float(scores[i])
+
+    @staticmethod
+    def _unit(vector) -> np.ndarray:
+        q = np.asarray(vector, dtype=np.float32).reshape(-1)
+        norm = np.linalg.norm(q)
+        return q / norm if norm else q
+
+    def get(self, vector, scope_text: str, index_version: str) -> dict | None:
+        q = self._unit(vector)
+        with self._lock:
+            self._check_version(index_version)
+            slot, score = self._best(q, _scope_hash(scope_text))
+            if slot < 0 or score < self.threshold:
+                self._stats["misses"] += 1
+                return None
+            self._lru.move_to_end(slot)
+            self._stats["hits"] += 1
+            return self._entries[slot]["answer"]
+
+    def set(self, vector, scope_text: str, index_version: str, answer: dict, chunk_ids: list[str]) -> None:
+        q = self._unit(vector)
+        scope = _scope_hash(scope_text)
+        with self._lock:
+            self._check_version(index_version)
+            if self._vecs is None or self._vecs.shape[1] != q.shape[0]:
+                self._vecs = np.zeros((self.capacity, q.shape[0]), dtype=np.float32)
+                self._valid[:] = False
+                self._lru.clear()
+            # A near-identical query in the same scope is refreshed rather than duplicated
+            slot, score = self._best(q, scope)
+            if slot < 0 or score < self.threshold:
+                free = np.flatnonzero(~self._valid)
+                if free.size:
+                    slot = int(free[0])
+                else:
+                    slot, _ = self._lru.popitem(last=False)
+                    self._stats["evictions"] += 1
+            self._vecs[slot] = q
+            self._scope[slot] = scope
+            self._stored_at[slot] = time.monotonic()
+            self._valid[slot] = True
+            self._entries[slot] = {"answer": answer, "chunk_ids": list(chunk_ids)}
+            self._lru[slot] = None
+            self._lru.move_to_end(slot)
+            self._stats["sets"] += 1
+
+    def invalidate(self) -> None:
+        with self._lock:
+            self._clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            s = dict(self._stats)
+            s["size"] = int(self._valid.sum())
+            s["index_version"] = self._index_version
+        lookups = s["hits"] + s["misses"]
+        s["hit_rate"] = (s["hits"] / lookups) if lookups else 0.0
+        s["threshold"] = self.threshold
+        s["capacity"] = self.capacity
+        return s
+
+
+_answer_cache: SemanticAnswerCache | None = None
+_answer_cache_lock = threading.Lock()
+
+
+def get_answer_cache() -> SemanticAnswerCache | None:
+    """Process-wide RAG answer cache (RAG_ANSWER_CACHE=0 disables it)."""
+    global _answer_cache
+    if os.getenv("RAG_ANSWER_CACHE", "1") == "0":
+        return None
+    if _answer_cache is None:
+        with _answer_cache_lock:
+            if _answer_cache is None:
+                _answer_cache = SemanticAnswerCache(
+                    capacity=int(os.getenv("RAG_ANSWER_CACHE_SIZE", "1000")),
+                    ttl=float(os.getenv("RAG_ANSWER_CACHE_TTL", "3600")),
+                    threshold=float(os.getenv("RAG_ANSWER_CACHE_THRESHOLD", "0.95")),
+                )
+    return _answer_cache
@@ -0,0 +1,89 @@
+import json
+import asyncio
+import hashlib
+import threading
+from concurrent.futures import Future
+
+
+def request_key(*parts) -> str:
+    """Canonical hash of a request (dict key order and whitespace do not matter)."""
+    payload = json.dumps(parts, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+class SingleFlight:
+    """Coalesces identical concurrent calls: the first caller for a key runs the
+    upstream call, callers arriving while it is in flight share its result (or
+    exception). Nothing is cached once the call completes.
+
+    `do` is for coroutines on the event loop, `do_sync` for threadpool endpoints.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._async: dict[str, asyncio.Future] = {}
+        self._sync: dict[str, Future] = {}
+        self._stats: dict[str, dict] = {}
+
+    def _count(self, name: str, shared: bool) -> None:
+        with self._lock:
+            s = self._stats.setdefault(name, {"calls": 0, "executions": 0, "saved": 0})
+            s["calls"] += 1
+            s["saved" if shared else "executions"] += 1
+
+    async def do(self, name: str, key: str, coro_fn):
+        key = f"{name}:{key}"
+        fut = self._async.get(key)
+        if fut is not None:
+            self._count(name, shared=True)
+            # shield: a disconnecting follower must not cancel the leader's call
+            return await asyncio.shield(fut)
+        self._count(name, shared=False)
+        fut = asyncio.get_running_loop().create_future()
+        self._async[key] = fut
+        try:
+            result = await coro_fn()
+        except BaseException as e:
+            fut.set_exception(e)
+            fut.exception()  # mark retrieved when there are no followers
+            raise
+        else:
+            fut.set_result(result)
+            return result
+        finally:
+            self._async.pop(key, None)
+
+    def do_sync(self, name: str, key: str, fn):
+        key = f"{name}:{key}"
+        with self._lock:
+            fut = self._sync.get(key)
+            leader = fut is None
+            if leader:
+                fut = self._sync[key] = Future()
+        self._count(name, shared=not leader)
+        if not leader:
+            return fut.result()
+        try:
+            result = fn()
+        except BaseException as e:
+            fut.set_exception(e)
+            raise
+        else:
+            fut.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                self._sync.pop(key, None)
+
+    def stats(self) -> dict:
+        with self._lock:
+            out = {name: dict(s) for name, s in self._stats.items()}
+            in_flight = len(self._async) + len(self._sync)
+        return {"in_flight": in_flight, "by_endpoint": out, "saved": sum(s["saved"] for s in out.values())}
+
+
+_single_flight = SingleFlight()
+
+
+def get_single_flight() -> SingleFlight:
+    return _single_flight
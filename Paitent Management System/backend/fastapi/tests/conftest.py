@@ -0,0 +1,11 @@
+import os
+import sys
+
+# The service modules import each other as siblings (see startup.sh)
+FASTAPI_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+REPO_ROOT = os.path.abspath(os.path.join(FASTAPI_DIR, "..", "..", ".."))
+THERAPY_DIR = os.path.join(REPO_ROOT, "Therapy Effectiveness Model")
+SYNTHETIC_CSV = os.path.join(THERAPY_DIR, "therapy_effectiveness_synthetic.csv")
+
+if FASTAPI_DIR not in sys.path:
+    sys.path.insert(0, FASTAPI_DIR)
@@ -0,0 +1,50 @@
+"""Cohort HbA1c forecasts vs the per-patient forecast_metric, on the synthetic CSV."""
+import sys
+
+import numpy as np
+import pytest
+
+from conftest import SYNTHETIC_CSV, THERAPY_DIR
+
+pd = pytest.importorskip("pandas")
+pytest.importorskip("statsmodels")
+
+from cohort_forecast import forecast_cohort
+
+if THERAPY_DIR not in sys.path:
+    sys.path.append(THERAPY_DIR)
+try:
+    import therapy_effectiveness_final as tef
+except (ImportError, FileNotFoundError) as e:  # the script looks for its CSV under /content
+    pytest.skip(f"therapy_effectiveness_final unavailable: {e}", allow_module_level=True)
+
+HBA1C = ["HbA1c1", "HbA1c2", "HbA1c3"]
+
+
+@pytest.fixture(scope="module")
+def dataset():
+    df = pd.read_csv(SYNTHETIC_CSV)
+    # Every row has all three visits; drop one on some rows for the 2-visit path
+    df.loc[df.index % 10 == 3, "HbA1c3"] = np.nan
+    df.loc[df.index % 10 == 7, "HbA1c2"] = np.nan
+    return df
+
+
+@pytest.mark.parametrize("steps", [1, 2])
+def test_batch_matches_forecast_metric(dataset, steps):
+    fcs = forecast_cohort(dataset[HBA1C].to_numpy(dtype=float), steps=steps)
+    for i, (_, row) in enumerate(dataset.iterrows()):
+        series_hba1c, _ = tef._patient_series(row)
+        fc, ci = tef._cohort_row_forecast(fcs, i, series_hba1c)
+        ref_fc, ref_ci = tef.forecast_metric(series_hba1c, steps=steps)
+        pd.testing.assert_series_equal(fc, ref_fc, check_exact=False, rtol=0, atol=1e-9)
+        pd.testing.assert_frame_equal(ci, ref_ci, check_exact=False, rtol=0, atol=1e-9)
+
+
+def test_linear_matches_polyfit(dataset):
+    H = dataset[HBA1C].to_numpy(dtype=float)
+    mean = forecast_cohort(H, steps=2, method="linear").mean
+    for i, row in enumerate(H):
+        values = row[~np.isnan(row)]
+        a, b = np.polyfit(np.arange(len(values), dtype=float), values, 1)
+        np.testing.assert_allclose(mean[i], a * np.arange(len(values), len(values) + 2) + b, rtol=0, atol=1e-9)
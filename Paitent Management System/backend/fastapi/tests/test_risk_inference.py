@@ -0,0 +1,43 @@
+"""Compiled risk model vs the shipped sklearn pickles."""
+import os
+import warnings
+
+import numpy as np
+import pytest
+
+from conftest import FASTAPI_DIR
+
+joblib = pytest.importorskip("joblib")
+pytest.importorskip("sklearn")
+
+from risk_inference import CompiledLinearModel, compile_linear_model, load_fast_linear_model
+
+
+def _load(name: str):
+    path = os.path.join(FASTAPI_DIR, name)
+    if not os.path.exists(path):
+        pytest.skip(f"{name} not present")
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")  # pickles may come from another sklearn version
+        return joblib.load(path)
+
+
+@pytest.mark.parametrize("name", ["lasso_model.pkl", "ridge_best_model_1.pkl"])
+def test_compiled_matches_sklearn(name):
+    model = _load(name)
+    compiled = compile_linear_model(model)
+    X = np.random.default_rng(1).normal(loc=5.0, scale=3.0, size=(500, compiled.n_features_in_))
+
+    np.testing.assert_allclose(compiled.predict(X), model.predict(X), rtol=1e-9, atol=1e-9)
+    np.testing.assert_allclose(compiled.predict(X[0]), model.predict(X[:1]), rtol=1e-9, atol=1e-9)
+
+
+def test_service_model_loads_compiled():
+    # main.get_ridge_model serves lasso_model.pkl through this loader
+    assert isinstance(load_fast_linear_model(_load("lasso_model.pkl")), CompiledLinearModel)
+
+
+def test_wrong_width_rejected():
+    compiled = compile_linear_model(_load("lasso_model.pkl"))
+    with pytest.raises(ValueError):
+        compiled.predict(np.zeros((2, compiled.n_features_in_ + 1)))
@@ -0,0 +1,66 @@
+"""Compiled therapy forest vs the shipped sklearn pipeline."""
+import os
+import warnings
+
+import numpy as np
+import pytest
+
+from conftest import FASTAPI_DIR, SYNTHETIC_CSV
+
+joblib = pytest.importorskip("joblib")
+pd = pytest.importorskip("pandas")
+pytest.importorskip("sklearn")
+
+from therapy_inference import CompiledTherapyForest, _probe_frame, compile_therapy_pipeline, load_fast_therapy_model
+
+MODEL_PATH = os.path.join(FASTAPI_DIR, "therapy_effectiveness_model.pkl")
+
+
+@pytest.fixture(scope="module")
+def pipe():
+    if not os.path.exists(MODEL_PATH):
+        pytest.skip("therapy_effectiveness_model.pkl not present")
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")  # pickles may come from another sklearn version
+        return joblib.load(MODEL_PATH)
+
+
+@pytest.fixture(scope="module")
+def compiled(pipe):
+    return compile_therapy_pipeline(pipe)
+
+
+@pytest.fixture(scope="module")
+def dataset(pipe):
+    if not os.path.exists(SYNTHETIC_CSV):
+        pytest.skip("therapy_effectiveness_synthetic.csv not present")
+    return pd.read_csv(SYNTHETIC_CSV)[list(pipe.feature_names_in_)]
+
+
+def _sklearn_proba(pipe, df):
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        return pipe.predict_proba(df[list(pipe.feature_names_in_)])
+
+
+def test_dataset_rows_match_sklearn(pipe, compiled, dataset):
+    # batch_loader is unset, so every size goes through the flat arrays
+    assert np.array_equal(compiled.predict_proba(dataset), _sklearn_proba(pipe, dataset))
+    assert np.array_equal(compiled.predict(dataset.iloc[:1]), pipe.predict(dataset.iloc[:1]))
+
+
+def test_probe_rows_match_sklearn(pipe, compiled):
+    # NaNs, the dropped category and unseen categories
+    df = _probe_frame(compiled, 512)
+    assert np.array_equal(compiled.predict_proba(df), _sklearn_proba(pipe, df))
+
+
+def test_large_batches_use_sklearn(pipe, dataset):
+    fast = load_fast_therapy_model(pipe)
+    assert isinstance(fast, CompiledTherapyForest)
+    fast.batch_threshold = 100
+    fast.batch_loader = lambda: pipe
+    assert np.array_equal(fast.predict_proba(dataset.iloc[:50]), _sklearn_proba(pipe, dataset.iloc[:50]))
+    assert fast._batch_model is None
+    assert np.array_equal(fast.predict_proba(dataset), _sklearn_proba(pipe, dataset))
+    assert fast._batch_model is pipe
@@ -0,0 +1,220 @@
+import logging
+import threading
+
+import numpy as np
+import pandas as pd
+
+
+class CompiledTherapyForest:
+    """Flat-array evaluator for the therapy ColumnTransformer -> RandomForest pipeline.
+
+    Preprocessing is reduced to scaler means/scales and one-hot lookup tables;
+    all trees are concatenated into contiguous node arrays (feature, threshold,
+    children, missing-value direction, normalised leaf probabilities) and
+    traversed together for every row.
+
+    That wins for single rows and small batches, but its working set grows as
+    rows x trees. Batches above `batch_threshold` rows go to the sklearn pipeline
+    returned by `batch_loader` (loaded on first use) when one is set.
+    """
+
+    batch_threshold = 256
+
+    def __init__(self, num_cols, means, scales, cat_cols, cat_categories, cat_lookups, n_cat_out,
+                 feature, threshold, left, right, missing_left, leaf_proba, roots, max_depth, classes):
+        self.num_cols = list(num_cols)
+        self.means = np.ascontiguousarray(means, dtype=np.float64)
+        self.scales = np.ascontiguousarray(scales, dtype=np.float64)
+        self.cat_cols = list(cat_cols)
+        self.cat_categories = [list(c) for c in cat_categories]
+        self.cat_lookups = cat_lookups  # per column: {category: output offset}, dropped/unknown -> absent
+        self.n_cat_out = int(n_cat_out)
+        self.feature = np.ascontiguousarray(feature, dtype=np.intp)
+        self.threshold = np.ascontiguousarray(threshold, dtype=np.float64)
+        self.left = np.ascontiguousarray(left, dtype=np.intp)
+        self.right = np.ascontiguousarray(right, dtype=np.intp)
+        self.missing_left = np.ascontiguousarray(missing_left, dtype=bool)
+        self.leaf_proba = np.ascontiguousarray(leaf_proba, dtype=np.float64)
+        self.roots = np.ascontiguousarray(roots, dtype=np.intp)
+        self.max_depth = int(max_depth)
+        self.classes_ = np.asarray(classes)
+        self.feature_names_in_ = np.asarray(self.num_cols + self.cat_cols, dtype=object)
+        self.batch_loader = None
+        self._batch_model = None
+        self._batch_lock = threading.Lock()
+
+    def _sklearn(self):
+        if self._batch_model is None:
+            with self._batch_lock:
+                if self._batch_model is None:
+                    self._batch_model = self.batch_loader()
+        return self._batch_model
+
+    def transform(self, df: pd.DataFrame) -> np.ndarray:
+        """ColumnTransformer equivalent: scaled numerics followed by one-hot columns."""
+        n = len(df)
+        X = np.empty((n, len(self.num_cols) + self.n_cat_out), dtype=np.float64)
+        num = df[self.num_cols].to_numpy(dtype=np.float64, na_value=np.nan)
+        X[:, :len(self.num_cols)] = (num - self.means) / self.scales
+        X[:, len(self.num_cols):] = 0.0
+        base = len(self.num_cols)
+        rows = np.arange(n)
+        for col, lookup in zip(self.cat_cols, self.cat_lookups):
+            pos = np.fromiter((lookup.get(v, -1) for v in df[col].tolist()), dtype=np.intp, count=n)
+            hit = pos >= 0
+            X[rows[hit], base + pos[hit]] = 1.0
+        return X
+
+    def _leaves(self, X32: np.ndarray) -> np.ndarray:
+        n, n_features = X32.shape
+        n_trees = self.roots.shape[0]
+        node = np.tile(self.roots, n)  # flat (row, tree) -> current node
+        x_flat = X32.ravel()
+        x_base = np.repeat(np.arange(n, dtype=np.intp) * n_features, n_trees)
+        active = np.arange(node.shape[0])
+        # Only (row, tree) pairs still sitting on an internal node are advanced
+        while active.size:
+            cur = node[active]
+            left = self.left[cur]
+            internal = left >= 0
+            active, cur, left = active[internal], cur[internal], left[internal]
+            if not active.size:
+                break
+            x = x_flat[x_base[active] + self.feature[cur]]
+            go_left = np.where(np.isnan(x), self.missing_left[cur], x <= self.threshold[cur])
+            node[active] = np.where(go_left, left, self.right[cur])
+        return node.reshape(n, n_trees)
+
+    def predict_proba(self, df: pd.DataFrame) -> np.ndarray:
+        if self.batch_loader is not None and len(df) > self.batch_threshold:
+            pipe = self._sklearn()
+            return pipe.predict_proba(df[list(getattr(pipe, "feature_names_in_", df.columns))])
+        # Trees compare float32 features against float64 thresholds, as sklearn does
+        X32 = self.transform(df).astype(np.float32)
+        leaves = self._leaves(X32)
+        out = np.zeros((X32.shape[0], self.leaf_proba.shape[1]), dtype=np.float64)
+        # Accumulate tree by tree to keep sklearn's summation order
+        for t in range(leaves.shape[1]):
+            out += self.leaf_proba[leaves[:, t]]
+        out /= leaves.shape[1]
+        return out
+
+    def predict(self, df: pd.DataFrame) -> np.ndarray:
+        return self.classes_.take(np.argmax(self.predict_proba(df), axis=1))
+
+
+def compile_therapy_pipeline(pipe) -> CompiledTherapyForest:
+    """Extract flat arrays from the fitted therapy pipeline.
+
+    Raises TypeError if the pipeline is not StandardScaler + OneHotEncoder in a
+    ColumnTransformer followed by a single-output RandomForestClassifier.
+    """
+    from sklearn.compose import ColumnTransformer
+    from sklearn.ensemble import RandomForestClassifier
+    from sklearn.preprocessing import OneHotEncoder, StandardScaler
+
+    pre = pipe.named_steps.get("preprocessor")
+    rf = pipe.named_steps.get("classifier")
+    if not isinstance(pre, ColumnTransformer) or not isinstance(rf, RandomForestClassifier):
+        raise TypeError("Expected preprocessor ColumnTransformer and RandomForestClassifier steps")
+    if rf.n_outputs_ != 1:
+        raise TypeError("Multi-output forests are not supported")
+
+    num_cols, cat_cols, means, scales, cat_categories, cat_lookups = [], [], None, None, [], []
+    n_cat_out = 0
+    for name, trans, cols in pre.transformers_:
+        if name == "remainder":
+            if trans != "drop":
+                raise TypeError("ColumnTransformer remainder must be 'drop'")
+            continue
+        if isinstance(trans, StandardScaler):
+            if num_cols:
+                raise TypeError("Only one StandardScaler block is supported")
+            num_cols = list(cols)
+            means = trans.mean_ if trans.mean_ is not None else np.zeros(len(cols))
+            scales = trans.scale_ if trans.scale_ is not None else np.ones(len(cols))
+        elif isinstance(trans, OneHotEncoder):
+            if trans.handle_unknown != "ignore" or getattr(trans, "_infrequent_enabled", False):
+                raise TypeError("OneHotEncoder must use handle_unknown='ignore' without infrequent categories")
+            drop_idx = trans.drop_idx_ if trans.drop_idx_ is not None else [None] * len(cols)
+            for cats, drop in zip(trans.categories_, drop_idx):
+                lookup = {}
+                for j, cat in enumerate(cats):
+                    if drop is not None and j == drop:
+                        continue
+                    lookup[cat] = n_cat_out
+                    n_cat_out += 1
+                cat_lookups.append(lookup)
+                cat_categories.append(cats)
+            cat_cols = list(cols)
+        else:
+            raise TypeError(f"Unsupported transformer: {type(trans).__name__}")
+    if not num_cols:
+        raise TypeError("Pipeline has no StandardScaler block")
+
+    # Concatenate every tree's node arrays with a global offset
+    feature, threshold, left, right, missing_left, leaf_proba, roots = [], [], [], [], [], [], []
+    offset = 0
+    max_depth = 0
+    for est in rf.estimators_:
+        tree = est.tree_
+        is_leaf = tree.children_left < 0
+        feature.append(np.where(is_leaf, 0, tree.feature))
+        threshold.append(tree.threshold)
+        left.append(np.where(is_leaf, -1, tree.children_left + offset))
+        right.append(np.where(is_leaf, -1, tree.children_right + offset))
+        missing_left.append(np.asarray(tree.missing_go_to_left, dtype=bool))
+        values = tree.value[:, 0, :rf.n_classes_].astype(np.float64)
+        normalizer = values.sum(axis=1)[:, None]
+        normalizer[normalizer == 0.0] = 1.0
+        leaf_proba.append(values / normalizer)
+        roots.append(offset)
+        offset += tree.node_count
+        max_depth = max(max_depth, tree.max_depth)
+
+    return CompiledTherapyForest(
+        num_cols, means, scales, cat_cols, cat_categories, cat_lookups, n_cat_out,
+        np.concatenate(feature), np.concatenate(threshold), np.concatenate(left),
+        np.concatenate(right), np.concatenate(missing_left), np.concatenate(leaf_proba),
+        np.asarray(roots), max_depth, rf.classes_,
+    )
+
+
+def _probe_frame(compiled: CompiledTherapyForest, n_rows: int) -> pd.DataFrame:
+    rng = np.random.default_rng(0)
+    data = {}
+    for col, mu, sd in zip(compiled.num_cols, compiled.means, compiled.scales):
+        vals = rng.normal(mu, sd * 1.5, size=n_rows)
+        vals[rng.random(n_rows) < 0.05] = np.nan
+        data[col] = vals
+    for col, cats in zip(compiled.cat_cols, compiled.cat_categories):
+        # Include the dropped category and an unknown one
+        choices = list(cats) + ["__unknown__"]
+        data[col] = rng.choice(np.asarray(choices, dtype=object), size=n_rows)
+    return pd.DataFrame(data)
+
+
+def check_parity(compiled: CompiledTherapyForest, pipe, n_rows: int = 256) -> bool:
+    """Strict probability parity against the sklearn pipeline on probe rows."""
+    import warnings
+
+    df = _probe_frame(compiled, n_rows)
+    ordered = df[list(getattr(pipe, "feature_names_in_", df.columns))]
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        theirs = pipe.predict_proba(ordered)
+    return bool(np.array_equal(compiled.predict_proba(df), theirs))
+
+
+def load_fast_therapy_model(pipe):
+    """Return the compiled evaluator when it matches sklearn exactly, else the pipeline."""
+    try:
+        compiled = compile_therapy_pipeline(pipe)
+    except Exception as e:
+        logging.warning(f"[Therapy] Flat-array evaluator unavailable, using sklearn: {e}")
+        return pipe
+    if not check_parity(compiled, pipe):
+        logging.warning("[Therapy] Flat-array evaluator failed parity check, using sklearn")
+        return pipe
+    logging.info(f"[Therapy] Compiled {len(compiled.roots)} trees ({len(compiled.feature)} nodes) for NumPy inference")
+    return compiled
@@ -0,0 +1,162 @@
+"""Patient glycemic trend plots: Agg-only rendering, content-hash caching, process pool.
+
+A plot is described by a plain dict spec (see `trend_spec`). A hash of the spec
+and PLOT_VERSION is stored in the PNG's metadata, and `render` leaves a file alone
+when that hash is unchanged. Each process or thread draws on one reused Figure,
+without pyplot, so no GUI backend or global figure state is involved.
+
+Used by "Therapy Effectiveness Model/therapy_effectiveness_final.py" and served
+by the service at GET /trend-plots/{patient_id}. The two number patients
+differently (dataset Patient_ID vs MySQL patients.id), so each writes to its own
+subdirectory of `trend_plots_dir()`.
+"""
+import os
+import json
+import struct
+import hashlib
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+PLOT_VERSION = "1"  # bump when the drawing changes so cached PNGs are re-rendered
+_KEY_FIELD = "TrendPlotKey"
+
+
+def trend_plots_dir(source: str) -> str:
+    """Plots for one patient-id namespace ("dataset" or "patients") under TREND_PLOTS_DIR,
+    else under plots/ next to this module (fastapi/plots, or /content/plots in Colab)."""
+    root = os.getenv("TREND_PLOTS_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "plots"))
+    return os.path.join(root, source)
+
+
+def patient_plot_name(patient_id: int) -> str:
+    return f"patient_{int(patient_id)}_glycemic_trend.png"
+
+
+def patient_plot_title(patient_id: int) -> str:
+    return f"Patient {int(patient_id)} — Glycemic Trend and Forecast"
+
+
+def _iso(values) -> list[str]:
+    return [str(np.datetime64(v, "D")) for v in values]
+
+
+def _floats(values) -> list[float]:
+    # Rounded so numerically identical forecasts from different code paths hash the same
+    return [round(float(v), 9) if v is not None else float("nan") for v in values]
+
+
+def trend_spec(series_hba1c, series_fpg, fc, ci, title: str) -> dict:
+    """Spec from the pandas objects make_patient_plot / forecast_metric produce."""
+    return {
+        "title": title,
+        "x": _iso(series_hba1c.index),
+        "hba1c": _floats(series_hba1c.values),
+        "fpg": _floats(series_fpg.values),
+        "forecast_x": _iso(fc.index),
+        "forecast": _floats(fc.values),
+        "lower": _floats(ci["lower"].values),
+        "upper": _floats(ci["upper"].values),
+    }
+
+
+def plot_key(spec: dict) -> str:
+    payload = json.dumps([PLOT_VERSION, spec], sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def stored_key(path: str) -> str | None:
+    """Hash recorded in a PNG's tEXt chunks (read up to the image data only)."""
+    try:
+        with open(path, "rb") as fh:
+            if fh.read(8) != b"\x89PNG\r\n\x1a\n":
+                return None
+            while True:
+                header = fh.read(8)
+                if len(header) < 8:
+                    return None
+                length, ctype = struct.unpack(">I4s", header)
+                if ctype in (b"IDAT", b"IEND"):
+                    return None
+                data = fh.read(length)
+                fh.seek(4, os.SEEK_CUR)  # CRC
+                if ctype == b"tEXt":
+                    keyword, _, text = data.partition(b"\x00")
+                    if keyword.decode("latin-1") == _KEY_FIELD:
+                        return text.decode("latin-1")
+    except OSError:
+        return None
+
+
+class TrendPlotRenderer:
+    """One reusable Agg figure; not thread-safe, use get_renderer() per thread."""
+
+    def __init__(self, figsize=(9, 5), dpi: int = 100):
+        from matplotlib import dates
+        from matplotlib.figure import Figure
+        from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+        self.fig = Figure(figsize=figsize, dpi=dpi)
+        FigureCanvasAgg(self.fig)
+        self.ax = self.fig.add_subplot()
+        self._dates = dates
+        self.rendered = 0
+        self.skipped = 0
+
+    def _draw(self, spec: dict) -> None:
+        ax = self.ax
+        ax.clear()
+        x = np.array(spec["x"], dtype="datetime64[D]")
+        fx = np.array(spec["forecast_x"], dtype="datetime64[D]")
+        ax.plot(x, spec["hba1c"], marker="o", label="HbA1c")
+        ax.plot(x, spec["fpg"], marker="o", linestyle="--", label="FPG")
+        ax.plot(fx, spec["forecast"], marker="x", linestyle="--", label="HbA1c forecast")
+        ax.fill_between(fx, spec["lower"], spec["upper"], alpha=0.2)
+        locator = self._dates.AutoDateLocator()
+        ax.xaxis.set_major_locator(locator)
+        ax.xaxis.set_major_formatter(self._dates.ConciseDateFormatter(locator))
+        ax.set_title(spec["title"])
+        ax.set_xlabel("Visit Date"); ax.set_ylabel("Value")
+        ax.legend(); ax.grid(True)
+        self.fig.tight_layout()
+
+    def render(self, spec: dict, out_path: str, force: bool = False) -> bool:
+        """Write the plot unless `out_path` already holds this spec; True if rendered."""
+        key = plot_key(spec)
+        if not force and stored_key(out_path) == key:
+            self.skipped += 1
+            return False
+        self._draw(spec)
+        tmp = f"{out_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        self.fig.savefig(tmp, format="png", metadata={_KEY_FIELD: key})
+        os.replace(tmp, out_path)
+        self.rendered += 1
+        return True
+
+
+_local = threading.local()
+
+
+def get_renderer() -> TrendPlotRenderer:
+    renderer = getattr(_local, "renderer", None)
+    if renderer is None:
+        renderer = _local.renderer = TrendPlotRenderer()
+    return renderer
+
+
+def _render_job(job: tuple[dict, str, bool]) -> bool:
+    spec, out_path, force = job
+    return get_renderer().render(spec, out_path, force)
+
+
+def render_plots(jobs: list[tuple[dict, str]], workers: int | None = None, force: bool = False) -> dict:
+    """Render (spec, out_path) jobs on a process pool; unchanged plots are skipped up front."""
+    todo = [(spec, path, force) for spec, path in jobs if force or stored_key(path) != plot_key(spec)]
+    workers = workers or max(1, (os.cpu_count() or 2) - 1)
+    if workers <= 1 or len(todo) < 2:
+        rendered = sum(_render_job(job) for job in todo)
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            rendered = sum(pool.map(_render_job, todo, chunksize=max(1, len(todo) // (workers * 4))))
+    return {"rendered": rendered, "skipped": len(jobs) - len(todo)}
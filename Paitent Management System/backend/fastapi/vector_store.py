@@ -0,0 +1,256 @@
+"""Local on-disk ANN index usable in place of the Pinecone index.
+
+Vectors are L2-normalised (cosine, like `medicalbooks-1536`), clustered with a
+small spherical k-means and stored grouped by cluster (IVF). Every array —
+including the chunk ids and metadata, kept as UTF-8/JSON blobs with offsets —
+is a `.npy` file opened with `mmap_mode="r"`, so resident memory stays bounded
+by the pages queries actually touch. Vectors may be stored as int8 with a
+per-row scale to cut the footprint by 4x.
+
+Import the chunks that were upserted to Pinecone with:
+
+    python vector_store.py import-pinecone medicalbooks-1536
+    python vector_store.py import-jsonl chunks.jsonl --name medicalbooks-1536
+"""
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+
+import numpy as np
+
+from model_artifacts import publish_artifact
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+INDEX_ROOT = os.getenv("LOCAL_INDEX_DIR", os.path.join(BASE_DIR, "vector_index"))
+
+_ARRAYS = ("centroids", "list_offsets", "vectors", "scales", "id_blob", "id_offsets", "meta_blob", "meta_offsets")
+
+
+def _normalize(X: np.ndarray) -> np.ndarray:
+    X = np.asarray(X, dtype=np.float32)
+    norms = np.linalg.norm(X, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return X / norms
+
+
+def pack_blob(items: list[bytes]) -> tuple[np.ndarray, np.ndarray]:
+    """Variable-length records as one uint8 array plus offsets (both mmap-able .npy)."""
+    offsets = np.zeros(len(items) + 1, dtype=np.int64)
+    np.cumsum([len(b) for b in items], out=offsets[1:])
+    return np.frombuffer(b"".join(items), dtype=np.uint8), offsets
+
+
+def blob_item(blob: np.ndarray, offsets: np.ndarray, i: int) -> bytes:
+    return bytes(blob[offsets[i]:offsets[i + 1]])
+
+
+def _kmeans(X: np.ndarray, k: int, iters: int = 15, sample: int = 50000, seed: int = 0) -> np.ndarray:
+    """Spherical k-means on a sample of the (normalised) rows."""
+    rng = np.random.default_rng(seed)
+    if X.shape[0] > sample:
+        X = X[rng.choice(X.shape[0], sample, replace=False)]
+    C = X[rng.choice(X.shape[0], k, replace=False)].copy()
+    for _ in range(iters):
+        assign = np.argmax(X @ C.T, axis=1)
+        for j in range(k):
+            members = X[assign == j]
+            # Re-seed empty clusters from a random row
+            C[j] = members.sum(axis=0) if len(members) else X[rng.integers(X.shape[0])]
+        C = _normalize(C)
+    return C
+
+
+def build_index(out_dir: str, ids: list[str], vectors, metadatas: list[dict], n_lists: int | None = None,
+                quantize: str = "int8", source: str = "", embedding_model: str | None = None) -> None:
+    """Cluster, optionally quantize and write an index directory (replaces any existing one)."""
+    X = _normalize(vectors)
+    n, dim = X.shape
+    if len(ids) != n or len(metadatas) != n:
+        raise ValueError("ids, vectors and metadatas must have the same length")
+    if quantize not in ("int8", "float32"):
+        raise ValueError(f"Unsupported quantization: {quantize}")
+    # ~sqrt(n) lists; small corpora are searched exhaustively through a single list
+    n_lists = n_lists or (1 if n < 2000 else int(np.sqrt(n)))
+    n_lists = max(1, min(n_lists, n))
+
+    centroids = _kmeans(X, n_lists) if n_lists > 1 else np.zeros((1, dim), dtype=np.float32)
+    assign = np.argmax(X @ centroids.T, axis=1) if n_lists > 1 else np.zeros(n, dtype=np.intp)
+    order = np.argsort(assign, kind="stable")
+    list_offsets = np.zeros(n_lists + 1, dtype=np.int64)
+    np.cumsum(np.bincount(assign, minlength=n_lists), out=list_offsets[1:])
+
+    X = X[order]
+    if quantize == "int8":
+        scales = np.abs(X).max(axis=1) / 127.0
+        scales[scales == 0] = 1.0
+        stored = np.round(X / scales[:, None]).astype(np.int8)
+    else:
+        scales = np.ones(n, dtype=np.float32)
+        stored = X
+    id_blob, id_offsets = pack_blob([ids[i].encode() for i in order])
+    meta_blob, meta_offsets = pack_blob([json.dumps(metadatas[i]).encode() for i in order])
+
+    arrays = {
+        "centroids": centroids, "list_offsets": list_offsets, "vectors": stored,
+        "scales": scales.astype(np.float32), "id_blob": id_blob, "id_offsets": id_offsets,
+        "meta_blob": meta_blob, "meta_offsets": meta_offsets,
+    }
+    meta = {
+        "dim": dim, "count": n, "n_lists": n_lists, "quantization": quantize, "metric": "cosine",
+        "source": source, "build_id": f"{int(time.time())}-{n}", "embedding_model": embedding_model,
+    }
+    publish_artifact(out_dir, arrays, meta)
+
+
+class LocalVectorIndex:
+    """Read-only IVF index with a Pinecone-compatible `query()`."""
+
+    def __init__(self, path: str, nprobe: int = 8):
+        with open(os.path.join(path, "meta.json")) as fh:
+            self.meta = json.load(fh)
+        for name in _ARRAYS:
+            setattr(self, name, np.load(os.path.join(path, f"{name}.npy"), mmap_mode="r"))
+        self.path = path
+        self.dim = int(self.meta["dim"])
+        self.nprobe = max(1, int(nprobe))
+        self.build_id = self.meta["build_id"]
+        self.embedding_model = self.meta.get("embedding_model")
+
+    def _id(self, row: int) -> str:
+        return blob_item(self.id_blob, self.id_offsets, row).decode()
+
+    def _metadata(self, row: int) -> dict:
+        return json.loads(blob_item(self.meta_blob, self.meta_offsets, row))
+
+    def search(self, vector, top_k: int = 3, nprobe: int | None = None) -> tuple[np.ndarray, np.ndarray]:
+        """Return (rows, scores) of the best `top_k` matches, best first."""
+        q = _normalize(np.asarray(vector, dtype=np.float32).reshape(-1))
+        if q.shape[0] != self.dim:
+            raise ValueError(f"Query has {q.shape[0]} dims, index expects {self.dim}")
+        n_lists = self.centroids.shape[0]
+        probe = min(nprobe or self.nprobe, n_lists)
+        lists = np.arange(n_lists) if probe == n_lists else np.argpartition(-(self.centroids @ q), probe - 1)[:probe]
+
+        rows, scores = [], []
+        for j in lists:
+            start, end = int(self.list_offsets[j]), int(self.list_offsets[j + 1])
+            if start == end:
+                continue
+            block = self.vectors[start:end]
+            s = (block @ q) if block.dtype == np.float32 else (block.astype(np.float32) @ q) * self.scales[start:end]
+            rows.append(np.arange(start, end))
+            scores.append(s)
+        if not rows:
+            return np.empty(0, dtype=np.intp), np.empty(0, dtype=np.float32)
+        rows, scores = np.concatenate(rows), np.concatenate(scores)
+        k = min(top_k, scores.shape[0])
+        best = np.argpartition(-scores, k - 1)[:k]
+        best = best[np.argsort(-scores[best])]
+        return rows[best], scores[best]
+
+    def query(self, vector=None, top_k: int = 3, include_metadata: bool = False, **kwargs) -> dict:
+        rows, scores = self.search(vector, top_k, kwargs.get("nprobe"))
+        matches = []
+        for row, score in zip(rows.tolist(), scores.tolist()):
+            match = {"id": self._id(row), "score": score}
+            if include_metadata:
+                match["metadata"] = self._metadata(row)
+            matches.append(match)
+        return {"matches": matches}
+
+    def stats(self) -> dict:
+        return {
+            "path": self.path, "count": self.meta["count"], "dim": self.dim, "n_lists": self.meta["n_lists"],
+            "nprobe": self.nprobe, "quantization": self.meta["quantization"], "build_id": self.build_id,
+            "embedding_model": self.embedding_model,
+        }
+
+
+def index_path(name: str) -> str:
+    return os.path.join(INDEX_ROOT, name)
+
+
+def open_local_index(name: str) -> LocalVectorIndex:
+    path = index_path(name)
+    if not os.path.isfile(os.path.join(path, "meta.json")):
+        raise RuntimeError(f"Local vector index not found at {path}; run `python vector_store.py import-pinecone {name}`")
+    return LocalVectorIndex(path, nprobe=int(os.getenv("LOCAL_INDEX_NPROBE", "8")))
+
+
+# ---- Import tools ----
+def _fetch_from_pinecone(name: str, batch: int = 100):
+    from pinecone import Pinecone
+
+    api_key = os.getenv("PINECONE_API_KEY")
+    if not api_key:
+        raise RuntimeError("PINECONE_API_KEY not set")
+    index = Pinecone(api_key=api_key).Index(name)
+    ids, vectors, metadatas = [], [], []
+    # list() pages through every id (serverless indexes); fetch() returns values + metadata
+    for page in index.list(limit=batch):
+        fetched = index.fetch(ids=list(page)).vectors
+        for vid in page:
+            v = fetched.get(vid)
+            if v is None:
+                continue
+            ids.append(v.id)
+            vectors.append(v.values)
+            metadatas.append(dict(v.metadata or {}))
+        logging.info(f"[Index] fetched {len(ids)} vectors from {name}")
+    return ids, vectors, metadatas
+
+
+def _read_jsonl(path: str):
+    """Rows of {"id", "values", "metadata"} — the tuples the notebooks upsert."""
+    ids, vectors, metadatas = [], [], []
+    with open(path) as fh:
+        for line in fh:
+            if line.strip():
+                row = json.loads(line)
+                ids.append(str(row["id"]))
+                vectors.append(row["values"])
+                metadatas.append(row.get("metadata") or {})
+    return ids, vectors, metadatas
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description="Build a local vector index from the RAG chunks")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    p = sub.add_parser("import-pinecone", help="copy every vector and its metadata out of a Pinecone index")
+    p.add_argument("index")
+    p.add_argument("--name", help="local index name (defaults to the Pinecone index name)")
+    p = sub.add_parser("import-jsonl", help="load {id, values, metadata} rows from a JSON lines file")
+    p.add_argument("path")
+    p.add_argument("--name", required=True)
+    for p in sub.choices.values():
+        p.add_argument("--lists", type=int, default=None, help="number of IVF lists (default ~sqrt(n))")
+        p.add_argument("--float32", action="store_true", help="store full-precision vectors instead of int8")
+        p.add_argument("--embedding-model", help="model the vectors came from, e.g. openai:text-embedding-3-small")
+    args = parser.parse_args(argv)
+
+    if args.cmd == "import-pinecone":
+        name, source = args.name or args.index, f"pinecone:{args.index}"
+        ids, vectors, metadatas = _fetch_from_pinecone(args.index)
+    else:
+        name, source = args.name, f"jsonl:{os.path.abspath(args.path)}"
+        ids, vectors, metadatas = _read_jsonl(args.path)
+    if not ids:
+        sys.exit("No vectors to import")
+    build_index(index_path(name), ids, np.asarray(vectors, dtype=np.float32), metadatas,
+                n_lists=args.lists, quantize="float32" if args.float32 else "int8", source=source,
+                embedding_model=args.embedding_model)
+    logging.info(f"[Index] wrote {len(ids)} vectors to {index_path(name)}")
+
+    from lexical_index import build_lexical_index, lexical_index_path
+
+    texts = [m.get("text", "") for m in metadatas]
+    build_lexical_index(lexical_index_path(name), ids, texts)
+    logging.info(f"[Index] wrote BM25 index to {lexical_index_path(name)}")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main()
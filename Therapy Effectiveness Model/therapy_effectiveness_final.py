@@ -1,280 +1,554 @@
-from __future__ import annotations
-
-import os, textwrap, warnings, json, glob
-from typing import Dict, Any, Optional, Tuple
-
-import numpy as np
-import pandas as pd
-import joblib
-import matplotlib.pyplot as plt
-from statsmodels.tsa.statespace.sarimax import SARIMAX
-from statsmodels.tools.sm_exceptions import ValueWarning as SMValueWarning
-from sklearn.compose import ColumnTransformer
-from sklearn.pipeline import Pipeline
-from sklearn.preprocessing import OneHotEncoder, StandardScaler
-from sklearn.ensemble import RandomForestClassifier
-from sklearn.model_selection import train_test_split
-from sklearn.metrics import classification_report, roc_auc_score
-from dotenv import load_dotenv
-
-# Silence non-actionable warnings
-warnings.filterwarnings("ignore", category=SMValueWarning)
-warnings.filterwarnings("ignore", message="Too few observations")
-warnings.filterwarnings("ignore", message="No supported index is available")
-
-# --- Paths ---
-CANDIDATE_CSV = [
-    "/content/therapy_effectiveness_synthetic.csv",
-    "/content/sample_data/therapy_effectiveness_synthetic.csv",
-    "/mnt/data/therapy_effectiveness_synthetic.csv", 
-]
-PIPELINE_PATH = "/content/therapy_effectiveness_final.pkl"
-PLOTS_DIR = "/content/plots"
-os.makedirs(PLOTS_DIR, exist_ok=True)
-
-def _find_csv() -> str:
-    for p in CANDIDATE_CSV:
-        if os.path.exists(p):
-            return p
-    # Last resort: scan content
-    matches = glob.glob("/content/**/*.csv", recursive=True)
-    if matches:
-        return matches[0]
-    raise FileNotFoundError(
-        "CSV not found. Upload 'therapy_effectiveness_synthetic.csv' to /content and re-run."
-    )
-
-CSV_PATH = _find_csv()
-
-# --- Data ---
-def load_dataset(path: str = CSV_PATH) -> pd.DataFrame:
-    df = pd.read_csv(path)
-    for c in ["VisitDate1", "VisitDate2", "VisitDate3"]:
-        if c in df.columns:
-            df[c] = pd.to_datetime(df[c])
-    return df
-
-# --- Model ---
-def build_model(df: pd.DataFrame) -> Pipeline:
-    df_model = df.drop(columns=["Patient_ID", "VisitDate1", "VisitDate2", "VisitDate3"])
-    X = df_model.drop(columns=["Therapy_Effective"])
-    y = df_model["Therapy_Effective"]
-
-    num_cols = X.select_dtypes(include=["int64", "float64"]).columns.tolist()
-    cat_cols = X.select_dtypes(include=["object"]).columns.tolist()
-
-    preprocessor = ColumnTransformer(
-        transformers=[
-            ("num", StandardScaler(), num_cols),
-            ("cat", OneHotEncoder(drop="first", handle_unknown="ignore"), cat_cols),
-        ]
-    )
-    pipe = Pipeline(steps=[
-        ("preprocessor", preprocessor),
-        ("classifier", RandomForestClassifier(n_estimators=200, random_state=42)),
-    ])
-
-    X_train, X_test, y_train, y_test = train_test_split(
-        X, y, test_size=0.25, random_state=42, stratify=y
-    )
-    pipe.fit(X_train, y_train)
-    # Optional metrics - not printed to avoid noise
-    _ = classification_report(y_test, pipe.predict(X_test))
-    _ = roc_auc_score(y_test, pipe.predict_proba(X_test)[:, 1])
-
-    joblib.dump(pipe, PIPELINE_PATH)
-    return pipe
-
-def load_or_train_model(df: pd.DataFrame) -> Pipeline:
-    if os.path.exists(PIPELINE_PATH):
-        try:
-            return joblib.load(PIPELINE_PATH)
-        except Exception:
-            pass
-    return build_model(df)
-
-# --- Effectiveness ---
-def _improvement_ratio(baseline: float, followup: float, direction: str) -> float:
-    if pd.isna(baseline) or pd.isna(followup) or baseline == 0:
-        return 0.0
-    change = followup - baseline
-    if direction == "down":
-        change = -change
-    ratio = change / abs(baseline)
-    return float(np.clip(ratio, -1.0, 1.0))
-
-def compute_effectiveness(df_row: pd.Series) -> dict:
-    comps: Dict[str, float] = {}
-    comps["HbA1c"]    = _improvement_ratio(df_row.get("HbA1c1"), df_row.get("HbA1c3"), "down")
-    comps["FPG"]      = _improvement_ratio(df_row.get("FPG1"),   df_row.get("FPG3"),   "down")
-    comps["BMI"]      = _improvement_ratio(df_row.get("BMI1"),   df_row.get("BMI3"),   "down")
-    comps["SBP"]      = _improvement_ratio(df_row.get("SBP"),    df_row.get("SBP"),    "down")  # single
-    comps["DBP"]      = _improvement_ratio(df_row.get("DBP"),    df_row.get("DBP"),    "down")  # single
-    comps["eGFR"]     = _improvement_ratio(df_row.get("eGFR1"),  df_row.get("eGFR3"),  "up")
-    comps["UACR"]     = _improvement_ratio(df_row.get("UACR1"),  df_row.get("UACR3"),  "down")
-    comps["Distress"] = _improvement_ratio(df_row.get("DDS1"),   df_row.get("DDS3"),   "down")
-
-    weights = {"HbA1c":0.30,"FPG":0.20,"BMI":0.10,"SBP":0.05,"DBP":0.05,"eGFR":0.10,"UACR":0.10,"Distress":0.10}
-    raw = sum(weights[k] * comps[k] for k in weights)
-    score = float(np.clip((raw + 1.0) / 2.0, 0.0, 1.0))
-    label = "Effective" if score >= 0.5 else "Not Effective"
-    return {"score": score, "label": label, "components": comps}
-
-# --- Forecast + Plot ---
-def _coerce_monthly_index(idx_like) -> tuple[pd.DatetimeIndex, str]:
-    idx = pd.DatetimeIndex(idx_like)
-    inferred = pd.infer_freq(idx)
-    if inferred is None:
-        freq = "ME"
-        start = idx.min() if len(idx) else pd.Timestamp("2023-01-31")
-        idx = pd.date_range(start=start, periods=len(idx_like), freq=freq)
-    else:
-        freq = "ME" if inferred.endswith("M") and not inferred.endswith("MS") else inferred
-        if freq.endswith("M") and not freq.endswith("MS"):
-            freq = "ME"
-        idx = pd.date_range(start=idx.min(), periods=len(idx_like), freq=freq)
-    return idx, freq
-
-def forecast_metric(series: pd.Series, steps: int = 2) -> tuple[pd.Series, pd.DataFrame]:
-    series = series.dropna()
-    if series.empty:
-        idx = pd.date_range("2023-03-31", periods=steps, freq="ME")
-        return pd.Series([np.nan]*steps, index=idx), pd.DataFrame({"lower": np.nan, "upper": np.nan}, index=idx)
-
-    idx, freq = _coerce_monthly_index(series.index)
-    series = pd.Series(series.values, index=idx)
-
-    if len(series) < 3:
-        x = np.arange(len(series), dtype=float)
-        a, b = np.polyfit(x, series.values, 1)
-        future_x = np.arange(len(series), len(series) + steps, dtype=float)
-        fc_vals = a * future_x + b
-        fc_idx = pd.date_range(series.index[-1] + pd.tseries.frequencies.to_offset("ME"), periods=steps, freq="ME")
-        fc = pd.Series(fc_vals, index=fc_idx)
-        ci = pd.DataFrame({"lower": np.nan, "upper": np.nan}, index=fc_idx)
-        return fc, ci
-
-    with warnings.catch_warnings():
-        warnings.simplefilter("ignore")
-        model = SARIMAX(series, order=(1,1,1), seasonal_order=(0,0,0,0),
-                        trend="c", enforce_stationarity=False, enforce_invertibility=False)
-        res = model.fit(disp=False)
-        fc = res.get_forecast(steps=steps)
-        ci = fc.conf_int()
-
-    fc_idx = pd.date_range(series.index[-1] + pd.tseries.frequencies.to_offset("ME"), periods=steps, freq="ME")
-    fc_series = pd.Series(np.asarray(fc.predicted_mean), index=fc_idx)
-    ci = pd.DataFrame({"lower": np.asarray(ci.iloc[:, 0]), "upper": np.asarray(ci.iloc[:, 1])}, index=fc_idx)
-    return fc_series, ci
-
-def make_patient_plot(df_row: pd.Series, patient_id: int, out_path: str) -> str:
-    idx = []
-    for c in ["VisitDate1", "VisitDate2", "VisitDate3"]:
-        val = df_row.get(c)
-        idx.append(pd.to_datetime(val) if not pd.isna(val) else None)
-    if any(v is None or pd.isna(v) for v in idx):
-        idx = pd.date_range("2023-01-31", periods=3, freq="ME")
-    idx, _ = _coerce_monthly_index(idx)
-
-    series_hba1c = pd.Series([df_row.get("HbA1c1"), df_row.get("HbA1c2"), df_row.get("HbA1c3")], index=idx)
-    series_fpg   = pd.Series([df_row.get("FPG1"),   df_row.get("FPG2"),   df_row.get("FPG3")], index=idx)
-
-    fc, ci = forecast_metric(series_hba1c, steps=2)
-
-    plt.figure(figsize=(9, 5))
-    plt.plot(series_hba1c, marker="o", label="HbA1c")
-    plt.plot(series_fpg,   marker="o", linestyle="--", label="FPG")
-    plt.plot(fc, marker="x", linestyle="--", label="HbA1c forecast")
-    try:
-        plt.fill_between(ci.index, ci["lower"], ci["upper"], alpha=0.2)
-    except Exception:
-        pass
-    plt.title(f"Patient {patient_id} — Glycemic Trend and Forecast")
-    plt.xlabel("Visit Date"); plt.ylabel("Value")
-    plt.legend(); plt.grid(True); plt.tight_layout()
-    plt.savefig(out_path); plt.close()
-    return out_path
-
-# --- LLM summary (Groq) ---
-def llm_analysis(df_row: pd.Series, eff: dict, forecast_vals: Optional[pd.Series]) -> str:
-    load_dotenv("/mnt/data/therapy_effectiveness_llm.env")  
-    api_key = os.getenv("GROQ_API_KEY")
-
-    hb = [df_row.get("HbA1c1"), df_row.get("HbA1c2"), df_row.get("HbA1c3")]
-    regimen = df_row.get("Regimen1")
-    pred_text = textwrap.dedent(f"""
-    Therapy effectiveness score: {eff['score']:.2f} ({eff['label']}).
-    HbA1c across visits: {', '.join(f"{x:.2f}" for x in hb if not pd.isna(x))}.
-    Forecast HbA1c next visits: {', '.join(f"{x:.2f}" for x in (forecast_vals.values.tolist() if forecast_vals is not None else []) if not pd.isna(x))}.
-    Regimen: {regimen}.
-    """).strip()
-
-    if not api_key:
-        trend = "improving" if eff["components"]["HbA1c"] > 0 else ("worsening" if eff["components"]["HbA1c"] < 0 else "flat")
-        recs = []
-        if eff["score"] < 0.5: recs.append("consider regimen intensification or adherence review")
-        else: recs.append("continue current regimen with monitoring")
-        if df_row.get("SBP", np.nan) >= 140 or df_row.get("DBP", np.nan) >= 90: recs.append("optimize blood pressure control")
-        if df_row.get("UACR3", np.nan) >= 30: recs.append("monitor albuminuria and kidney function")
-        return f"Glycemic trend is {trend}. Overall therapy appears {eff['label'].lower()} (score {eff['score']:.2f}). Recommendation: " + "; ".join(recs) + "."
-
-    try:
-        from groq import Groq
-    except ImportError:
-        return "LLM not enabled: install with `pip install groq` and set GROQ_API_KEY in env"
-
-    try:
-        client = Groq(api_key=api_key)
-        prompt = (
-            "You are a helpful medical assistant.\n"
-            "Summarize the patient's trajectory and give a concise, clinically-relevant recommendation (<120 words).\n\n"
-            + pred_text
-        )
-        chat = client.chat.completions.create(
-            model="llama-3.3-70b-versatile",
-            messages=[
-                {"role": "system", "content": "You are a helpful medical AI assistant."},
-                {"role": "user", "content": prompt},
-            ],
-            temperature=0.2,
-            max_tokens=220,
-        )
-        return chat.choices[0].message.content.strip()
-    except Exception as e:
-        return f"(LLM unavailable) {str(e)}"
-
-# --- Orchestration ---
-def _get_row_by_patient_id(df: pd.DataFrame, patient_id: int):
-    m = df[df["Patient_ID"] == patient_id]
-    return None if m.empty else m.iloc[0]
-
-def run_for_patient_id(patient_id: int) -> Dict[str, Any]:
-    df = load_dataset(CSV_PATH)
-    row = _get_row_by_patient_id(df, patient_id)
-    if row is None:
-        raise ValueError(f"Patient_ID {patient_id} not found")
-
-    pipe = load_or_train_model(df)
-
-    df_model = df.drop(columns=["Patient_ID", "VisitDate1", "VisitDate2", "VisitDate3"])
-    X = df_model.drop(columns=["Therapy_Effective"])
-    row_df = pd.DataFrame([{col: row.get(col, np.nan) for col in X.columns}])[X.columns]
-    model_prob = float(pipe.predict_proba(row_df)[0][1])
-
-    eff = compute_effectiveness(row)
-
-    out_plot = os.path.join(PLOTS_DIR, f"patient_{patient_id}_glycemic_trend.png")
-    fc_vals, _ = forecast_metric(
-        pd.Series([row.get("HbA1c1"), row.get("HbA1c2"), row.get("HbA1c3")],
-                  index=[row.get("VisitDate1"), row.get("VisitDate2"), row.get("VisitDate3")])
-    )
-    plot_path = make_patient_plot(row, int(patient_id), out_plot)
-    summary = llm_analysis(row, eff, fc_vals)
-    return {
-        "patient_id": int(patient_id),
-        "effectiveness": eff,
-        "model_probability": model_prob,
-        "plot_path": plot_path,
-        "summary": summary,
-    }
-
+from __future__ import annotations
+
+import os, sys, time, textwrap, warnings, json, glob, hashlib
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from typing import Dict, Any, Optional, Tuple, Iterable
+
+import numpy as np
+import pandas as pd
+import joblib
+import pyarrow as pa
+import pyarrow.feather as feather
+from statsmodels.tsa.statespace.sarimax import SARIMAX
+from statsmodels.tools.sm_exceptions import ValueWarning as SMValueWarning
+from sklearn.compose import ColumnTransformer
+from sklearn.pipeline import Pipeline
+from sklearn.preprocessing import OneHotEncoder, StandardScaler
+from sklearn.ensemble import RandomForestClassifier
+from sklearn.model_selection import train_test_split
+from sklearn.metrics import classification_report, roc_auc_score
+from dotenv import load_dotenv
+
+# Effectiveness scoring, cohort forecasting and trend plots are shared with the
+# FastAPI service. In Colab, upload effectiveness.py, cohort_forecast.py and
+# trend_plots.py to /content next to the CSV.
+_SERVICE_DIR = os.path.join(os.path.dirname(os.path.abspath(globals().get("__file__", "."))),
+                            "..", "Paitent Management System", "backend", "fastapi")
+for _p in (_SERVICE_DIR, "/content"):
+    if os.path.isfile(os.path.join(_p, "effectiveness.py")) and _p not in sys.path:
+        sys.path.append(_p)
+from effectiveness import effectiveness_records, effectiveness_frame
+from cohort_forecast import forecast_cohort
+from trend_plots import get_renderer, render_plots, trend_spec, trend_plots_dir, patient_plot_name, patient_plot_title
+
+# Silence non-actionable warnings
+warnings.filterwarnings("ignore", category=SMValueWarning)
+warnings.filterwarnings("ignore", message="Too few observations")
+warnings.filterwarnings("ignore", message="No supported index is available")
+
+# --- Paths ---
+CANDIDATE_CSV = [
+    "/content/therapy_effectiveness_synthetic.csv",
+    "/content/sample_data/therapy_effectiveness_synthetic.csv",
+    "/mnt/data/therapy_effectiveness_synthetic.csv", 
+]
+PIPELINE_PATH = "/content/therapy_effectiveness_final.pkl"
+PLOTS_DIR = trend_plots_dir("dataset")  # keyed by the CSV's Patient_ID
+COHORT_OUT_DIR = "/content/cohort_results"
+DATASET_STORE_DIR = "/content/dataset_store"
+os.makedirs(PLOTS_DIR, exist_ok=True)
+
+def _find_csv() -> str:
+    for p in CANDIDATE_CSV:
+        if os.path.exists(p):
+            return p
+    # Last resort: scan content
+    matches = glob.glob("/content/**/*.csv", recursive=True)
+    if matches:
+        return matches[0]
+    raise FileNotFoundError(
+        "CSV not found. Upload 'therapy_effectiveness_synthetic.csv' to /content and re-run."
+    )
+
+CSV_PATH = _find_csv()
+
+# --- Data ---
+def _parse_csv(path: str) -> pd.DataFrame:
+    df = pd.read_csv(path)
+    for c in ["VisitDate1", "VisitDate2", "VisitDate3"]:
+        if c in df.columns:
+            df[c] = pd.to_datetime(df[c])
+    return df
+
+def _file_sha256(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as fh:
+        for block in iter(lambda: fh.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+class PatientStore:
+    """The CSV converted once to an uncompressed Arrow IPC (Feather v2) file, read
+    memory-mapped, plus a Patient_ID -> row table (.npy, also memory-mapped).
+
+    Dense IDs (span <= 4x rows) use a direct-address table, so lookups are O(1);
+    otherwise sorted IDs are binary-searched. The store is rebuilt when the CSV's
+    content hash changes (size/mtime are checked first so unchanged files are not re-hashed).
+    """
+
+    def __init__(self, csv_path: str = CSV_PATH, store_dir: str = DATASET_STORE_DIR):
+        self.csv_path = csv_path
+        stem = os.path.splitext(os.path.basename(csv_path))[0]
+        self.base = os.path.join(store_dir, stem)
+        os.makedirs(store_dir, exist_ok=True)
+        if not self._is_fresh():
+            self._build()
+        with open(self.base + ".meta.json") as fh:
+            self.meta = json.load(fh)
+        # Zero-copy: column buffers are views into the mapped file
+        self.table = pa.ipc.open_file(pa.memory_map(self.base + ".arrow", "r")).read_all()
+        self._index = np.load(self.base + ".index.npy", mmap_mode="r")
+        self._rows = np.load(self.base + ".rows.npy", mmap_mode="r") if self.meta["index"] == "sorted" else None
+
+    def _is_fresh(self) -> bool:
+        try:
+            with open(self.base + ".meta.json") as fh:
+                meta = json.load(fh)
+        except (OSError, ValueError):
+            return False
+        st = os.stat(self.csv_path)
+        if (meta["source_size"], meta["source_mtime_ns"]) == (st.st_size, st.st_mtime_ns):
+            return True
+        if meta["source_sha256"] != _file_sha256(self.csv_path):
+            return False
+        meta["source_size"], meta["source_mtime_ns"] = st.st_size, st.st_mtime_ns  # touched only
+        self._write_json(meta)
+        self.meta = meta
+        return True
+
+    def _write_json(self, meta: dict) -> None:
+        tmp = self.base + ".meta.json.tmp"
+        with open(tmp, "w") as fh:
+            json.dump(meta, fh)
+        os.replace(tmp, self.base + ".meta.json")
+
+    def _write_npy(self, suffix: str, arr: np.ndarray) -> None:
+        tmp = self.base + suffix + ".tmp"
+        with open(tmp, "wb") as fh:
+            np.save(fh, arr)
+        os.replace(tmp, self.base + suffix)
+
+    def _build(self) -> None:
+        st = os.stat(self.csv_path)
+        sha = _file_sha256(self.csv_path)
+        df = _parse_csv(self.csv_path)
+        tmp = self.base + ".arrow.tmp"
+        feather.write_feather(df, tmp, compression="uncompressed")  # compression would defeat mmap
+        os.replace(tmp, self.base + ".arrow")
+
+        ids = df["Patient_ID"].to_numpy(dtype=np.int64)
+        if len(np.unique(ids)) != len(ids):
+            warnings.warn("Duplicate Patient_ID values; lookups return the first row")
+        rows = np.arange(len(ids), dtype=np.int64)
+        lo = int(ids.min()) if len(ids) else 0
+        span = int(ids.max()) - lo + 1 if len(ids) else 0
+        if span <= 4 * max(len(ids), 1):
+            index = np.full(span, -1, dtype=np.int64)
+            index[ids[::-1] - lo] = rows[::-1]  # reversed so the first occurrence wins
+            kind = "dense"
+        else:
+            order = np.argsort(ids, kind="stable")
+            index, kind = ids[order], "sorted"
+            self._write_npy(".rows.npy", rows[order])
+        self._write_npy(".index.npy", index)
+        self._write_json({"source_size": st.st_size, "source_mtime_ns": st.st_mtime_ns, "source_sha256": sha,
+                          "rows": int(len(df)), "index": kind, "min_id": lo})
+
+    @property
+    def columns(self) -> list[str]:
+        return self.table.column_names
+
+    def __len__(self) -> int:
+        return self.table.num_rows
+
+    def row_number(self, patient_id: int) -> Optional[int]:
+        pid = int(patient_id)
+        if self.meta["index"] == "dense":
+            i = pid - self.meta["min_id"]
+            row = int(self._index[i]) if 0 <= i < len(self._index) else -1
+            return row if row >= 0 else None
+        i = int(np.searchsorted(self._index, pid))
+        return int(self._rows[i]) if i < len(self._index) and self._index[i] == pid else None
+
+    def read(self, columns: Optional[list[str]] = None) -> pd.DataFrame:
+        table = self.table.select(columns) if columns is not None else self.table
+        return table.to_pandas()
+
+    def get_row(self, patient_id: int, columns: Optional[list[str]] = None) -> Optional[pd.Series]:
+        row = self.row_number(patient_id)
+        if row is None:
+            return None
+        # Scalar reads from the mapped columns; much cheaper than a one-row to_pandas()
+        values = {}
+        for name in columns if columns is not None else self.columns:
+            col = self.table.column(name)
+            v = col[row].as_py()
+            if pa.types.is_timestamp(col.type):
+                v = pd.Timestamp(v) if v is not None else pd.NaT
+            elif v is None:
+                v = np.nan
+            values[name] = v
+        return pd.Series(values, name=row)
+
+    def get_rows(self, patient_ids: Iterable[int], columns: Optional[list[str]] = None) -> pd.DataFrame:
+        """Rows in the order given; unknown IDs raise ValueError."""
+        pids = [int(p) for p in patient_ids]
+        rows = [self.row_number(p) for p in pids]
+        missing = [p for p, r in zip(pids, rows) if r is None]
+        if missing:
+            raise ValueError(f"Patient_ID(s) not found: {missing[:10]}")
+        table = self.table.take(pa.array(rows, type=pa.int64()))
+        if columns is not None:
+            table = table.select(columns)
+        return table.to_pandas()
+
+_stores: Dict[str, PatientStore] = {}
+
+def get_patient_store(path: str = CSV_PATH) -> PatientStore:
+    store = _stores.get(path)
+    if store is not None:
+        st = os.stat(path)
+        if (store.meta["source_size"], store.meta["source_mtime_ns"]) == (st.st_size, st.st_mtime_ns) or store._is_fresh():
+            return store
+    store = _stores[path] = PatientStore(path)
+    return store
+
+def load_dataset(path: str = CSV_PATH, columns: Optional[list[str]] = None) -> pd.DataFrame:
+    return get_patient_store(path).read(columns)
+
+# --- Model ---
+def build_model(df: pd.DataFrame) -> Pipeline:
+    df_model = df.drop(columns=["Patient_ID", "VisitDate1", "VisitDate2", "VisitDate3"])
+    X = df_model.drop(columns=["Therapy_Effective"])
+    y = df_model["Therapy_Effective"]
+
+    num_cols = X.select_dtypes(include=["int64", "float64"]).columns.tolist()
+    cat_cols = X.select_dtypes(include=["object"]).columns.tolist()
+
+    preprocessor = ColumnTransformer(
+        transformers=[
+            ("num", StandardScaler(), num_cols),
+            ("cat", OneHotEncoder(drop="first", handle_unknown="ignore"), cat_cols),
+        ]
+    )
+    pipe = Pipeline(steps=[
+        ("preprocessor", preprocessor),
+        ("classifier", RandomForestClassifier(n_estimators=200, random_state=42)),
+    ])
+
+    X_train, X_test, y_train, y_test = train_test_split(
+        X, y, test_size=0.25, random_state=42, stratify=y
+    )
+    pipe.fit(X_train, y_train)
+    # Optional metrics - not printed to avoid noise
+    _ = classification_report(y_test, pipe.predict(X_test))
+    _ = roc_auc_score(y_test, pipe.predict_proba(X_test)[:, 1])
+
+    joblib.dump(pipe, PIPELINE_PATH)
+    return pipe
+
+_pipeline: Optional[Pipeline] = None
+
+def load_or_train_model(df: Optional[pd.DataFrame] = None) -> Pipeline:
+    """Pipeline loaded once per process; the dataset is only read if it must be trained."""
+    global _pipeline
+    if _pipeline is None and os.path.exists(PIPELINE_PATH):
+        try:
+            _pipeline = joblib.load(PIPELINE_PATH)
+        except Exception:
+            pass
+    if _pipeline is None:
+        _pipeline = build_model(df if df is not None else load_dataset(CSV_PATH))
+    return _pipeline
+
+_NON_FEATURE_COLS = ["Patient_ID", "VisitDate1", "VisitDate2", "VisitDate3", "Therapy_Effective"]
+
+# --- Effectiveness ---
+def compute_effectiveness(df_row: pd.Series) -> dict:
+    return effectiveness_records(pd.DataFrame([df_row]))[0]
+
+def compute_effectiveness_cohort(df: pd.DataFrame) -> pd.DataFrame:
+    """Score, label and components for every row in one vectorized pass."""
+    return effectiveness_frame(df)
+
+# --- Forecast + Plot ---
+def _coerce_monthly_index(idx_like) -> tuple[pd.DatetimeIndex, str]:
+    idx = pd.DatetimeIndex(idx_like)
+    inferred = pd.infer_freq(idx) if len(idx) >= 3 else None  # infer_freq raises on fewer
+    if inferred is None:
+        freq = "ME"
+        start = idx.min() if len(idx) else pd.Timestamp("2023-01-31")
+        idx = pd.date_range(start=start, periods=len(idx_like), freq=freq)
+    else:
+        freq = "ME" if inferred.endswith("M") and not inferred.endswith("MS") else inferred
+        if freq.endswith("M") and not freq.endswith("MS"):
+            freq = "ME"
+        idx = pd.date_range(start=idx.min(), periods=len(idx_like), freq=freq)
+    return idx, freq
+
+def forecast_metric(series: pd.Series, steps: int = 2) -> tuple[pd.Series, pd.DataFrame]:
+    series = series.dropna()
+    if series.empty:
+        idx = pd.date_range("2023-03-31", periods=steps, freq="ME")
+        return pd.Series([np.nan]*steps, index=idx), pd.DataFrame({"lower": np.nan, "upper": np.nan}, index=idx)
+
+    idx, freq = _coerce_monthly_index(series.index)
+    series = pd.Series(series.values, index=idx)
+
+    if len(series) < 3:
+        x = np.arange(len(series), dtype=float)
+        a, b = np.polyfit(x, series.values, 1)
+        future_x = np.arange(len(series), len(series) + steps, dtype=float)
+        fc_vals = a * future_x + b
+        fc_idx = pd.date_range(series.index[-1] + pd.tseries.frequencies.to_offset("ME"), periods=steps, freq="ME")
+        fc = pd.Series(fc_vals, index=fc_idx)
+        ci = pd.DataFrame({"lower": np.nan, "upper": np.nan}, index=fc_idx)
+        return fc, ci
+
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        model = SARIMAX(series, order=(1,1,1), seasonal_order=(0,0,0,0),
+                        trend="c", enforce_stationarity=False, enforce_invertibility=False)
+        res = model.fit(disp=False)
+        fc = res.get_forecast(steps=steps)
+        ci = fc.conf_int()
+
+    fc_idx = pd.date_range(series.index[-1] + pd.tseries.frequencies.to_offset("ME"), periods=steps, freq="ME")
+    fc_series = pd.Series(np.asarray(fc.predicted_mean), index=fc_idx)
+    ci = pd.DataFrame({"lower": np.asarray(ci.iloc[:, 0]), "upper": np.asarray(ci.iloc[:, 1])}, index=fc_idx)
+    return fc_series, ci
+
+def _patient_series(df_row: pd.Series) -> tuple[pd.Series, pd.Series]:
+    idx = []
+    for c in ["VisitDate1", "VisitDate2", "VisitDate3"]:
+        val = df_row.get(c)
+        idx.append(pd.to_datetime(val) if not pd.isna(val) else None)
+    if any(v is None or pd.isna(v) for v in idx):
+        idx = pd.date_range("2023-01-31", periods=3, freq="ME")
+    idx, _ = _coerce_monthly_index(idx)
+
+    series_hba1c = pd.Series([df_row.get("HbA1c1"), df_row.get("HbA1c2"), df_row.get("HbA1c3")], index=idx)
+    series_fpg   = pd.Series([df_row.get("FPG1"),   df_row.get("FPG2"),   df_row.get("FPG3")], index=idx)
+    return series_hba1c, series_fpg
+
+def make_patient_plot(df_row: pd.Series, patient_id: int, out_path: str,
+                      forecast: Optional[tuple[pd.Series, pd.DataFrame]] = None) -> str:
+    series_hba1c, series_fpg = _patient_series(df_row)
+    # Pass forecast=(fc, ci) from forecast_metric to avoid fitting twice
+    fc, ci = forecast if forecast is not None else forecast_metric(series_hba1c, steps=2)
+    # Skips drawing when out_path already holds a plot of exactly this data
+    get_renderer().render(trend_spec(series_hba1c, series_fpg, fc, ci, patient_plot_title(patient_id)), out_path)
+    return out_path
+
+def _forecast_index(series: pd.Series, steps: int) -> pd.DatetimeIndex:
+    """Dates forecast_metric assigns to the forecasts of `series`."""
+    series = series.dropna()
+    if series.empty:
+        return pd.date_range("2023-03-31", periods=steps, freq="ME")
+    idx, _ = _coerce_monthly_index(series.index)
+    return pd.date_range(idx[-1] + pd.tseries.frequencies.to_offset("ME"), periods=steps, freq="ME")
+
+def _cohort_row_forecast(fcs, i: int, series_hba1c: pd.Series) -> tuple[pd.Series, pd.DataFrame]:
+    """Row i of a forecast_cohort result as the (fc, ci) pair forecast_metric returns."""
+    fc_idx = _forecast_index(series_hba1c, fcs.mean.shape[1])
+    fc = pd.Series(fcs.mean[i], index=fc_idx)
+    ci = pd.DataFrame({"lower": fcs.lower[i], "upper": fcs.upper[i]}, index=fc_idx)
+    return fc, ci
+
+def render_cohort_plots(patient_ids: Optional[Iterable[int]] = None, workers: Optional[int] = None,
+                        force: bool = False, steps: int = 2) -> dict:
+    """Trend plots for many patients: forecasts for all rows in one vectorized pass,
+    rendering on a process pool, unchanged plots skipped."""
+    store = get_patient_store(CSV_PATH)
+    df = store.read() if patient_ids is None else store.get_rows(sorted(set(int(p) for p in patient_ids)))
+    fcs = forecast_cohort(df[["HbA1c1", "HbA1c2", "HbA1c3"]].to_numpy(dtype=float), steps=steps)
+    jobs = []
+    for i, (_, row) in enumerate(df.iterrows()):
+        patient_id = int(row["Patient_ID"])
+        series_hba1c, series_fpg = _patient_series(row)
+        fc, ci = _cohort_row_forecast(fcs, i, series_hba1c)
+        jobs.append((trend_spec(series_hba1c, series_fpg, fc, ci, patient_plot_title(patient_id)),
+                     os.path.join(PLOTS_DIR, patient_plot_name(patient_id))))
+    return render_plots(jobs, workers=workers, force=force)
+
+# --- LLM summary (Groq) ---
+def llm_analysis(df_row: pd.Series, eff: dict, forecast_vals: Optional[pd.Series]) -> str:
+    load_dotenv("/mnt/data/therapy_effectiveness_llm.env")  
+    api_key = os.getenv("GROQ_API_KEY")
+
+    hb = [df_row.get("HbA1c1"), df_row.get("HbA1c2"), df_row.get("HbA1c3")]
+    regimen = df_row.get("Regimen1")
+    pred_text = textwrap.dedent(f"""
+    Therapy effectiveness score: {eff['score']:.2f} ({eff['label']}).
+    HbA1c across visits: {', '.join(f"{x:.2f}" for x in hb if not pd.isna(x))}.
+    Forecast HbA1c next visits: {', '.join(f"{x:.2f}" for x in (forecast_vals.values.tolist() if forecast_vals is not None else []) if not pd.isna(x))}.
+    Regimen: {regimen}.
+    """).strip()
+
+    if not api_key:
+        trend = "improving" if eff["components"]["HbA1c"] > 0 else ("worsening" if eff["components"]["HbA1c"] < 0 else "flat")
+        recs = []
+        if eff["score"] < 0.5: recs.append("consider regimen intensification or adherence review")
+        else: recs.append("continue current regimen with monitoring")
+        if df_row.get("SBP", np.nan) >= 140 or df_row.get("DBP", np.nan) >= 90: recs.append("optimize blood pressure control")
+        if df_row.get("UACR3", np.nan) >= 30: recs.append("monitor albuminuria and kidney function")
+        return f"Glycemic trend is {trend}. Overall therapy appears {eff['label'].lower()} (score {eff['score']:.2f}). Recommendation: " + "; ".join(recs) + "."
+
+    try:
+        from groq import Groq
+    except ImportError:
+        return "LLM not enabled: install with `pip install groq` and set GROQ_API_KEY in env"
+
+    try:
+        client = Groq(api_key=api_key)
+        prompt = (
+            "You are a helpful medical assistant.\n"
+            "Summarize the patient's trajectory and give a concise, clinically-relevant recommendation (<120 words).\n\n"
+            + pred_text
+        )
+        chat = client.chat.completions.create(
+            model="llama-3.3-70b-versatile",
+            messages=[
+                {"role": "system", "content": "You are a helpful medical AI assistant."},
+                {"role": "user", "content": prompt},
+            ],
+            temperature=0.2,
+            max_tokens=220,
+        )
+        return chat.choices[0].message.content.strip()
+    except Exception as e:
+        return f"(LLM unavailable) {str(e)}"
+
+# --- Orchestration ---
+def _get_row_by_patient_id(patient_id: int):
+    return get_patient_store(CSV_PATH).get_row(patient_id)
+
+def run_for_patient_id(patient_id: int) -> Dict[str, Any]:
+    row = _get_row_by_patient_id(patient_id)
+    if row is None:
+        raise ValueError(f"Patient_ID {patient_id} not found")
+
+    pipe = load_or_train_model()
+
+    feature_cols = [c for c in get_patient_store(CSV_PATH).columns if c not in _NON_FEATURE_COLS]
+    row_df = pd.DataFrame([{col: row.get(col, np.nan) for col in feature_cols}])[feature_cols]
+    model_prob = float(pipe.predict_proba(row_df)[0][1])
+
+    eff = compute_effectiveness(row)
+
+    out_plot = os.path.join(PLOTS_DIR, patient_plot_name(patient_id))
+    series_hba1c, _ = _patient_series(row)
+    fc_vals, ci = forecast_metric(series_hba1c)
+    plot_path = make_patient_plot(row, int(patient_id), out_plot, forecast=(fc_vals, ci))
+    summary = llm_analysis(row, eff, fc_vals)
+    return {
+        "patient_id": int(patient_id),
+        "effectiveness": eff,
+        "model_probability": model_prob,
+        "plot_path": plot_path,
+        "summary": summary,
+    }
+
+# --- Cohort batch ---
+def _cohort_worker_init() -> None:
+    warnings.filterwarnings("ignore", category=SMValueWarning)
+
+def _cohort_patient_job(row: pd.Series, eff: dict, forecast: tuple[pd.Series, pd.DataFrame],
+                        with_summary: bool, plots_dir: str) -> Dict[str, Any]:
+    """Plot and (optionally) summarize one patient from its precomputed forecast; runs in a worker process."""
+    patient_id = int(row["Patient_ID"])
+    fc, ci = forecast
+    out = {"patient_id": patient_id, "plot_path": None, "summary": None, "error": None}
+    for i in range(len(fc)):
+        out[f"forecast_hba1c_{i + 1}"] = float(fc.iloc[i])
+        out[f"forecast_lower_{i + 1}"] = float(ci["lower"].iloc[i])
+        out[f"forecast_upper_{i + 1}"] = float(ci["upper"].iloc[i])
+    try:
+        out_plot = os.path.join(plots_dir, patient_plot_name(patient_id))
+        out["plot_path"] = make_patient_plot(row, patient_id, out_plot, forecast=(fc, ci))
+        if with_summary:
+            out["summary"] = llm_analysis(row, eff, fc)
+    except Exception as e:
+        out["error"] = f"{type(e).__name__}: {e}"
+    return out
+
+def _completed_patient_ids(out_dir: str) -> set:
+    done = set()
+    for part in sorted(glob.glob(os.path.join(out_dir, "part-*.parquet"))):
+        res = pd.read_parquet(part, columns=["patient_id", "error"])
+        done.update(res.loc[res["error"].isna(), "patient_id"].astype(int).tolist())
+    return done
+
+def _write_part(out_dir: str, rows: list) -> str:
+    # Timestamp first so sorted() stays chronological; the pid keeps concurrent runs apart
+    path = os.path.join(out_dir, f"part-{time.time_ns():020d}-{os.getpid()}.parquet")
+    tmp = path + ".tmp"
+    pd.DataFrame(rows).to_parquet(tmp, index=False)
+    os.replace(tmp, path)  # a crash mid-write never leaves a half part behind
+    return path
+
+def load_cohort_results(out_dir: str = COHORT_OUT_DIR) -> pd.DataFrame:
+    parts = sorted(glob.glob(os.path.join(out_dir, "part-*.parquet")))
+    if not parts:
+        return pd.DataFrame()
+    res = pd.concat([pd.read_parquet(p) for p in parts], ignore_index=True)
+    # A patient retried after an error appears again in a later part; keep the latest
+    return res.drop_duplicates("patient_id", keep="last").reset_index(drop=True)
+
+def run_for_cohort(patient_ids: Optional[Iterable[int]] = None, out_dir: str = COHORT_OUT_DIR,
+                   workers: Optional[int] = None, with_summary: bool = False,
+                   flush_every: int = 100, resume: bool = True, steps: int = 2) -> pd.DataFrame:
+    """run_for_patient_id over many patients: data and model are loaded once, the
+    model scores every row in one predict_proba call, HbA1c is forecast for every
+    row in one forecast_cohort pass, and plot / summary run on a process pool. Results are appended to `out_dir` as Parquet parts every
+    `flush_every` patients; with resume=True patients already written are skipped.
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    store = get_patient_store(CSV_PATH)
+    df = store.read() if patient_ids is None else store.get_rows(sorted(set(int(p) for p in patient_ids)))
+    if resume:
+        df = df[~df["Patient_ID"].isin(_completed_patient_ids(out_dir))]
+    if df.empty:
+        return load_cohort_results(out_dir)
+
+    pipe = load_or_train_model()
+    X = df.drop(columns=_NON_FEATURE_COLS)
+    probs = pipe.predict_proba(X)[:, 1]
+    effs = effectiveness_records(df)
+    fcs = forecast_cohort(df[["HbA1c1", "HbA1c2", "HbA1c3"]].to_numpy(dtype=float), steps=steps)
+
+    workers = workers or max(1, (os.cpu_count() or 2) - 1)
+    max_in_flight = workers * 4  # bounds memory and keeps results flowing to disk
+    pending, buffer = {}, []
+    rows = zip(range(len(df)), df.iterrows(), probs, effs)
+
+    def record(fut):
+        prob, eff = pending.pop(fut)
+        out = fut.result()
+        out["model_probability"] = float(prob)
+        out["effectiveness_score"] = eff["score"]
+        out["effectiveness_label"] = eff["label"]
+        for k, v in eff["components"].items():
+            out[f"component_{k}"] = v
+        buffer.append(out)
+        if len(buffer) >= flush_every:
+            _write_part(out_dir, buffer)
+            buffer.clear()
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=_cohort_worker_init) as pool:
+        for i, (_, row), prob, eff in rows:
+            if len(pending) >= max_in_flight:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for fut in done:
+                    record(fut)
+            forecast = _cohort_row_forecast(fcs, i, _patient_series(row)[0])
+            fut = pool.submit(_cohort_patient_job, row, eff, forecast, with_summary, PLOTS_DIR)
+            pending[fut] = (prob, eff)
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for fut in done:
+                record(fut)
+    if buffer:
+        _write_part(out_dir, buffer)
+    return load_cohort_results(out_dir)
+